@@ -40,11 +40,13 @@ def main():
     parser.add_argument('--verbose', '-v', action='store_true', dest='verbose', help="Show lots of output, useful for debugging")
     parser.add_argument('--sync', action='store_true', dest='sync', help="Sync all keylists without loading the GUI")
     parser.add_argument('--force', action='store_true', dest='force', help="If syncing without the GUI, force sync again even if it has synced recently")
+    parser.add_argument('--daemon', action='store_true', dest='daemon', help="Keep running without the GUI, syncing keylists whenever they're due")
     args = parser.parse_args()
 
     verbose = args.verbose
     sync = args.sync
     force = args.force
+    daemon = args.daemon
 
     # Create the common object
     common = Common(verbose)
@@ -54,6 +56,11 @@ def main():
         from . import cli
         cli.sync(common, force)
 
+    # If we want to keep syncing keylists in the background
+    elif daemon:
+        from . import cli
+        cli.daemon(common)
+
     else:
         # Otherwise, start the GUI
         from . import gui
@@ -19,22 +19,15 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import queue
-import threading
 import time
+import datetime
 import sys
-from .keylist import Keylist, RefresherMessageQueue
-
-
-def worker(common, keylist, force, status):
-    """
-    Sync a single keylist, to be run in a separate thread
-    """
-    cancel_q = queue.Queue()
-
-    result = Keylist.refresh(common, cancel_q, keylist, force=force)
-    keylist.interpret_result(result)
-
-    status[keylist.id]['result'] = result
+import signal
+import socket
+import select
+import concurrent.futures
+from .keylist import RefresherMessageQueue
+from .scheduler import Scheduler
 
 
 def sync(common, force=False):
@@ -65,14 +58,14 @@ def sync(common, force=False):
         print("[{}] Keylist {}, with authority key {}".format(i, keylist.url.decode(), keylist.fingerprint.decode()))
     print("")
 
-    # Start threads
-    threads = []
+    # Keep track of how many gpg processes this sync spawns
+    process_count = common.gpg.process_count
+
+    # Queue up all keylists in the shared sync pool
+    futures = {}
     for keylist in common.settings.keylists:
         keylist.q = RefresherMessageQueue()
-
-        t = threading.Thread(target=worker, args=(common, keylist, force, status,))
-        threads.append(t)
-        t.start()
+        futures[keylist.id] = common.sync_pool.submit(keylist, queue.Queue(), force)
 
     # Monitor queues for updates
     while True:
@@ -91,7 +84,10 @@ def sync(common, force=False):
             if not status[id]['event']:
                 status[id]['str'] = '[{0:d}] Syncing...'.format(status[id]['index'])
             else:
-                percent = (status[id]['event']['current_key'] / status[id]['event']['total_keys']) * 100;
+                if status[id]['event']['total_keys'] == 0:
+                    percent = 100
+                else:
+                    percent = (status[id]['event']['current_key'] / status[id]['event']['total_keys']) * 100;
                 status[id]['str'] = '[{0:d}] {1:d}/{2:d} ({3:d}%)'.format(
                     status[id]['index'],
                     status[id]['event']['current_key'],
@@ -99,6 +95,13 @@ def sync(common, force=False):
                     int(percent))
         sys.stdout.write('{}          \r'.format('    '.join([status[id]['str'] for id in ids])))
 
+        # Collect the results of keylists that finished syncing
+        for id in ids:
+            if not status[id]['result'] and futures[id].done():
+                result = futures[id].result()
+                status[id]['keylist'].interpret_result(result)
+                status[id]['result'] = result
+
         # Are all keylists finished syncing?
         done = True
         for id in ids:
@@ -112,25 +115,167 @@ def sync(common, force=False):
             # Wait a bit before checking for updates again
             time.sleep(1)
 
-    # Make sure all threads are finished
-    for t in threads:
-        t.join()
+    common.log("cli", "sync", "spawned {} gpg processes".format(common.gpg.process_count - process_count))
+    common.settings.flush()
 
     # Display the results
     for id in ids:
-        result = status[id]['result']
-        keylist = status[id]['keylist']
+        print("[{0:d}] {1:s}".format(status[id]['index'], describe_result(status[id]['result'], status[id]['keylist'])))
+
+
+def describe_result(result, keylist):
+    if result['type'] == 'success':
+        message = "Sync successful."
+
+        key_changes = (result.get('data') or {}).get('key_changes')
+        if key_changes:
+            message += " Keys: {0:d} new, {1:d} updated, {2:d} unchanged.".format(
+                key_changes['new'], key_changes['updated'], key_changes['unchanged'])
+
+        if keylist.warning:
+            message += " Warning: {0:s}".format(keylist.warning)
+        return message
+    elif result['type'] == 'error':
+        return "Sync failed. Error: {0:s}".format(keylist.error)
+    elif result['type'] == 'cancel':
+        return "Sync canceled."
+    elif result['type'] == 'skip':
+        return "Sync skipped. (Use --force to force syncing.)"
+    else:
+        return "Unknown problem with sync."
+
+
+class Daemon(object):
+    """
+    Keeps running without the GUI, syncing each keylist when it's due. HTTP
+    sessions and the keyring index stay warm between syncs. SIGHUP reloads
+    the settings, and SIGTERM (or Ctrl-C) cancels any syncs and shuts down.
+    """
+    def __init__(self, common):
+        self.c = common
+        self.scheduler = Scheduler(common)
+
+        self.reload_requested = False
+        self.stop_requested = False
+
+        # Maps keylists that are syncing to their (future, cancel_q)
+        self.running = {}
+
+        # Signal handlers and finished syncs wake up the main loop by writing
+        # to this socket, which is safe to do from a signal handler
+        self.wakeup_r, self.wakeup_w = socket.socketpair()
+        self.wakeup_w.setblocking(False)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self.handle_reload)
+
+        self.log("GPG Sync {} daemon started, {} keylists".format(self.c.version, len(self.c.settings.keylists)))
 
-        if result['type'] == 'success':
-            if keylist.warning:
-                print("[{0:d}] Sync successful. Warning: {1:s}".format(status[id]['index'], keylist.warning))
+        while not self.stop_requested:
+            self.reap()
+
+            # Only reload once nothing is syncing, so finished syncs don't
+            # save old keylists over the new settings
+            if self.reload_requested and not self.running:
+                self.reload()
+            if not self.reload_requested:
+                for keylist in self.scheduler.due_keylists(self.c.settings.keylists):
+                    self.start(keylist)
+
+            if self.reload_requested and self.running:
+                self.sleep(None)
             else:
-                print("[{0:d}] Sync successful.".format(status[id]['index']))
-        elif result['type'] == 'error':
-            print("[{0:d}] Sync failed. Error: {1:s}".format(status[id]['index'], keylist.error))
-        elif result['type'] == 'cancel':
-            print("[{0:d}] Sync canceled.".format(status[id]['index']))
-        elif result['type'] == 'skip':
-            print("[{0:d}] Sync skipped. (Use --force to force syncing.)".format(status[id]['index']))
-        else:
-            print("[{0:d}] Unknown problem with sync.".format(status[id]['index']))
+                self.sleep(self.scheduler.seconds_until_next_sync(self.c.settings.keylists))
+
+        self.shutdown()
+
+    def start(self, keylist):
+        if keylist in self.running:
+            return
+
+        keylist.syncing = True
+        keylist.q = RefresherMessageQueue()
+        cancel_q = queue.Queue()
+        future = self.c.sync_pool.submit(keylist, cancel_q)
+        future.add_done_callback(lambda future: self.wake())
+        self.running[keylist] = (future, cancel_q)
+
+    def reap(self):
+        for keylist, (future, cancel_q) in list(self.running.items()):
+            if future.done():
+                del self.running[keylist]
+                keylist.syncing = False
+                try:
+                    result = future.result()
+                except Exception as e:
+                    self.log("Keylist {}: Sync crashed: {}".format(keylist.url.decode(), e))
+                    self.scheduler.record_result(keylist, keylist.result_object('error'))
+                    continue
+                keylist.interpret_result(result)
+                self.scheduler.record_result(keylist, result)
+                self.log("Keylist {}: {}".format(keylist.url.decode(), describe_result(result, keylist)))
+
+    def reload(self):
+        self.log("Reloading settings")
+        http_pool_size = self.c.settings.http_pool_size
+        self.c.settings.flush()
+        self.c.settings.load()
+        self.reload_requested = False
+
+        # Only throw away the pooled sessions if they need to be resized
+        if self.c.settings.http_pool_size != http_pool_size:
+            self.c.sessions.close()
+
+        # The network might have changed too
+        self.c.connectivity.invalidate()
+
+        self.log("{} keylists".format(len(self.c.settings.keylists)))
+
+    def shutdown(self):
+        self.log("Shutting down")
+        for keylist, (future, cancel_q) in self.running.items():
+            cancel_q.put(True)
+        concurrent.futures.wait([future for future, cancel_q in self.running.values()])
+        self.reap()
+        self.c.settings.flush()
+
+        self.c.sessions.close()
+        self.wakeup_r.close()
+        self.wakeup_w.close()
+
+    def handle_reload(self, signum, frame):
+        self.reload_requested = True
+        self.wake()
+
+    def handle_stop(self, signum, frame):
+        self.stop_requested = True
+        self.wake()
+
+    def wake(self):
+        try:
+            self.wakeup_w.send(b'\0')
+        except OSError:
+            # The socket buffer is full, so the main loop is getting woken anyway
+            pass
+
+    def sleep(self, seconds):
+        """
+        Sleep until woken up, or for this many seconds (forever if None).
+        """
+        readable, _, _ = select.select([self.wakeup_r], [], [], seconds)
+        if readable:
+            self.wakeup_r.recv(4096)
+
+    def log(self, msg):
+        print("[{}] {}".format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), msg))
+        sys.stdout.flush()
+
+
+def daemon(common):
+    """
+    Keep syncing keylists as they become due, until SIGTERM.
+    """
+    Daemon(common).run()
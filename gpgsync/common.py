@@ -19,18 +19,29 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import datetime
+import time
 import os
 import sys
 import re
 import platform
 import inspect
+import tempfile
 import requests
-import socket
 from urllib.parse import urlparse
 from packaging.version import parse
 
-from .gnupg import GnuPG, NotFoundOnKeyserver, KeyserverError
+from . import openpgp
+from .gnupg import GnuPG, NotFoundOnKeyserver, KeyserverError, RateLimited
 from .settings import Settings
+from .sessions import SessionManager
+from .state_db import StateDB
+from .http_cache import HTTPCache
+from .sync_state import SyncState
+from .fetch_coordinator import FetchCoordinator
+from .connectivity import ConnectivityMonitor
+from .rate_limiter import RateLimiter
+from .keyserver_health import KeyserverHealth
+from .sync_pool import SyncPool
 
 
 class Common(object):
@@ -50,6 +61,34 @@ class Common(object):
         # Load settings
         self.settings = Settings(self)
 
+        # Pooled HTTP sessions, shared by all keylists
+        self.sessions = SessionManager(self)
+
+        # Per-key and per-keylist state
+        self.state_db = StateDB(self, self.settings.get_appdata_path())
+        self.state_db.load_keylist_status(self.settings)
+
+        # Validators and bodies of downloaded keylists and signatures
+        self.http_cache = HTTPCache(self, self.state_db)
+
+        # When each key was last fetched, for incremental syncs
+        self.sync_state = SyncState(self, self.state_db)
+
+        # Shares key downloads between keylists that sync at the same time
+        self.fetch_coordinator = FetchCoordinator(self)
+
+        # Shared, cached checks for whether the internet is reachable
+        self.connectivity = ConnectivityMonitor(self)
+
+        # Paces requests to keys.openpgp.org
+        self.rate_limiter = RateLimiter(self)
+
+        # Retries and circuit breakers for keyservers
+        self.keyserver_health = KeyserverHealth(self)
+
+        # Keylists sync in this shared pool of threads
+        self.sync_pool = SyncPool(self)
+
         # Initialize GnuPG
         self.gpg = GnuPG(self, appdata_path=self.settings.get_appdata_path())
 
@@ -117,7 +156,7 @@ class Common(object):
         resource_path = os.path.join(prefix, filename)
         return resource_path
 
-    def requests_get(self, url, proxies=None):
+    def requests_get(self, url, proxies=None, headers=None, deadline=None):
         # When creating an OSX app bundle, the requests module can't seem to find
         # the location of cacerts.pem. Here's a hack to let it know where it is.
         # https://stackoverflow.com/questions/17158529/fixing-ssl-certificate-error-in-exe-compiled-with-py2exe-or-pyinstaller
@@ -128,9 +167,43 @@ class Common(object):
                 verify = os.path.join(os.path.dirname(sys.executable), 'certifi/cacert.pem')
             else:
                 verify = None
-            return requests.get(url, proxies=proxies, verify=verify)
         else:
-            return requests.get(url, proxies=proxies)
+            verify = None
+
+        session = self.sessions.get_session(proxies, verify)
+        kwargs = {'headers': headers, 'proxies': proxies}
+        if verify is not None:
+            kwargs['verify'] = verify
+
+        if deadline is None:
+            return session.get(url, timeout=(self.settings.connect_timeout, self.settings.read_timeout), **kwargs)
+
+        # The request can't take longer than the sync has left, and stops
+        # downloading as soon as the sync is canceled. It runs in this thread,
+        # so callers are done with it (and its connection) when this returns.
+        r = session.get(url, timeout=deadline.timeout(), stream=True, **kwargs)
+        r._content = deadline.download(r)
+        return r
+
+    def write_file_atomic(self, filename, data):
+        """
+        Write data (bytes) to a temp file next to filename, sync it to disk,
+        and rename it over filename. Readers see either the old file or the
+        new one, never a half-written file, even after a crash.
+        """
+        fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename), prefix='.{}.'.format(os.path.basename(filename)), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_filename, filename)
+        except:
+            try:
+                os.remove(tmp_filename)
+            except OSError:
+                pass
+            raise
 
     def serialize_settings(self, o):
         if isinstance(o, bytes):
@@ -138,17 +211,10 @@ class Common(object):
         if isinstance(o, datetime.datetime):
             return o.isoformat()
 
-    def internet_available(self):
-        try:
-            host = socket.gethostbyname("www.example.com")
-            s = socket.create_connection((host, 80), 2)
-            return True
-        except:
-            pass
-
-        return False
+    def internet_available(self, use_proxy=False, proxy_host=None, proxy_port=None):
+        return self.connectivity.is_available(use_proxy, proxy_host, proxy_port)
 
-    def vks_get_by_fingerprint(self, fp, use_proxy, proxy_host, proxy_port):
+    def vks_get_by_fingerprint(self, fp, use_proxy, proxy_host, proxy_port, deadline=None):
         """
         Download a public key from keys.openssl.org using the VKS interface:
         https://keys.openpgp.org/about/api
@@ -165,28 +231,47 @@ class Common(object):
             api_endpoint = 'https://keys.openpgp.org/vks/v1'
             proxies = None
 
-        # Fetch the key by fingerprint
-        r = self.requests_get("{}/by-fingerprint/{}".format(api_endpoint, fp), proxies)
-        self.log("Common", "vks_get_by_fingerprint", "{} GET /by-fingerprint/{}".format(r.status_code, fp))
-
-        if r.status_code == 404:
-            raise NotFoundOnKeyserver(fp)
-        if r.status_code != 200:
-            raise KeyserverError("keys.openpgp.org: {}".format(r.text))
-
-        pubkey = r.content
-
-        # Verify the fingerprint of the public key
-        out, _ = self.gpg._gpg(['--with-colons', '--with-fingerprint'], pubkey)
-        verified = False
-        returned_fp = 'n/a'
-        for line in out.split(b'\n'):
-            if line.startswith(b'fpr:'):
-                returned_fp = line.split(b':')[-2].decode()
-                if returned_fp == fp:
-                    verified = True
+        # Fetch the key by fingerprint, as fast as the endpoint allows
+        limiter = self.rate_limiter.get(api_endpoint)
+
+        def get():
+            limiter.acquire(deadline)
+            start = time.monotonic()
+            try:
+                r = self.requests_get("{}/by-fingerprint/{}".format(api_endpoint, fp), proxies, deadline=deadline)
+            except requests.exceptions.RequestException as e:
+                limiter.release()
+                raise KeyserverError("keys.openpgp.org: {}".format(e))
+            except:
+                limiter.release()
+                raise
+            self.log("Common", "vks_get_by_fingerprint", "{} GET /by-fingerprint/{}".format(r.status_code, fp))
+
+            if r.status_code == 429:
+                limiter.release(retry_after=r.headers.get('Retry-After'), rate_limited=True)
+                raise RateLimited("keys.openpgp.org: rate limited")
+            limiter.release(latency=time.monotonic() - start)
+
+            if r.status_code == 404:
+                raise NotFoundOnKeyserver(fp)
+            if r.status_code != 200:
+                raise KeyserverError("keys.openpgp.org: {}".format(r.text))
+
+            return r.content
+
+        # Retry if the keyserver fails, and fail fast while it's down
+        pubkey = self.keyserver_health.call(api_endpoint, get, deadline=deadline)
+
+        # Verify the fingerprint of the public key. The server should return
+        # exactly one key, and it should be the one we asked for
+        try:
+            keys = openpgp.parse_public_keys(pubkey)
+        except openpgp.OpenPGPError as e:
+            self.log("Common", "vks_get_by_fingerprint", "ERROR: pubkey returned by server can't be parsed, {}".format(e))
+            return None
 
-        if verified:
+        returned_fp = keys[0].fingerprint if keys else 'n/a'
+        if len(keys) == 1 and fp in keys[0].fingerprints():
             # Return the ASCII-armored public key, in bytes
             return pubkey
 
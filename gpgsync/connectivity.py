@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+GPG Sync
+Helps users have up-to-date public keys for everyone in their organization
+https://github.com/firstlookmedia/gpgsync
+Copyright (C) 2016 First Look Media
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import time
+import socket
+import threading
+import socks
+
+
+class ConnectivityMonitor(object):
+    """
+    Checks whether the internet is reachable, by connecting to
+    settings.connectivity_probe (a host:port), through the Tor proxy if the
+    keylist uses one. Results are cached for a little while and shared by
+    every keylist, and keylists that check at the same time share a single
+    probe.
+    """
+    TTL = 60
+    OFFLINE_TTL = 15
+
+    def __init__(self, common):
+        self.c = common
+        self.lock = threading.Lock()
+
+        # Maps (probe, proxy) to (available, checked_at)
+        self.results = {}
+
+        # Maps (probe, proxy) to a lock held while probing
+        self.probe_locks = {}
+
+    def is_available(self, use_proxy=False, proxy_host=None, proxy_port=None):
+        probe = self.c.settings.connectivity_probe
+        proxy = (proxy_host, proxy_port) if use_proxy else None
+        key = (probe, proxy)
+
+        with self.lock:
+            probe_lock = self.probe_locks.setdefault(key, threading.Lock())
+
+        with probe_lock:
+            with self.lock:
+                cached = self.results.get(key)
+            if cached is not None:
+                available, checked_at = cached
+                ttl = self.TTL if available else self.OFFLINE_TTL
+                if time.monotonic() - checked_at < ttl:
+                    return available
+
+            available = self.probe(probe, proxy)
+            self.c.log("ConnectivityMonitor", "is_available", "probe={}, proxy={}, available={}".format(probe, proxy, available))
+            with self.lock:
+                self.results[key] = (available, time.monotonic())
+            return available
+
+    def invalidate(self):
+        with self.lock:
+            self.results = {}
+
+    def probe(self, probe, proxy):
+        host, _, port = probe.rpartition(':')
+        if not host or not port.isdigit():
+            host, port = probe, '80'
+        timeout = float(self.c.settings.connect_timeout)
+
+        try:
+            if proxy:
+                # Let the proxy resolve the hostname, so DNS doesn't leak
+                # outside of Tor
+                proxy_host, proxy_port = [p.decode() if isinstance(p, bytes) else p for p in proxy]
+                s = socks.create_connection((host, int(port)), timeout=timeout,
+                    proxy_type=socks.SOCKS5, proxy_addr=proxy_host, proxy_port=int(proxy_port), proxy_rdns=True)
+            else:
+                s = socket.create_connection((host, int(port)), timeout)
+            s.close()
+            return True
+        except:
+            return False
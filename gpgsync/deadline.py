@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+GPG Sync
+Helps users have up-to-date public keys for everyone in their organization
+https://github.com/firstlookmedia/gpgsync
+Copyright (C) 2016 First Look Media
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import time
+import subprocess
+
+
+class SyncCanceled(Exception):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline(object):
+    """
+    Bounds how long a single sync can take. Network requests that run under
+    a deadline time out when it does, and stop downloading as soon as the
+    sync gets canceled (by pushing onto cancel_q) or runs out of time. gpg
+    subprocesses get killed. Either way the sync doesn't only notice between
+    keys.
+    """
+    POLL_INTERVAL = 0.1
+
+    # How much of a response body to read between checks
+    DOWNLOAD_CHUNK_SIZE = 16384
+
+    def __init__(self, common, cancel_q, seconds=None):
+        self.c = common
+        self.cancel_q = cancel_q
+
+        if seconds is None:
+            seconds = 60*float(self.c.settings.sync_timeout_minutes)
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def canceled(self):
+        return self.cancel_q.qsize() > 0
+
+    def remaining(self):
+        return max(0, self.expires - time.monotonic())
+
+    def check(self):
+        """
+        Raises SyncCanceled or DeadlineExceeded if the sync should stop.
+        """
+        if self.canceled():
+            raise SyncCanceled()
+        if self.remaining() == 0:
+            raise DeadlineExceeded()
+
+    def timeout(self):
+        """
+        The (connect, read) timeout to pass to requests, never longer than the
+        time left.
+        """
+        self.check()
+        remaining = self.remaining()
+        return (min(float(self.c.settings.connect_timeout), remaining),
+                min(float(self.c.settings.read_timeout), remaining))
+
+    def download(self, r):
+        """
+        Read the body of a requests response that was made with stream=True,
+        and close it if the sync stops before it's all downloaded. Each read
+        is bounded by the timeout the request was made with.
+        """
+        chunks = []
+        try:
+            for chunk in r.iter_content(self.DOWNLOAD_CHUNK_SIZE):
+                chunks.append(chunk)
+                self.check()
+        except:
+            r.close()
+            raise
+        return b''.join(chunks)
+
+    def sleep(self, seconds):
+        """
+        Like time.sleep, but raises as soon as the sync stops.
+        """
+        self.check()
+        end = time.monotonic() + seconds
+        while True:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(self.POLL_INTERVAL, remaining))
+            self.check()
+
+    def communicate(self, p, input=None):
+        """
+        Like p.communicate(input), but kill the subprocess if the sync stops.
+        """
+        while True:
+            try:
+                return p.communicate(input, timeout=self.POLL_INTERVAL)
+            except subprocess.TimeoutExpired:
+                # The input has already been sent, it can't be passed again
+                input = None
+                try:
+                    self.check()
+                except (SyncCanceled, DeadlineExceeded):
+                    p.kill()
+                    p.communicate()
+                    raise
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+GPG Sync
+Helps users have up-to-date public keys for everyone in their organization
+https://github.com/firstlookmedia/gpgsync
+Copyright (C) 2016 First Look Media
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import hashlib
+import threading
+import concurrent.futures
+
+from .gnupg import NotFoundOnKeyserver, ImportStreamClosed
+from .deadline import SyncCanceled, DeadlineExceeded
+
+
+class FetchCoordinator(object):
+    """
+    Keylists often share keys. While keylists are syncing, this makes sure
+    each key only gets downloaded from keys.openpgp.org and imported once:
+    a keylist asking for a key that another keylist is already fetching (or
+    has already fetched during this sync) waits for that result instead.
+
+    Keys that are byte-for-byte the same as the last time they were imported
+    don't get imported again, since gpg would have nothing to merge.
+    """
+    KEY_NEW = 'new'
+    KEY_UPDATED = 'updated'
+    KEY_UNCHANGED = 'unchanged'
+
+    def __init__(self, common):
+        self.c = common
+        self.lock = threading.Lock()
+
+        # Number of keylists currently fetching keys
+        self.active = 0
+
+        # Maps fingerprints to Futures, for as long as any keylist is fetching
+        self.futures = {}
+
+    def begin(self):
+        with self.lock:
+            self.active += 1
+
+    def end(self):
+        with self.lock:
+            self.active -= 1
+            if self.active == 0:
+                self.futures = {}
+
+    def fetch(self, fp, use_proxy, proxy_host, proxy_port, import_stream, keyring=None, deadline=None):
+        """
+        Download a key and write it to import_stream, or wait for another
+        keylist that's doing the same. keyring is a KeyringIndex of the
+        default keyring, used to tell whether unchanged keys are still there.
+
+        Returns a (pubkey, change) tuple, where change is KEY_NEW, KEY_UPDATED
+        or KEY_UNCHANGED. pubkey and change are None if the server returned
+        an invalid key. Raises the same exceptions as
+        Common.vks_get_by_fingerprint, and ImportStreamClosed if the key
+        couldn't be written to import_stream.
+        """
+        while True:
+            with self.lock:
+                future = self.futures.get(fp)
+                owner = future is None
+                if owner:
+                    future = concurrent.futures.Future()
+                    self.futures[fp] = future
+
+            if owner:
+                return self.fetch_as_owner(future, fp, use_proxy, proxy_host, proxy_port, import_stream, keyring, deadline)
+
+            try:
+                return self.wait(future, deadline)
+            except (SyncCanceled, DeadlineExceeded, ImportStreamClosed):
+                # If this sync is the one that stopped, give up. Otherwise the
+                # keylist that was fetching the key stopped, or couldn't
+                # import it, so try again and import it into our own stream
+                if deadline is not None:
+                    deadline.check()
+                self.c.log("FetchCoordinator", "fetch", "retrying {}, the keylist fetching it stopped".format(fp))
+
+    def fetch_as_owner(self, future, fp, use_proxy, proxy_host, proxy_port, import_stream, keyring, deadline):
+        try:
+            pubkey = self.c.vks_get_by_fingerprint(fp, use_proxy, proxy_host, proxy_port, deadline=deadline)
+            change = None
+            if pubkey:
+                change = self.import_if_changed(fp, pubkey, import_stream, keyring)
+        except Exception as e:
+            # Keys that aren't on the keyserver stay not found for this sync,
+            # but anything else gets tried again by the next keylist to ask
+            if not isinstance(e, NotFoundOnKeyserver):
+                with self.lock:
+                    if self.futures.get(fp) is future:
+                        del self.futures[fp]
+            future.set_exception(e)
+            raise
+
+        future.set_result((pubkey, change))
+        return (pubkey, change)
+
+    def import_if_changed(self, fp, pubkey, import_stream, keyring):
+        content_hash = hashlib.sha256(pubkey).hexdigest()
+        last_hash = self.c.state_db.get_key_hash(fp)
+
+        # Without a keyring index there's no telling if the key was deleted
+        # since it was imported, so import it anyway
+        in_keyring = keyring is None or fp in keyring
+
+        if last_hash is None or not in_keyring:
+            change = self.KEY_NEW
+        elif last_hash != content_hash:
+            change = self.KEY_UPDATED
+        else:
+            change = self.KEY_UNCHANGED
+
+        if change == self.KEY_UNCHANGED and keyring is not None:
+            self.c.log("FetchCoordinator", "import_if_changed", "{} is unchanged, not importing it".format(fp))
+            return change
+
+        # Only remember the key as imported once gpg confirms importing it,
+        # so a key gpg rejects gets imported again next sync. The owner's
+        # stream gets closed if its sync stops while downloads are still
+        # running.
+        def on_imported():
+            self.c.state_db.set_key_hash(fp, content_hash)
+
+        if not import_stream.write(pubkey, fp, on_imported):
+            raise ImportStreamClosed(fp)
+        return change
+
+    def wait(self, future, deadline):
+        if deadline is None:
+            return future.result()
+
+        while True:
+            try:
+                return future.result(timeout=deadline.POLL_INTERVAL)
+            except concurrent.futures.TimeoutError:
+                deadline.check()
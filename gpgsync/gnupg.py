@@ -19,12 +19,18 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import re
+import time
 import subprocess
 import os
 import tempfile
 import shutil
+import threading
+import datetime
 from urllib.parse import urlparse
 
+from .keyring import KeyringIndex
+from .gpg_status import parse_status
+
 
 class InvalidFingerprint(Exception):
     pass
@@ -38,6 +44,10 @@ class KeyserverError(Exception):
     pass
 
 
+class RateLimited(KeyserverError):
+    pass
+
+
 class NotFoundOnKeyserver(Exception):
     pass
 
@@ -66,15 +76,128 @@ class SignedWithWrongKey(Exception):
     pass
 
 
+class ImportStreamClosed(Exception):
+    pass
+
+
+class ImportStream(object):
+    """
+    A single long-running `gpg --import` into the default homedir. Each key
+    written to it gets imported as soon as it arrives, so keys don't need to
+    be collected in memory first, and importing overlaps with downloading.
+    The gpg process only gets started when the first key is written.
+    """
+    def __init__(self, gpg):
+        self.gpg = gpg
+        self.p = None
+        self.lock = threading.Lock()
+        self.readers = []
+        self.out = []
+        self.err = []
+        self.num_keys = 0
+        self.closed = False
+
+        # Maps fingerprints to functions to call once gpg confirms importing them
+        self.on_imported = {}
+
+        # gpg's IMPORT_RES statistics, once it's closed
+        self.import_result = None
+
+    def write(self, pubkey, fp=None, on_imported=None):
+        """
+        Returns True if the key was passed to gpg, or False if it wasn't
+        because the stream is closed or gpg stopped. If fp and on_imported are
+        passed in, on_imported gets called when the stream is closed, but only
+        if gpg reported importing fp.
+        """
+        with self.lock:
+            if self.closed:
+                # A download that was still running when the sync stopped
+                self.gpg.c.log("ImportStream", "write", "already closed, not importing key")
+                return False
+
+            if self.p is None:
+                self.start()
+
+            try:
+                self.p.stdin.write(pubkey + b'\n')
+                self.p.stdin.flush()
+                self.num_keys += 1
+                if fp is not None and on_imported is not None:
+                    self.on_imported[fp] = on_imported
+                return True
+            except (BrokenPipeError, OSError) as e:
+                self.gpg.c.log("ImportStream", "write", "gpg --import stopped accepting keys: {}".format(e))
+                return False
+
+    def start(self):
+        self.p = self.gpg._popen([self.gpg.gpg_path, '--batch', '--status-fd', '1', '--import'])
+
+        # Keep reading gpg's output, so it never blocks on a full pipe while
+        # we're blocked writing to it
+        for pipe, chunks in [(self.p.stdout, self.out), (self.p.stderr, self.err)]:
+            t = threading.Thread(target=self.read_pipe, args=(pipe, chunks), daemon=True)
+            t.start()
+            self.readers.append(t)
+
+    def read_pipe(self, pipe, chunks):
+        for chunk in iter(lambda: pipe.read(4096), b''):
+            chunks.append(chunk)
+        pipe.close()
+
+    def close(self):
+        """
+        Finish importing, and wait for gpg to exit. Returns gpg's stdout and stderr.
+        """
+        with self.lock:
+            self.closed = True
+            if self.p is None:
+                return b'', b''
+
+            try:
+                self.p.stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+            self.p.wait()
+            for t in self.readers:
+                t.join()
+
+            out = b''.join(self.out)
+            err = b''.join(self.err)
+            events = parse_status(out)
+            self.import_result = events.get('IMPORT_RES')
+            self.gpg.c.log("ImportStream", "close", "wrote {} keys, {}".format(self.num_keys, self.import_result))
+            if err != b'':
+                self.gpg.c.log("ImportStream", "close", "stderr: {}".format(err))
+
+            # Keys gpg rejected don't get confirmed
+            for fp in events.imported_fingerprints():
+                on_imported = self.on_imported.pop(fp, None)
+                if on_imported is not None:
+                    on_imported()
+            if self.on_imported:
+                self.gpg.c.log("ImportStream", "close", "gpg didn't import {} keys".format(len(self.on_imported)))
+            self.on_imported = {}
+
+            self.p = None
+            return out, err
+
+
 class GnuPG(object):
+    # How many fingerprints to pass to a single `gpg --recv-keys`
+    RECV_KEYS_CHUNK_SIZE = 100
+
+    # List the keys in the homedir again after this many seconds, even if
+    # nothing got imported, so keys that expire while GPG Sync keeps running
+    # don't look valid forever
+    KEYRING_INDEX_MAX_AGE = 10*60
+
     def __init__(self, common, appdata_path=None):
         self.appdata_path = appdata_path
         self.c = common
 
-        self.homedir = tempfile.mkdtemp()
-        self.c.log("GnuPG", "__init__", "created homedir: {}".format(self.homedir))
-
         self.system = self.c.os
+        self.homedir, self.homedir_lock = self.open_homedir(appdata_path)
         self.popen_startupinfo = None
         self.creationflags = 0
         if self.system == 'Darwin':
@@ -91,17 +214,132 @@ class GnuPG(object):
             self.popen_startupinfo = subprocess.STARTUPINFO()
             self.popen_startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
 
-        # Remember uids that have already been queried
-        self.uids = dict()
+        # An index of the keys in the temporary homedir, rebuilt whenever
+        # keys get imported into it, or after KEYRING_INDEX_MAX_AGE
+        self.keyring_index = None
+        self.keyring_index_listed_at = 0
+        self.keyring_index_lock = threading.Lock()
+
+        # Keylists with the same authority key validate it one at a time, so
+        # only the first one does any work. Maps fingerprints to locks.
+        self.authority_key_locks = {}
+        self.authority_key_locks_lock = threading.Lock()
+
+        # Legacy keyservers are configured in the temporary homedir's gpg.conf,
+        # so only one keylist at a time can fetch from one
+        self.configured_keyserver = None
+        self.keyserver_lock = threading.Lock()
+
+        # How many gpg processes have been spawned, to keep track of how
+        # expensive syncs are
+        self.process_count = 0
+        self.process_count_lock = threading.Lock()
+
+        # Limit how many gpg processes run at once, so keylists syncing at the
+        # same time don't all fight over the keyring locks. The long-running
+        # `gpg --import` of an ImportStream doesn't count, since there's at
+        # most one per syncing keylist.
+        self.gpg_semaphore = threading.BoundedSemaphore(max(1, int(self.c.settings.max_gpg_processes)))
 
     def __del__(self):
-        # Delete the temporary homedir
-        shutil.rmtree(self.homedir, ignore_errors=True)
+        if self.homedir_lock is not None:
+            # Keep the persistent homedir, just let other processes use it
+            self.homedir_lock.close()
+        else:
+            # Delete the temporary homedir
+            shutil.rmtree(self.homedir, ignore_errors=True)
 
         # Commenting out log, because when running tests __del__ seems to run without
         # capturing output
         #self.c.log("GnuPG", "__del__", "deleted homedir: {}".format(self.homedir))
 
+    def open_homedir(self, appdata_path):
+        """
+        Authority keys are kept in a homedir in appdata_path, so they don't
+        need to be fetched again every time GPG Sync starts. Only one process
+        can use it at a time, any others get a temporary homedir. Returns
+        (homedir, lock_file), and lock_file is None for a temporary homedir.
+        """
+        if appdata_path:
+            homedir = os.path.join(appdata_path, 'homedir')
+            if not os.path.exists(homedir):
+                os.makedirs(homedir, mode=0o700)
+
+            lock_file = open(os.path.join(homedir, 'gpgsync.lock'), 'a')
+            try:
+                if self.system == 'Windows':
+                    import msvcrt
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                else:
+                    import fcntl
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.c.log("GnuPG", "open_homedir", "using homedir: {}".format(homedir))
+                return homedir, lock_file
+            except OSError:
+                lock_file.close()
+                self.c.log("GnuPG", "open_homedir", "{} is in use by another process".format(homedir))
+
+        homedir = tempfile.mkdtemp()
+        self.c.log("GnuPG", "open_homedir", "created homedir: {}".format(homedir))
+        return homedir, None
+
+    def acquire_authority_key(self, fp, deadline=None):
+        """
+        Wait until no other keylist is validating this authority key. Call
+        release_authority_key when done.
+        """
+        fp = self.c.clean_fp(fp).decode()
+        with self.authority_key_locks_lock:
+            lock = self.authority_key_locks.setdefault(fp, threading.Lock())
+
+        if deadline is None:
+            lock.acquire()
+            return
+
+        while not lock.acquire(timeout=deadline.POLL_INTERVAL):
+            deadline.check()
+
+    def release_authority_key(self, fp):
+        fp = self.c.clean_fp(fp).decode()
+        with self.authority_key_locks_lock:
+            lock = self.authority_key_locks[fp]
+        lock.release()
+
+    def authority_key_is_fresh(self, fp):
+        """
+        Was this authority key validated less than
+        settings.authority_key_max_age_hours ago, and is it still in the
+        homedir, not revoked or expired, and exported to disk? If so, it
+        doesn't need to be fetched and validated again yet.
+        """
+        fp = self.c.clean_fp(fp).decode()
+        key = self.get_keyring_index().get(fp)
+        if key is None or key.revoked or key.expired:
+            return False
+
+        if self.appdata_path and not os.path.exists(self.get_pubkey_filename_on_disk(fp)):
+            return False
+
+        validated_at = self.c.state_db.get_authority_key_validated(fp)
+        if validated_at is None:
+            return False
+        try:
+            validated_at = datetime.datetime.fromisoformat(validated_at)
+        except ValueError:
+            return False
+
+        max_age = datetime.timedelta(hours=float(self.c.settings.authority_key_max_age_hours))
+        return datetime.datetime.now() - validated_at < max_age
+
+    def record_authority_key_validated(self, fp, valid=True):
+        """
+        Remember that this authority key was just validated, or if it wasn't
+        valid, that it needs to be validated again next time.
+        """
+        fp = self.c.clean_fp(fp).decode()
+        validated_at = datetime.datetime.now().isoformat() if valid else None
+        self.c.state_db.record_authority_key_validated(fp, validated_at)
+
     def is_gpg_available(self):
         if self.system == 'Windows':
             try:
@@ -114,7 +352,7 @@ class GnuPG(object):
             except:
                 return False
 
-    def recv_key(self, use_modern_keyserver, keyserver, fp, use_proxy, proxy_host, proxy_port):
+    def recv_key(self, use_modern_keyserver, keyserver, fp, use_proxy, proxy_host, proxy_port, deadline=None):
         if use_modern_keyserver:
             self.c.log("GnuPG", "recv_key", "using modern keyserver, fp={}, use_proxy={}".format(fp, use_proxy))
         else:
@@ -126,10 +364,11 @@ class GnuPG(object):
         fp = self.c.clean_fp(fp).decode()
 
         if use_modern_keyserver:
-            pubkey = self.c.vks_get_by_fingerprint(fp, use_proxy, proxy_host, proxy_port)
+            pubkey = self.c.vks_get_by_fingerprint(fp, use_proxy, proxy_host, proxy_port, deadline=deadline)
 
             # Import into temporary homedir
             self._gpg(['--import'], pubkey)
+            self.invalidate_keyring_index()
 
             # Also import into default homedir
             self.import_to_default_homedir(pubkey=pubkey)
@@ -138,40 +377,125 @@ class GnuPG(object):
             # Use legacy SKS keyserver
             keyserver = self.c.clean_keyserver(keyserver).decode()
 
-            hkps_pool_keyserver = 'hkps://hkps.pool.sks-keyservers.net'
-            ca_cert_file = self.c.get_resource_path('sks-keyservers.netCA.pem')
-
-            # Create gpg.conf and dirmngr.conf
-            dirmngr_conf = ''
-            gpg_conf = 'require-cross-certification\n'
-            gpg_conf += 'keyserver {}\n'.format(keyserver)
-            if keyserver == hkps_pool_keyserver:
-                # Don't need to add ca_cert_file in OS X, because GPG Tools includes the
-                # correct .pem for hkps://hkps.pool.sks-keyservers.net, and specifying it
-                # breaks because of a space in the filename (in "GPG Sync.app")
-                if not self.system == 'Darwin':
-                    gpg_conf += 'keyserver-options ca-cert-file={}\n'.format(ca_cert_file)
-                    dirmngr_conf += 'hkp-cacert {}\n'.format(ca_cert_file)
-            open(os.path.join(self.homedir, 'dirmngr.conf'), 'w').write(dirmngr_conf)
-            open(os.path.join(self.homedir, 'gpg.conf'), 'w').write(gpg_conf)
-
-            args = ['--recv-keys', fp]
-            out,err = self._gpg(args)
+            def recv():
+                with self.keyserver_lock:
+                    self.configure_keyserver(keyserver)
+
+                    args = ['--recv-keys', fp]
+                    events,err = self._gpg_status(args, deadline=deadline)
+                    self.invalidate_keyring_index()
+
+                # Keyserver failures only show up in dirmngr's messages
+                if b"could not parse keyserver URL" in err:
+                    raise InvalidKeyserver(keyserver)
+
+                if b"No keyserver available" in err or b"gpg: keyserver communications error: General error" in err:
+                    raise KeyserverError(keyserver)
+
+                if b"not found on keyserver" in err or b"keyserver receive failed: No data" in err or events.has('NODATA'):
+                    raise NotFoundOnKeyserver(fp)
 
+                if b"keyserver receive failed" in err:
+                    raise KeyserverError(keyserver)
+
+                if fp not in events.imported_fingerprints():
+                    raise NotFoundOnKeyserver(fp)
+
+            # Retry if the keyserver fails, and fail fast while it's down
+            self.c.keyserver_health.call(keyserver, recv, deadline=deadline)
+
+            # Import key into default homedir
+            self.import_to_default_homedir(fp=fp)
+
+    def create_temp_homedir(self):
+        """
+        Keylist members fetched from legacy keyservers go into a temporary
+        homedir for each sync, so that only authority keys are kept in the
+        persistent homedir. Delete it with delete_temp_homedir when done.
+        """
+        homedir = tempfile.mkdtemp()
+        self.c.log("GnuPG", "create_temp_homedir", "created homedir: {}".format(homedir))
+        return homedir
+
+    def delete_temp_homedir(self, homedir):
+        shutil.rmtree(homedir, ignore_errors=True)
+
+    def recv_keys(self, keyserver, fps, homedir, deadline=None):
+        """
+        Fetch many keys from a legacy keyserver into homedir (from
+        create_temp_homedir), running one `gpg --recv-keys` per
+        RECV_KEYS_CHUNK_SIZE fingerprints. Unlike recv_key, this doesn't
+        import them into the default homedir, use import_to_default_homedir
+        for that once all keys are fetched.
+
+        Returns the list of fingerprints that weren't found on the keyserver.
+        Raises InvalidKeyserver or KeyserverError if the whole fetch failed.
+        """
+        self.c.log("GnuPG", "recv_keys", "using legacy keyserver, keyserver={}, {} fingerprints".format(keyserver, len(fps)))
+
+        fps = [self.c.clean_fp(fp).decode() for fp in fps]
+        keyserver = self.c.clean_keyserver(keyserver).decode()
+
+        self.configure_keyserver(keyserver, homedir)
+
+        def recv_chunk(chunk):
+            events,err = self._gpg_status(['--recv-keys'] + chunk, deadline=deadline, homedir=homedir)
+
+            # Keyserver failures only show up in dirmngr's messages
             if b"could not parse keyserver URL" in err:
                 raise InvalidKeyserver(keyserver)
 
-            if b"No keyserver available" in err or b"gpg: keyserver communications error: General error" in err or b"gpgkeys: HTTP fetch error" in out:
+            if b"No keyserver available" in err or b"gpg: keyserver communications error: General error" in err:
                 raise KeyserverError(keyserver)
 
-            if b"not found on keyserver" in err or b"keyserver receive failed: No data" in err or b"no valid OpenPGP data found" in err:
-                raise NotFoundOnKeyserver(fp)
-
-            if b"keyserver receive failed" in err:
+            # With several keys, some of them missing is normal. Only fail if
+            # the keyserver failed for some other reason
+            notfound = b"not found on keyserver" in err or b"keyserver receive failed: No data" in err or events.has('NODATA')
+            if b"keyserver receive failed" in err and not notfound:
                 raise KeyserverError(keyserver)
 
-            # Import key into default homedir
-            self.import_to_default_homedir(fp=fp)
+            imported = events.get('IMPORT_RES')
+            if imported:
+                self.c.log("GnuPG", "recv_keys", str(imported))
+            return events.imported_fingerprints()
+
+        found = set()
+        for i in range(0, len(fps), self.RECV_KEYS_CHUNK_SIZE):
+            chunk = fps[i:i+self.RECV_KEYS_CHUNK_SIZE]
+            found.update(self.c.keyserver_health.call(keyserver, lambda: recv_chunk(chunk), deadline=deadline))
+
+        # Whatever gpg didn't report importing wasn't found
+        return [fp for fp in fps if fp not in found]
+
+    def configure_keyserver(self, keyserver, homedir=None):
+        """
+        Write gpg.conf and dirmngr.conf in homedir (the persistent homedir by
+        default) to use this keyserver. In the persistent homedir they only
+        get rewritten when the keyserver changes. Hold keyserver_lock while
+        calling this and fetching keys into the persistent homedir.
+        """
+        if homedir is None and keyserver == self.configured_keyserver:
+            return
+
+        hkps_pool_keyserver = 'hkps://hkps.pool.sks-keyservers.net'
+        ca_cert_file = self.c.get_resource_path('sks-keyservers.netCA.pem')
+
+        # Create gpg.conf and dirmngr.conf
+        dirmngr_conf = ''
+        gpg_conf = 'require-cross-certification\n'
+        gpg_conf += 'keyserver {}\n'.format(keyserver)
+        if keyserver == hkps_pool_keyserver:
+            # Don't need to add ca_cert_file in OS X, because GPG Tools includes the
+            # correct .pem for hkps://hkps.pool.sks-keyservers.net, and specifying it
+            # breaks because of a space in the filename (in "GPG Sync.app")
+            if not self.system == 'Darwin':
+                gpg_conf += 'keyserver-options ca-cert-file={}\n'.format(ca_cert_file)
+                dirmngr_conf += 'hkp-cacert {}\n'.format(ca_cert_file)
+        open(os.path.join(homedir or self.homedir, 'dirmngr.conf'), 'w').write(dirmngr_conf)
+        open(os.path.join(homedir or self.homedir, 'gpg.conf'), 'w').write(gpg_conf)
+
+        if homedir is None:
+            self.configured_keyserver = keyserver
 
     def get_pubkey_filename_on_disk(self, fp):
         fp = self.c.clean_fp(fp).decode()
@@ -210,6 +534,7 @@ class GnuPG(object):
         # Import key
         try:
             out,err = self._gpg(['--import', filename])
+            self.invalidate_keyring_index()
         except:
             # If the key doesn't exist, ignore
             pass
@@ -235,6 +560,35 @@ class GnuPG(object):
         except:
             pass
 
+    def get_keyring_index(self):
+        """
+        Returns a KeyringIndex of the temporary homedir, listing all of the
+        keys with a single gpg call the first time it's needed.
+        """
+        with self.keyring_index_lock:
+            if self.keyring_index is None or time.monotonic() - self.keyring_index_listed_at >= self.KEYRING_INDEX_MAX_AGE:
+                out,err = self._gpg(['--with-colons', '--list-keys'])
+                self.keyring_index = KeyringIndex(out)
+                self.keyring_index_listed_at = time.monotonic()
+            return self.keyring_index
+
+    def invalidate_keyring_index(self):
+        with self.keyring_index_lock:
+            self.keyring_index = None
+
+    def get_default_keyring_index(self):
+        """
+        Returns a KeyringIndex of the default homedir. This lists the keys again
+        every time it's called, since other programs change this keyring.
+        """
+        self.acquire_gpg_slot()
+        try:
+            p = self._popen([self.gpg_path, '--batch', '--no-tty', '--with-colons', '--list-keys'])
+            (out, err) = p.communicate()
+        finally:
+            self.gpg_semaphore.release()
+        return KeyringIndex(out)
+
     def test_key(self, fp):
         self.c.log("GnuPG", "test_key", "fp={}".format(fp))
 
@@ -242,18 +596,14 @@ class GnuPG(object):
             raise InvalidFingerprint(fp)
 
         fp = self.c.clean_fp(fp).decode()
-        out,err = self._gpg(['--with-colons', '--list-keys', fp])
+        key = self.get_keyring_index().get(fp)
 
-        if b"error reading key: No public key" in err:
+        if key is None:
             raise NotFoundInKeyring(fp)
-
-        for line in out.split(b'\n'):
-            if line.startswith(b'pub:'):
-                chunks = line.split(b':')
-                if chunks[1] == b'r':
-                    raise RevokedKey(fp)
-                if chunks[1] == b'e':
-                    raise ExpiredKey(fp)
+        if key.revoked:
+            raise RevokedKey(fp)
+        if key.expired:
+            raise ExpiredKey(fp)
 
     def get_uid(self, fp):
         self.c.log("GnuPG", "get_uid", "fp={}".format(fp))
@@ -262,21 +612,13 @@ class GnuPG(object):
             raise InvalidFingerprint(fp)
 
         fp = self.c.clean_fp(fp).decode()
+        key = self.get_keyring_index().get(fp)
 
-        if fp in self.uids:
-            return self.uids[fp]
-
-        out,err = self._gpg(['--with-colons', '--list-keys', fp])
-        for line in out.split(b'\n'):
-            if line.startswith(b'uid:'):
-                chunks = line.split(b':')
-                uid = str(chunks[9], 'UTF-8')
-                self.uids[fp] = uid
-                return uid
-
+        if key and key.uids:
+            return key.uids[0]
         return ''
 
-    def verify(self, msg_sig, msg, fp):
+    def verify(self, msg_sig, msg, fp, deadline=None):
         self.c.log("GnuPG", "verify," "fp={}".format(fp))
 
         if not self.c.valid_fp(fp):
@@ -284,37 +626,70 @@ class GnuPG(object):
 
         fp = self.c.clean_fp(fp).decode()
 
-        # Write message and detached signature to disk
-        msg_sig_filename = tempfile.NamedTemporaryFile(delete=False).name
-        open(msg_sig_filename, 'wb').write(msg_sig)
-        msg_filename = tempfile.NamedTemporaryFile(delete=False).name
-        open(msg_filename, 'wb').write(msg)
-
         # Verify the signature
-        out,err = self._gpg(['--keyid-format', '0xlong', '--verify', msg_sig_filename, msg_filename])
-        os.unlink(msg_filename)
-        os.unlink(msg_sig_filename)
+        if self.c.os == 'Windows':
+            events,err = self.verify_with_files(msg_sig, msg, deadline)
+        else:
+            events,err = self.verify_with_pipes(msg_sig, msg, deadline)
 
-        if b'BAD signature' in err:
+        if events.has('BADSIG'):
             raise BadSignature()
-        if b"Can't check signature: No public key" in err or b'no valid OpenPGP data found' in err or b'the signature could not be verified' in err:
+        if events.has('ERRSIG', 'NO_PUBKEY', 'NODATA'):
             raise VerificationError()
-        if b'This key has been revoked by its owner!' in err:
+        if events.has('REVKEYSIG', 'KEYREVOKED'):
             raise RevokedKey()
-        if b'Note: This key has expired!' in err:
+        if events.has('EXPKEYSIG', 'KEYEXPIRED'):
             raise ExpiredKey()
-        if b'Signature made' not in err and b'Good signature from' not in err:
+
+        validsig = events.get('VALIDSIG')
+        if validsig is None:
             raise VerificationError()
 
-        # Make sure the authority key is correct
-        lines = err.split(b'\n')
-        for i in range(len(lines)):
-            if lines[i].startswith(b'gpg: Signature made'):
-                signing_fp = lines[i+1].split()[-1]
-                signing_keyid = self.fp_to_long_keyid(signing_fp)
-                if signing_keyid not in self.list_all_keyids(fp):
-                    raise SignedWithWrongKey
-                break
+        # Make sure the authority key is correct. It's either the primary key
+        # that signed, or the primary key of the subkey that signed
+        if validsig.primary_fingerprint != fp:
+            raise SignedWithWrongKey
+
+    def verify_with_pipes(self, msg_sig, msg, deadline=None):
+        """
+        Pass the message to gpg on stdin, and the detached signature on
+        another pipe, so neither one gets written to disk.
+        """
+        sig_r, sig_w = os.pipe()
+
+        def write_sig():
+            # gpg might exit without reading the whole signature
+            try:
+                with os.fdopen(sig_w, 'wb') as f:
+                    f.write(msg_sig)
+            except OSError:
+                pass
+
+        t = threading.Thread(target=write_sig, daemon=True)
+        t.start()
+        try:
+            args = ['--enable-special-filenames', '--verify', '--', '-&{}'.format(sig_r), '-']
+            return self._gpg_status(args, msg, deadline=deadline, pass_fds=(sig_r,))
+        finally:
+            # Once gpg is gone, closing the read end unblocks the writer
+            os.close(sig_r)
+            t.join()
+
+    def verify_with_files(self, msg_sig, msg, deadline=None):
+        """
+        Windows can't pass extra pipes to gpg, so write the message and
+        detached signature to disk instead.
+        """
+        msg_sig_filename = tempfile.NamedTemporaryFile(delete=False).name
+        open(msg_sig_filename, 'wb').write(msg_sig)
+        msg_filename = tempfile.NamedTemporaryFile(delete=False).name
+        open(msg_filename, 'wb').write(msg)
+
+        try:
+            return self._gpg_status(['--verify', msg_sig_filename, msg_filename], deadline=deadline)
+        finally:
+            os.unlink(msg_filename)
+            os.unlink(msg_sig_filename)
 
     def list_all_keyids(self, fp):
         self.c.log("GnuPG", "list_all_keyids", "fp={}".format(fp))
@@ -323,53 +698,80 @@ class GnuPG(object):
             raise InvalidFingerprint(fp)
 
         fp = self.c.clean_fp(fp).decode()
+        key = self.get_keyring_index().get(fp)
 
-        out, err = self._gpg(['--keyid-format', '0xlong', '--list-keys', fp])
-        if b'gpg: error reading key: No public key' in err:
+        if key is None:
             raise NotFoundInKeyring
 
-        return re.findall(b'0x[A-F\d]{16}', out)
+        return list(key.keyids)
 
     def fp_to_long_keyid(self, fp):
         if re.match(b'0x[A-F\d]{16}', fp):
             return fp
         return b'0x' + fp[-16:]
 
-    def import_to_default_homedir(self, fp=None, pubkey=None):
+    def import_to_default_homedir(self, fp=None, pubkey=None, homedir=None):
         """
-        If fp is passed in, export the pubkey from the temporary homedir. If pubkey is passed in,
-        just import that pubkey directly.
+        If fp is passed in, export the pubkey from homedir (the persistent homedir by default).
+        fp can also be a list of fingerprints, to export them all at once. If pubkey is passed
+        in, just import that pubkey directly. Returns gpg's IMPORT_RES statistics, if anything
+        got imported.
         """
         #self.c.log("GnuPG", "import_to_default_homedir", "fp={}, pubkey={}".format(fp, pubkey))
 
         if fp is not None:
             # Export public key from the temporary homedir
-            out,err = self._gpg(['--armor', '--export', fp])
+            fps = fp if isinstance(fp, list) else [fp]
+            if len(fps) == 0:
+                return
+            out,err = self._gpg(['--armor', '--export'] + fps, homedir=homedir)
             pubkey = out
 
             if b'gpg: WARNING: nothing exported' in err:
                 return
 
         # Import public key into default homedir
-        p = subprocess.Popen([self.gpg_path, '--import'],
-            stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE,
-            startupinfo=self.popen_startupinfo)
-        (out, err) = p.communicate(pubkey)
+        self.acquire_gpg_slot()
+        try:
+            p = self._popen([self.gpg_path, '--batch', '--status-fd', '1', '--import'])
+            (out, err) = p.communicate(pubkey)
+        finally:
+            self.gpg_semaphore.release()
 
-        if out != b'':
-            self.c.log("GnuPG", "import_to_default_homedir", "stdout: {}".format(out))
         if err != b'':
             self.c.log("GnuPG", "import_to_default_homedir", "stderr: {}".format(err))
 
-    def _gpg(self, args, input=None):
-        default_args = [self.gpg_path, '--batch', '--no-tty', '--homedir', self.homedir]
+        imported = parse_status(out).get('IMPORT_RES')
+        if imported:
+            self.c.log("GnuPG", "import_to_default_homedir", str(imported))
+        return imported
+
+    def start_import_to_default_homedir(self):
+        """
+        Returns an ImportStream, to import keys into the default homedir one at
+        a time as they get downloaded. Call close() on it when done.
+        """
+        return ImportStream(self)
+
+    def _gpg(self, args, input=None, deadline=None, pass_fds=(), homedir=None):
+        """
+        Run gpg in homedir (the persistent homedir by default). If a Deadline
+        is passed in, gpg gets killed as soon as the sync is canceled or runs
+        out of time. pass_fds are file descriptors for gpg to inherit.
+        """
+        default_args = [self.gpg_path, '--batch', '--no-tty', '--homedir', homedir or self.homedir]
 
         self.c.log("GnuPG", "_gpg", "args: {}".format(default_args + args))
 
-        p = subprocess.Popen(default_args + args,
-            stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE,
-            startupinfo=self.popen_startupinfo)
-        (out, err) = p.communicate(input)
+        self.acquire_gpg_slot(deadline)
+        try:
+            p = self._popen(default_args + args, pass_fds)
+            if deadline is None:
+                (out, err) = p.communicate(input)
+            else:
+                (out, err) = deadline.communicate(p, input)
+        finally:
+            self.gpg_semaphore.release()
 
         if out != '':
             # Only display the first 512 bytes
@@ -381,3 +783,32 @@ class GnuPG(object):
         if err != '':
             self.c.log("GnuPG", "_gpg", "stderr: {}".format(err))
         return out, err
+
+    def _gpg_status(self, args, input=None, deadline=None, pass_fds=(), homedir=None):
+        """
+        Like _gpg, but gpg writes its machine-readable status lines to
+        stdout, and they get parsed into StatusEvents. Only use this for
+        commands that don't write anything else to stdout. Returns (events, err).
+        """
+        out, err = self._gpg(['--status-fd', '1'] + args, input, deadline=deadline, pass_fds=pass_fds, homedir=homedir)
+        return parse_status(out), err
+
+    def acquire_gpg_slot(self, deadline=None):
+        """
+        Wait until fewer than settings.max_gpg_processes gpg processes are
+        running. Release gpg_semaphore when the process is done.
+        """
+        if deadline is None:
+            self.gpg_semaphore.acquire()
+            return
+
+        while not self.gpg_semaphore.acquire(timeout=deadline.POLL_INTERVAL):
+            deadline.check()
+
+    def _popen(self, args, pass_fds=()):
+        with self.process_count_lock:
+            self.process_count += 1
+
+        return subprocess.Popen(args,
+            stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE,
+            startupinfo=self.popen_startupinfo, pass_fds=pass_fds)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+GPG Sync
+Helps users have up-to-date public keys for everyone in their organization
+https://github.com/firstlookmedia/gpgsync
+Copyright (C) 2016 First Look Media
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# gpg's machine-readable status lines, from `gpg --status-fd`. Each line looks
+# like "[GNUPG:] KEYWORD arg1 arg2 ...", see doc/DETAILS in the GnuPG source.
+# These don't depend on gpg's version or locale, unlike its stderr messages.
+
+STATUS_PREFIX = b'[GNUPG:] '
+
+
+class StatusEvent(object):
+    """
+    A single status line. Keywords without a subclass just keep their
+    arguments as strings.
+    """
+    def __init__(self, keyword, args):
+        self.keyword = keyword
+        self.args = args
+
+    def arg(self, i, default=None):
+        if i < len(self.args):
+            return self.args[i]
+        return default
+
+    def int_arg(self, i):
+        try:
+            return int(self.arg(i, 0))
+        except ValueError:
+            return 0
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.keyword, ' '.join(self.args))
+
+
+class ValidSig(StatusEvent):
+    """
+    The signature is valid. fingerprint is the key that made the signature,
+    which might be a subkey, and primary_fingerprint is its primary key.
+    """
+    @property
+    def fingerprint(self):
+        return self.arg(0)
+
+    @property
+    def primary_fingerprint(self):
+        return self.arg(9, self.fingerprint)
+
+
+class ImportOk(StatusEvent):
+    """
+    A key was imported, or was already in the keyring unchanged.
+    """
+    @property
+    def reason(self):
+        return self.int_arg(0)
+
+    @property
+    def fingerprint(self):
+        return self.arg(1)
+
+
+class ImportRes(StatusEvent):
+    """
+    Statistics at the end of an import.
+    """
+    @property
+    def count(self):
+        return self.int_arg(0)
+
+    @property
+    def imported(self):
+        return self.int_arg(2)
+
+    @property
+    def unchanged(self):
+        return self.int_arg(4)
+
+    @property
+    def revocations(self):
+        return self.int_arg(8)
+
+    @property
+    def not_imported(self):
+        return self.int_arg(13)
+
+    def __str__(self):
+        return '{} keys processed, {} imported, {} unchanged, {} new revocations, {} not imported'.format(
+            self.count, self.imported, self.unchanged, self.revocations, self.not_imported)
+
+
+EVENT_TYPES = {
+    'VALIDSIG': ValidSig,
+    'IMPORT_OK': ImportOk,
+    'IMPORT_RES': ImportRes
+}
+
+
+class StatusEvents(list):
+    """
+    All of the status events from one gpg process, in order.
+    """
+    def get(self, keyword):
+        """
+        Returns the first event with this keyword, or None.
+        """
+        for event in self:
+            if event.keyword == keyword:
+                return event
+        return None
+
+    def has(self, *keywords):
+        return any(event.keyword in keywords for event in self)
+
+    def imported_fingerprints(self):
+        return [event.fingerprint for event in self if event.keyword == 'IMPORT_OK' and event.fingerprint]
+
+
+def parse_status(data):
+    """
+    Parse status lines into StatusEvents. Anything that isn't a status line
+    is ignored.
+    """
+    events = StatusEvents()
+    for line in data.split(b'\n'):
+        line = line.rstrip(b'\r')
+        if not line.startswith(STATUS_PREFIX):
+            continue
+
+        parts = line[len(STATUS_PREFIX):].decode('utf-8', errors='replace').split(' ')
+        keyword = parts[0]
+        events.append(EVENT_TYPES.get(keyword, StatusEvent)(keyword, parts[1:]))
+
+    return events
@@ -27,6 +27,7 @@ from .settings_dialog import SettingsDialog
 from .keylist_dialog import KeylistDialog
 from .keylist_list import KeylistList
 from .threads import RefresherThread
+from ..scheduler import Scheduler
 
 
 class MainWindow(QtWidgets.QMainWindow):
@@ -104,13 +105,19 @@ class MainWindow(QtWidgets.QMainWindow):
         central_widget.setLayout(layout)
         self.setCentralWidget(central_widget)
 
+        # Sleep until the next keylist is due to sync
+        self.scheduler = Scheduler(self.c)
+        self.sync_timer = QtCore.QTimer()
+        self.sync_timer.setSingleShot(True)
+        self.sync_timer.timeout.connect(self.run_scheduled_sync)
+
         # Update the UI
         self.update_ui()
 
-        # Timed tasks intialize
-        self.global_timer = QtCore.QTimer()
-        self.global_timer.timeout.connect(self.run_interval_tasks)
-        self.global_timer.start(60000) # 1 minute
+        # Check for updates once an hour (check_for_updates only actually checks once a day)
+        self.update_timer = QtCore.QTimer()
+        self.update_timer.timeout.connect(self.run_interval_tasks)
+        self.update_timer.start(3600000) # 1 hour
 
         # Decide if window should start out shown or hidden
         if len(self.c.settings.keylists) == 0:
@@ -125,8 +132,6 @@ class MainWindow(QtWidgets.QMainWindow):
         self.app.applicationStateChanged.connect(self.application_state_change)
 
     def run_interval_tasks(self):
-        self.sync_all_keylists(False)
-
         if self.c.os != 'Linux' and self.c.settings.run_autoupdate:
             self.check_for_updates(False)
 
@@ -177,6 +182,9 @@ class MainWindow(QtWidgets.QMainWindow):
         d = SettingsDialog(self.c)
         d.exec_()
 
+        # The update interval might have changed
+        self.schedule_next_sync()
+
     def update_ui(self):
         # Update the systray icon
         self.systray.update_icon()
@@ -192,6 +200,9 @@ class MainWindow(QtWidgets.QMainWindow):
         # Add or delete keylists, if necessary
         self.keylist_list.update_keylist_widgets()
 
+        # Keylists might have been added, edited, or synced
+        self.schedule_next_sync()
+
     def add_keylist(self):
         d = KeylistDialog(self.c)
         d.saved.connect(self.update_ui)
@@ -199,14 +210,26 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def sync_all_keylists(self, force=False):
         self.c.log("MainWindow", "sync_all_keylists", "force={}".format(force))
+        self.sync_keylists(self.c.settings.keylists)
+
+    def run_scheduled_sync(self):
+        keylists = self.scheduler.due_keylists(self.c.settings.keylists)
+        self.c.log("MainWindow", "run_scheduled_sync", "{} keylists due".format(len(keylists)))
+        self.sync_keylists(keylists)
 
-        for keylist in self.c.settings.keylists:
+    def sync_keylists(self, keylists):
+        for keylist in keylists:
             if not hasattr(keylist, 'refresher') or keylist.refresher.is_finished:
                 keylist.refresher = RefresherThread(self.c, keylist)
-                #keylist.refresher.finished.connect(self.update_ui)
+                keylist.refresher.finished.connect(self.schedule_next_sync)
                 keylist.refresher.start()
         self.update_ui()
 
+    def schedule_next_sync(self):
+        seconds = self.scheduler.seconds_until_next_sync(self.c.settings.keylists)
+        self.c.log("MainWindow", "schedule_next_sync", "next sync in {:.0f} seconds".format(seconds))
+        self.sync_timer.start(int(seconds * 1000))
+
     def check_for_updates(self, force=False):
         self.c.log("MainWindow", "check_for_updates", "force={}".format(force))
 
@@ -288,4 +311,5 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def quit(self):
         self.c.log("MainWindow", "quit")
+        self.c.settings.flush()
         self.app.quit()
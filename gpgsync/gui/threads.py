@@ -110,8 +110,11 @@ class RefresherThread(QtCore.QThread):
             return
         self.keylist.syncing = True
 
-        result = Keylist.refresh(self.c, self.cancel_q, self.keylist, force=self.force)
+        process_count = self.c.gpg.process_count
+        # Wait for a turn in the shared sync pool
+        result = self.c.sync_pool.submit(self.keylist, self.cancel_q, force=self.force).result()
         self.keylist.interpret_result(result)
+        self.c.log("RefresherThread", "run", "spawned {} gpg processes".format(self.c.gpg.process_count - process_count))
 
         self.keylist.syncing = False
         self.is_finished = True
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+GPG Sync
+Helps users have up-to-date public keys for everyone in their organization
+https://github.com/firstlookmedia/gpgsync
+Copyright (C) 2016 First Look Media
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import hashlib
+import threading
+
+
+class HTTPCache(object):
+    """
+    Remembers the ETag and Last-Modified validators, and the body, of
+    downloaded keylists and signatures, so they can be re-downloaded with a
+    conditional GET. Cached bodies still get their signatures verified every
+    sync, this only saves bandwidth. The validators are stored in the
+    StateDB, and the bodies in files next to it.
+    """
+    def __init__(self, common, state_db):
+        self.c = common
+        self.db = state_db
+        self.cache_path = os.path.join(state_db.appdata_path, 'http_cache')
+        self.lock = threading.Lock()
+
+    def get_body_filename(self, url):
+        return os.path.join(self.cache_path, hashlib.sha256(url.encode()).hexdigest())
+
+    def conditional_headers(self, url):
+        """
+        Returns the If-None-Match and If-Modified-Since headers to send for
+        this url, if there's a cached copy of it.
+        """
+        url = self.clean_url(url)
+        headers = {}
+
+        validators = self.db.get_http_validators(url)
+        if validators is None or not os.path.isfile(self.get_body_filename(url)):
+            return headers
+
+        etag, last_modified = validators
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        return headers
+
+    def get(self, url):
+        """
+        Returns the cached body for this url, or None if it's not cached.
+        """
+        url = self.clean_url(url)
+
+        if self.db.get_http_validators(url) is None:
+            return None
+
+        with self.lock:
+            try:
+                return open(self.get_body_filename(url), 'rb').read()
+            except:
+                return None
+
+    def store(self, url, headers, body):
+        """
+        Cache the body of a 200 response, if the server sent any validators.
+        """
+        url = self.clean_url(url)
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+
+        if not etag and not last_modified:
+            # Nothing to revalidate with, so don't bother caching it
+            self.db.delete_http_validators(url)
+            self.db.commit()
+            return
+
+        self.c.log("HTTPCache", "store", "url={}, etag={}, last_modified={}".format(url, etag, last_modified))
+
+        with self.lock:
+            if not os.path.exists(self.cache_path):
+                os.makedirs(self.cache_path)
+            self.c.write_file_atomic(self.get_body_filename(url), body)
+
+        self.db.set_http_validators(url, etag, last_modified)
+        self.db.commit()
+
+    def clean_url(self, url):
+        if isinstance(url, bytes):
+            return url.decode()
+        return url
@@ -25,9 +25,14 @@ import datetime
 import dateutil.parser as date_parser
 import queue
 import json
+import concurrent.futures
+import sqlite3
 from io import BytesIO
 
 from .gnupg import *
+from .sync_state import SyncState
+from .fetch_coordinator import FetchCoordinator
+from .deadline import Deadline, SyncCanceled, DeadlineExceeded
 
 
 class URLDownloadError(Exception):
@@ -84,11 +89,53 @@ class RefresherMessageQueue(queue.LifoQueue):
         })
 
 
+class RefreshPipeline(object):
+    """
+    Runs the network stages of a refresh that don't depend on each other
+    (downloading the keylist, downloading its signature, and fetching the
+    authority key) concurrently. Each stage is a function that returns a
+    result object, and each one only runs once per refresh, even when a
+    keylist turns out to be a legacy keylist and gets handed off.
+    """
+    def __init__(self, common, deadline):
+        self.c = common
+        self.deadline = deadline
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=3)
+        self.futures = {}
+
+    def start(self, name, func):
+        if name not in self.futures:
+            self.c.log("RefreshPipeline", "start", name)
+            self.futures[name] = self.executor.submit(func)
+
+    def wait(self, name):
+        """
+        Wait for a stage to finish and return its result object. Raises
+        SyncCanceled or DeadlineExceeded if the sync stops first.
+        """
+        future = self.futures[name]
+        while True:
+            try:
+                return future.result(timeout=self.deadline.POLL_INTERVAL)
+            except concurrent.futures.TimeoutError:
+                self.deadline.check()
+
+    def shutdown(self):
+        # Don't wait for stages that are no longer needed, like fetching the
+        # authority key after the keylist failed to download
+        for future in self.futures.values():
+            future.cancel()
+        self.executor.shutdown(wait=False)
+
+
 class Keylist(object):
     """
     This represents a keylist. It complies with the Keylist RFC draft:
     https://datatracker.ietf.org/doc/draft-mccain-keylist/
     """
+    # Attributes saved in the state database rather than settings.json
+    STATUS_KEYS = ['last_checked', 'last_synced', 'last_failed', 'error', 'warning']
+
     def __init__(self, common):
         self.c = common
 
@@ -111,6 +158,7 @@ class Keylist(object):
         # Temporary variable for if it's in the middle of syncing
         self.syncing = False
         self.q = None
+        self.deadline = None
 
         # Ubuntu's keyserver is the default we fall back to (since it seems better managed than the SKS pool)
         self.default_keyserver = b'hkps://keyserver.ubuntu.com/'
@@ -146,11 +194,16 @@ class Keylist(object):
         return self
 
     def serialize(self):
-        tmp = {}
+        # Serialize only the attributes that should persist in settings.json
+        return self._serialize(['fingerprint', 'url', 'use_modern_keylist', 'keyserver', 'use_proxy', 'proxy_host',
+                                'proxy_port'])
+
+    def serialize_status(self):
+        # The sync status is saved in the state database
+        return self._serialize(self.STATUS_KEYS)
 
-        # Serialize only the attributes that should persist
-        keys = ['fingerprint', 'url', 'use_modern_keylist', 'keyserver', 'use_proxy', 'proxy_host',
-                'proxy_port', 'last_checked', 'last_synced', 'last_failed', 'error', 'warning']
+    def _serialize(self, keys):
+        tmp = {}
         for k, v in self.__dict__.items():
             if k in keys:
                 if isinstance(v, bytes):
@@ -180,13 +233,27 @@ class Keylist(object):
                   'https': socks5_address,
                   'http': socks5_address
                 }
-
-                r = self.c.requests_get(url, proxies=proxies)
             else:
-                r = self.c.requests_get(url)
+                proxies = None
 
+            # If we've downloaded this before, only download it again if it changed
+            r = self.c.requests_get(url, proxies=proxies, headers=self.c.http_cache.conditional_headers(url), deadline=self.deadline)
             r.close()
-            msg_bytes = r.content
+
+            msg_bytes = None
+            if r.status_code == 304:
+                self.c.log("Keylist", "fetch_url", "not modified, using cached copy of {}".format(url))
+                msg_bytes = self.c.http_cache.get(url)
+
+            if msg_bytes is None:
+                if r.status_code == 304:
+                    # The cached copy disappeared, so download it again
+                    r = self.c.requests_get(url, proxies=proxies, deadline=self.deadline)
+                    r.close()
+
+                msg_bytes = r.content
+                if r.status_code == 200:
+                    self.c.http_cache.store(url, r.headers, msg_bytes)
         except (socks.ProxyConnectionError, requests.exceptions.RequestException, requests.exceptions.ConnectionError) as e:
             if self.use_proxy:
                 raise ProxyURLDownloadError(e)
@@ -197,7 +264,7 @@ class Keylist(object):
 
     def verify_sig(self, gpg, msg_sig_bytes, msg_bytes):
         # Make sure the signature is valid
-        gpg.verify(msg_sig_bytes, msg_bytes, self.fingerprint)
+        gpg.verify(msg_sig_bytes, msg_bytes, self.fingerprint, deadline=self.deadline)
 
     def interpret_result(self, result):
         """
@@ -208,8 +275,11 @@ class Keylist(object):
 
         if result['type'] == "success":
             self.c.log("Keylist", "interpret_result", "refresh success")
+            if result['data'].get('key_changes'):
+                self.c.log("Keylist", "interpret_result", "keys: {new} new, {updated} updated, {unchanged} unchanged".format(**result['data']['key_changes']))
 
-            if len(result['data']['invalid_fingerprints']) == 0 and len(result['data']['notfound_fingerprints']) == 0:
+            cached_notfound_fingerprints = result['data'].get('cached_notfound_fingerprints', [])
+            if len(result['data']['invalid_fingerprints']) == 0 and len(result['data']['notfound_fingerprints']) == 0 and len(cached_notfound_fingerprints) == 0:
                 warning = False
             else:
                 warnings = []
@@ -217,6 +287,8 @@ class Keylist(object):
                     warning.append('Invalid fingerprints: {}'.format(', '.join(result['data']['invalid_fingerprints'])))
                 if len(result['data']['notfound_fingerprints']) > 0:
                     warnings.append('Fingerprints not found: {}'.format(', '.join(result['data']['notfound_fingerprints'])))
+                if len(cached_notfound_fingerprints) > 0:
+                    warnings.append('Fingerprints recently not found, not looked up this time: {}'.format(', '.join(cached_notfound_fingerprints)))
                 warning = ', '.join(warnings)
 
             self.last_checked = datetime.datetime.now()
@@ -224,7 +296,7 @@ class Keylist(object):
             self.warning = warning
             self.error = None
 
-            self.c.settings.save()
+            self.save_status()
 
         elif result['type'] == "cancel":
             self.c.log("Keylist", "interpret_result", "refresh canceled")
@@ -241,7 +313,13 @@ class Keylist(object):
             self.warning = None
             self.last_failed = datetime.datetime.now()
 
-            self.c.settings.save()
+            self.save_status()
+
+    def save_status(self):
+        try:
+            self.c.state_db.save_keylist_status(self)
+        except sqlite3.Error as e:
+            self.c.log("Keylist", "save_status", "error saving status: {}".format(e))
 
     def validate_format(self, msg_bytes):
         """
@@ -321,6 +399,13 @@ class Keylist(object):
 
         return self.default_keyserver
 
+    def authority_key_needs_keylist(self):
+        """
+        Fetching the authority key only depends on the downloaded keylist
+        when the keyserver comes from the keylist's metadata.
+        """
+        return not self.use_modern_keyserver and self.keyserver == b''
+
     def result_object(self, type, message=None, exception=None, data=None):
         """
         Returns an object that can be further evaluated.
@@ -332,19 +417,41 @@ class Keylist(object):
             "data": data
         }
 
-    def validate_authority_key(self):
+    def validate_authority_key(self, force=False):
         """
-        Fetches the authority key from keyservers.
+        Makes sure the authority key is in the keyring, isn't expired or
+        revoked, and is exported to disk, unless that was checked recently.
+        Forced syncs always check it again, to see if it's revoked.
         Returns a result object.
         """
-        # Fetch authority key from keyserver, make sure it's not expired or revoked
+        if not self.c.valid_fp(self.fingerprint):
+            return self.result_object('error', 'Invalid authority key fingerprint', data={"reset_last_checked": True})
+
+        # Keylists with the same authority key share the result
+        self.c.gpg.acquire_authority_key(self.fingerprint, self.deadline)
+        try:
+            if not force and self.c.gpg.authority_key_is_fresh(self.fingerprint):
+                self.c.log('Keylist', 'validate_authority_key', 'Public key {} was validated recently, not validating it again'.format(self.c.fp_to_keyid(self.fingerprint).decode()))
+                return self.result_object('success')
+
+            result = self.fetch_authority_key()
+            self.c.gpg.record_authority_key_validated(self.fingerprint, result['type'] == 'success')
+            return result
+        finally:
+            self.c.gpg.release_authority_key(self.fingerprint)
+
+    def fetch_authority_key(self):
+        """
+        Fetches the authority key from keyservers, makes sure it's not
+        expired or revoked, and saves it to disk. Returns a result object.
+        """
         try:
-            self.c.log('Keylist', 'validate_authority_key', 'Fetching public key {} {}'.format(self.c.fp_to_keyid(self.fingerprint).decode(), self.c.gpg.get_uid(self.fingerprint)))
+            self.c.log('Keylist', 'fetch_authority_key', 'Fetching public key {} {}'.format(self.c.fp_to_keyid(self.fingerprint).decode(), self.c.gpg.get_uid(self.fingerprint)))
             keyserver = self.get_keyserver()
-            self.c.log('Keylist', 'validate_authority_key', 'keyserver={}'.format(keyserver))
+            self.c.log('Keylist', 'fetch_authority_key', 'keyserver={}'.format(keyserver))
 
             # Retreive the authority key from the keyserver
-            self.c.gpg.recv_key(self.use_modern_keyserver, keyserver, self.fingerprint, self.use_proxy, self.proxy_host, self.proxy_port)
+            self.c.gpg.recv_key(self.use_modern_keyserver, keyserver, self.fingerprint, self.use_proxy, self.proxy_host, self.proxy_port, deadline=self.deadline)
 
             # Test the key for issues
             self.c.gpg.test_key(self.fingerprint)
@@ -416,13 +523,20 @@ class Keylist(object):
         except SignedWithWrongKey:
             return self.result_object('error', 'Valid signature, but signed with wrong authority key')
 
-    def refresh_build_fingerprints_lists(self, fingerprints):
+    def refresh_build_fingerprints_lists(self, fingerprints, force=False):
         """
         Takes a list of fingerprints, returns a tuple that contains a list
-        of fingerprints to fetch, and a list of invalid fingerprints
+        of fingerprints to fetch, and a list of invalid fingerprints.
+
+        Unless force is True, keys that were fetched recently and are still
+        in the keyring get skipped. See SyncState.is_due.
         """
         fingerprints_to_fetch = []
         invalid_fingerprints = []
+
+        if not force:
+            default_keyring = self.c.gpg.get_default_keyring_index()
+
         for fingerprint in fingerprints:
             try:
                 self.c.gpg.test_key(fingerprint)
@@ -438,65 +552,149 @@ class Keylist(object):
                 # Fetch all others
                 fingerprints_to_fetch.append(fingerprint)
 
+        if not force:
+            num_fingerprints = len(fingerprints_to_fetch)
+            fingerprints_to_fetch = [fingerprint for fingerprint in fingerprints_to_fetch if self.c.sync_state.is_due(fingerprint, default_keyring)]
+            self.c.log("Keylist", "refresh_build_fingerprints_lists", "{} of {} keys are due to be fetched".format(len(fingerprints_to_fetch), num_fingerprints))
+
         return (fingerprints_to_fetch, invalid_fingerprints)
 
+    def refresh_cached_notfound_fingerprints(self, fingerprints, fingerprints_to_fetch, invalid_fingerprints):
+        """
+        Returns the fingerprints that aren't getting fetched because they
+        weren't on the keyserver recently. Forced syncs fetch these too.
+        """
+        not_skipped = set(fingerprints_to_fetch) | set(invalid_fingerprints)
+        skipped_fingerprints = [fingerprint for fingerprint in fingerprints if fingerprint not in not_skipped]
+        return [self.c.clean_fp(fingerprint).decode() for fingerprint in skipped_fingerprints if self.c.sync_state.is_notfound_cached(fingerprint)]
+
     def refresh_fetch_fingerprints(self, fingerprints_to_fetch, total_keys, cancel_q):
         """
-        Takes a list of fingerprints to fetch, and loops through it fetching
-        them all. Returns a result object. On success, the result's data
-        includes a list of fingerprints that weren't found.
+        Takes a list of fingerprints to fetch, and fetches them all. With the
+        modern keyserver, up to settings.fetch_workers keys are downloaded at
+        once. Returns a result object. On success, the result's data includes
+        a list of fingerprints that weren't found, and with the modern
+        keyserver, how many of the fetched keys were new, updated or unchanged.
         """
         current_key = 0
         notfound_fingerprints = []
+        key_changes = None
 
         if self.use_modern_keyserver:
-            # Download all keys from keys.openpgp.org
-            pubkeys = []
-            for fingerprint in fingerprints_to_fetch:
-                fingerprint = self.c.clean_fp(fingerprint).decode()
-                try:
-                    pubkey = self.c.vks_get_by_fingerprint(fingerprint, self.use_proxy, self.proxy_host, self.proxy_port)
-                    if pubkey:
-                        pubkeys.append(pubkey)
-                except KeyserverError as e:
-                    return self.result_object('error', str(e))
-                except NotFoundOnKeyserver:
-                    notfound_fingerprints.append(fingerprint)
-
-                current_key += 1
-                self.q.add_message(RefresherMessageQueue.STATUS_IN_PROGRESS, total_keys, current_key)
-
-                if cancel_q.qsize() > 0:
-                    self.c.log("Keylist", "refresh_fetch_fingerprints", "canceling early {}".format(self.url.decode()))
-                    return self.result_object('cancel')
-
-            # Import them all to local keyring
-            self.c.gpg.import_to_default_homedir(pubkey=b'\n'.join(pubkeys))
+            # Download all keys from keys.openpgp.org, several at a time, and
+            # import each one into the local keyring as soon as it arrives.
+            # Keys that other keylists are also fetching only get downloaded
+            # and imported once.
+            # Keys that haven't changed since they were last imported get
+            # skipped, as long as they're still in the keyring.
+            default_keyring = self.c.gpg.get_default_keyring_index()
+            key_changes = {
+                FetchCoordinator.KEY_NEW: 0,
+                FetchCoordinator.KEY_UPDATED: 0,
+                FetchCoordinator.KEY_UNCHANGED: 0
+            }
+            import_stream = self.c.gpg.start_import_to_default_homedir()
+            self.c.fetch_coordinator.begin()
+            fingerprints_to_fetch = [self.c.clean_fp(fingerprint).decode() for fingerprint in fingerprints_to_fetch]
+            futures = {}
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(self.c.settings.fetch_workers)))
+            try:
+                for fingerprint in fingerprints_to_fetch:
+                    future = executor.submit(self.c.fetch_coordinator.fetch, fingerprint, self.use_proxy, self.proxy_host, self.proxy_port, import_stream, keyring=default_keyring, deadline=self.deadline)
+                    futures[future] = fingerprint
+
+                # Progress is reported in the order that downloads finish
+                for future in concurrent.futures.as_completed(futures):
+                    fingerprint = futures[future]
+                    try:
+                        pubkey, change = future.result()
+                        if pubkey:
+                            key_changes[change] += 1
+                            self.c.sync_state.record(fingerprint, SyncState.RESULT_SUCCESS)
+                        else:
+                            self.c.sync_state.record(fingerprint, SyncState.RESULT_ERROR)
+                    except KeyserverError as e:
+                        self.c.sync_state.record(fingerprint, SyncState.RESULT_ERROR, str(e))
+                        return self.result_object('error', str(e))
+                    except NotFoundOnKeyserver:
+                        notfound_fingerprints.append(fingerprint)
+                        self.c.sync_state.record(fingerprint, SyncState.RESULT_NOTFOUND)
+                    except ImportStreamClosed:
+                        self.c.sync_state.record(fingerprint, SyncState.RESULT_ERROR, 'gpg stopped importing keys')
+                        return self.result_object('error', 'gpg stopped importing keys')
+
+                    current_key += 1
+                    self.q.add_message(RefresherMessageQueue.STATUS_IN_PROGRESS, total_keys, current_key)
+
+                    if cancel_q.qsize() > 0:
+                        self.c.log("Keylist", "refresh_fetch_fingerprints", "canceling early {}".format(self.url.decode()))
+                        return self.result_object('cancel')
+            finally:
+                # Don't start any downloads that haven't started yet
+                for future in futures:
+                    future.cancel()
+                executor.shutdown(wait=False)
+                self.c.fetch_coordinator.end()
+                import_stream.close()
+                self.c.sync_state.save()
+
+            # Keep the not found fingerprints in keylist order
+            notfound_fingerprints.sort(key=fingerprints_to_fetch.index)
 
         else:
-            # Legacy keyservers
-            for fingerprint in fingerprints_to_fetch:
-                try:
-                    self.c.log('Keylist', 'refresh_fetch_fingerprints', 'Fetching public key {} {}'.format(self.c.fp_to_keyid(fingerprint).decode(), self.c.gpg.get_uid(fingerprint)))
-                    self.c.gpg.recv_key(self.use_modern_keyserver, self.get_keyserver(), fingerprint, self.use_proxy, self.proxy_host, self.proxy_port)
-                except KeyserverError:
-                    return self.result_object('error', 'Keyserver error')
-                except InvalidKeyserver:
-                    return self.result_object('error', 'Invalid keyserver')
-                except NotFoundOnKeyserver:
-                    notfound_fingerprints.append(fingerprint)
-
-                current_key += 1
-                self.q.add_message(RefresherMessageQueue.STATUS_IN_PROGRESS, total_keys, current_key)
-
-                if cancel_q.qsize() > 0:
-                    self.c.log("Keylist", "refresh_fetch_fingerprints", "canceling early {}".format(self.url.decode()))
-                    return self.result_object('cancel')
-
-        return self.result_object('success', data=notfound_fingerprints)
+            # Legacy keyservers, fetching a chunk of keys with each gpg call
+            # Keys are fetched into a temporary homedir, so they don't pile up
+            # in the persistent homedir that's only for authority keys
+            fingerprints_to_fetch = [self.c.clean_fp(fingerprint).decode() for fingerprint in fingerprints_to_fetch]
+            found_fingerprints = []
+            chunk_size = self.c.gpg.RECV_KEYS_CHUNK_SIZE
+            homedir = self.c.gpg.create_temp_homedir()
+            try:
+                for i in range(0, len(fingerprints_to_fetch), chunk_size):
+                    chunk = fingerprints_to_fetch[i:i+chunk_size]
+                    try:
+                        self.c.log('Keylist', 'refresh_fetch_fingerprints', 'Fetching {} public keys'.format(len(chunk)))
+                        chunk_notfound = self.c.gpg.recv_keys(self.get_keyserver(), chunk, homedir, deadline=self.deadline)
+                    except KeyserverError as e:
+                        return self.result_object('error', 'Keyserver error: {}'.format(e))
+                    except InvalidKeyserver:
+                        return self.result_object('error', 'Invalid keyserver')
+
+                    for fingerprint in chunk:
+                        if fingerprint in chunk_notfound:
+                            notfound_fingerprints.append(fingerprint)
+                            self.c.sync_state.record(fingerprint, SyncState.RESULT_NOTFOUND)
+                        else:
+                            found_fingerprints.append(fingerprint)
+                            self.c.sync_state.record(fingerprint, SyncState.RESULT_SUCCESS)
+
+                    current_key += len(chunk)
+                    self.q.add_message(RefresherMessageQueue.STATUS_IN_PROGRESS, total_keys, current_key)
+
+                    if cancel_q.qsize() > 0:
+                        self.c.log("Keylist", "refresh_fetch_fingerprints", "canceling early {}".format(self.url.decode()))
+                        return self.result_object('cancel')
+            finally:
+                # Import everything that was fetched into the default homedir at once
+                self.c.gpg.import_to_default_homedir(fp=found_fingerprints, homedir=homedir)
+                self.c.gpg.delete_temp_homedir(homedir)
+                self.c.sync_state.save()
+
+        return self.result_object('success', data={
+            "notfound_fingerprints": notfound_fingerprints,
+            "key_changes": key_changes
+        })
+
+    def refresh_record_keylist(self, fingerprints, invalid_fingerprints):
+        """
+        Store which keys are in this keylist in the state database.
+        """
+        fingerprints = [self.c.clean_fp(fingerprint).decode() for fingerprint in fingerprints if fingerprint not in invalid_fingerprints]
+        self.c.state_db.record_keylist(self, fingerprints, datetime.datetime.now().isoformat())
+        self.c.state_db.commit()
 
     @staticmethod
-    def refresh(common, cancel_q, keylist, force=False):
+    def refresh(common, cancel_q, keylist, force=False, pipeline=None):
         """
         This function syncs a keylist, importing all of the public key.
         q should be a RefresherMessageQueue object, and keylist is the
@@ -508,6 +706,24 @@ class Keylist(object):
         there's no error but the keylist is getting skipped, "cancel"
         if the refresh gets canceled early, and "success" on success.
         """
+        if pipeline is None:
+            keylist.deadline = Deadline(common, cancel_q)
+            pipeline = RefreshPipeline(common, keylist.deadline)
+            try:
+                return Keylist.refresh(common, cancel_q, keylist, force, pipeline)
+            except SyncCanceled:
+                common.log("Keylist", "refresh", "canceling early {}".format(keylist.url.decode()))
+                return keylist.result_object('cancel')
+            except DeadlineExceeded:
+                common.log("Keylist", "refresh", "deadline exceeded {}".format(keylist.url.decode()))
+                return keylist.result_object('error', 'Sync took longer than {} minutes'.format(common.settings.sync_timeout_minutes), data={"reset_last_checked": False})
+            except sqlite3.Error as e:
+                # Like when another GPG Sync process has the database locked for too long
+                common.log("Keylist", "refresh", "state database error {}: {}".format(keylist.url.decode(), e))
+                return keylist.result_object('error', 'Error updating sync state: {}'.format(e), data={"reset_last_checked": False})
+            finally:
+                pipeline.shutdown()
+
         common.log("Keylist", "refresh", "Refreshing keylist {}".format(keylist.url.decode()))
         keylist.q.add_message(RefresherMessageQueue.STATUS_STARTING)
 
@@ -516,12 +732,18 @@ class Keylist(object):
             return keylist.result_object('skip')
 
         # If there is no connection - skip
-        if not common.internet_available():
+        if not common.internet_available(keylist.use_proxy, keylist.proxy_host, keylist.proxy_port):
             common.log("Keylist", "refresh", "No internet, skipping {}".format(keylist.url.decode()))
             return keylist.result_object('skip')
 
+        # Start fetching the authority key while the keylist downloads, unless
+        # the keyserver to fetch it from is in the keylist
+        if not keylist.authority_key_needs_keylist():
+            pipeline.start('authority', lambda: keylist.validate_authority_key(force))
+
         # Download keylist URI
-        result = keylist.refresh_keylist_uri()
+        pipeline.start('keylist', keylist.refresh_keylist_uri)
+        result = pipeline.wait('keylist')
         if result['type'] == 'success':
             msg_bytes = result['data']
         else:
@@ -542,9 +764,11 @@ class Keylist(object):
                 legacy_keylist = LegacyKeylist(keylist)
                 legacy_keylist.get_fingerprint_list(msg_bytes)
 
-                # No exception yet? Let's treat it as a legacy keylist then
+                # No exception yet? Let's treat it as a legacy keylist then. It
+                # reuses the keylist download and authority key fetch that
+                # already started.
                 common.log("Keylist", "refresh", "Looks like a legacy keylist")
-                return LegacyKeylist.refresh(common, cancel_q, legacy_keylist, force)
+                return LegacyKeylist.refresh(common, cancel_q, legacy_keylist, force, pipeline)
 
             except InvalidFingerprints:
                 # Not a legacy keylist, throw error
@@ -553,8 +777,13 @@ class Keylist(object):
         except KeylistInvalid as e:
             return keylist.result_object('error', e.reason)
 
+        # Now that signature_uri (and the keyserver) are known, download the
+        # signature and fetch the authority key at the same time
+        pipeline.start('signature', keylist.refresh_keylist_signature_uri)
+        pipeline.start('authority', lambda: keylist.validate_authority_key(force))
+
         # Download keylist signature URI
-        result = keylist.refresh_keylist_signature_uri()
+        result = pipeline.wait('signature')
         if result['type'] == 'success':
             msg_sig_bytes = result['data']
         else:
@@ -565,7 +794,7 @@ class Keylist(object):
             return keylist.result_object('cancel')
 
         # Validate the authority key
-        result = keylist.validate_authority_key()
+        result = pipeline.wait('authority')
         if result['type'] != 'success':
             return result
 
@@ -582,26 +811,33 @@ class Keylist(object):
             common.log("Keylist", "refresh", "canceling early {}".format(keylist.url.decode()))
             return keylist.result_object('cancel')
 
-        # Communicate
-        total_keys = len(keylist.keylist_obj['keys'])
-        keylist.q.add_message(RefresherMessageQueue.STATUS_IN_PROGRESS, total_keys, 0)
-
         # Build list of fingerprints to fetch
         fingerprints = [key['fingerprint'] for key in keylist.keylist_obj['keys']]
-        fingerprints_to_fetch, invalid_fingerprints = keylist.refresh_build_fingerprints_lists(fingerprints)
+        fingerprints_to_fetch, invalid_fingerprints = keylist.refresh_build_fingerprints_lists(fingerprints, force)
+        cached_notfound_fingerprints = keylist.refresh_cached_notfound_fingerprints(fingerprints, fingerprints_to_fetch, invalid_fingerprints)
+
+        # Communicate
+        total_keys = len(fingerprints_to_fetch)
+        keylist.q.add_message(RefresherMessageQueue.STATUS_IN_PROGRESS, total_keys, 0)
 
         # Fetch fingerprints
         result = keylist.refresh_fetch_fingerprints(fingerprints_to_fetch, total_keys, cancel_q)
         if result['type'] == 'success':
-            notfound_fingerprints = result['data']
+            notfound_fingerprints = result['data']['notfound_fingerprints']
+            key_changes = result['data']['key_changes']
         else:
             return result
 
+        # Remember which keys are in this keylist
+        keylist.refresh_record_keylist(fingerprints, invalid_fingerprints)
+
         # All done
         return keylist.result_object('success', data={
             "keylist": keylist,
             "invalid_fingerprints": invalid_fingerprints,
-            "notfound_fingerprints": notfound_fingerprints
+            "notfound_fingerprints": notfound_fingerprints,
+            "cached_notfound_fingerprints": cached_notfound_fingerprints,
+            "key_changes": key_changes
         })
 
 
@@ -629,6 +865,7 @@ class LegacyKeylist(Keylist):
         self.error = keylist.error
         self.warning = keylist.warning
         self.q = keylist.q
+        self.deadline = keylist.deadline
 
     def get_keyserver(self):
         """
@@ -641,6 +878,9 @@ class LegacyKeylist(Keylist):
         # Otherwise return the default keyserver
         return self.default_keyserver
 
+    def authority_key_needs_keylist(self):
+        return False
+
     def get_fingerprint_list(self, msg_bytes):
         # Convert the message content into a list of fingerprints
         fingerprints = []
@@ -669,11 +909,29 @@ class LegacyKeylist(Keylist):
         return self.url + b'.sig'
 
     @staticmethod
-    def refresh(common, cancel_q, keylist, force=False):
+    def refresh(common, cancel_q, keylist, force=False, pipeline=None):
         """
         This function syncs a legacy keylist. It's exactly like Keylist.refresh,
         except it uses the legacy file format instead.
         """
+        if pipeline is None:
+            keylist.deadline = Deadline(common, cancel_q)
+            pipeline = RefreshPipeline(common, keylist.deadline)
+            try:
+                return LegacyKeylist.refresh(common, cancel_q, keylist, force, pipeline)
+            except SyncCanceled:
+                common.log("LegacyKeylist", "refresh", "canceling early {}".format(keylist.url.decode()))
+                return keylist.result_object('cancel')
+            except DeadlineExceeded:
+                common.log("LegacyKeylist", "refresh", "deadline exceeded {}".format(keylist.url.decode()))
+                return keylist.result_object('error', 'Sync took longer than {} minutes'.format(common.settings.sync_timeout_minutes), data={"reset_last_checked": False})
+            except sqlite3.Error as e:
+                # Like when another GPG Sync process has the database locked for too long
+                common.log("LegacyKeylist", "refresh", "state database error {}: {}".format(keylist.url.decode(), e))
+                return keylist.result_object('error', 'Error updating sync state: {}'.format(e), data={"reset_last_checked": False})
+            finally:
+                pipeline.shutdown()
+
         common.log("LegacyKeylist", "refresh", "Refreshing keylist {}".format(keylist.url.decode()))
         keylist.q.add_message(RefresherMessageQueue.STATUS_STARTING)
 
@@ -682,12 +940,18 @@ class LegacyKeylist(Keylist):
             return keylist.result_object('skip')
 
         # If there is no connection - skip
-        if not common.internet_available():
+        if not common.internet_available(keylist.use_proxy, keylist.proxy_host, keylist.proxy_port):
             common.log("LegacyKeylist", "refresh", "No internet, skipping {}".format(keylist.url.decode()))
             return keylist.result_object('skip')
 
+        # The signature URI is known up front, so download the keylist and
+        # its signature, and fetch the authority key, all at the same time
+        pipeline.start('keylist', keylist.refresh_keylist_uri)
+        pipeline.start('signature', keylist.refresh_keylist_signature_uri)
+        pipeline.start('authority', lambda: keylist.validate_authority_key(force))
+
         # Download keylist URI
-        result = keylist.refresh_keylist_uri()
+        result = pipeline.wait('keylist')
         if result['type'] == 'success':
             msg_bytes = result['data']
         else:
@@ -698,7 +962,7 @@ class LegacyKeylist(Keylist):
             return keylist.result_object('cancel')
 
         # Download keylist signature URI
-        result = keylist.refresh_keylist_signature_uri()
+        result = pipeline.wait('signature')
         if result['type'] == 'success':
             msg_sig_bytes = result['data']
         else:
@@ -709,7 +973,7 @@ class LegacyKeylist(Keylist):
             return keylist.result_object('cancel')
 
         # Validate the authority key
-        result = keylist.validate_authority_key()
+        result = pipeline.wait('authority')
         if result['type'] != 'success':
             return result
 
@@ -742,7 +1006,8 @@ class LegacyKeylist(Keylist):
             fingerprints = [fp.decode() for fp in keylist.get_fingerprint_list(msg_bytes)]
         except InvalidFingerprints as e:
             return keylist.result_object('error', 'Invalid fingerprints: {}'.format(e))
-        fingerprints_to_fetch, invalid_fingerprints = keylist.refresh_build_fingerprints_lists(fingerprints)
+        fingerprints_to_fetch, invalid_fingerprints = keylist.refresh_build_fingerprints_lists(fingerprints, force)
+        cached_notfound_fingerprints = keylist.refresh_cached_notfound_fingerprints(fingerprints, fingerprints_to_fetch, invalid_fingerprints)
 
         # Communicate
         total_keys = len(fingerprints_to_fetch)
@@ -751,13 +1016,19 @@ class LegacyKeylist(Keylist):
         # Fetch fingerprints
         result = keylist.refresh_fetch_fingerprints(fingerprints_to_fetch, total_keys, cancel_q)
         if result['type'] == 'success':
-            notfound_fingerprints = result['data']
+            notfound_fingerprints = result['data']['notfound_fingerprints']
+            key_changes = result['data']['key_changes']
         else:
             return result
 
+        # Remember which keys are in this keylist
+        keylist.refresh_record_keylist(fingerprints, invalid_fingerprints)
+
         # All done
         return keylist.result_object('success', data={
             "keylist": keylist,
             "invalid_fingerprints": invalid_fingerprints,
-            "notfound_fingerprints": notfound_fingerprints
+            "notfound_fingerprints": notfound_fingerprints,
+            "cached_notfound_fingerprints": cached_notfound_fingerprints,
+            "key_changes": key_changes
         })
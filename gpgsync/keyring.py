@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+GPG Sync
+Helps users have up-to-date public keys for everyone in their organization
+https://github.com/firstlookmedia/gpgsync
+Copyright (C) 2016 First Look Media
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import datetime
+
+
+class KeyInfo(object):
+    """
+    What the keyring knows about a single public key
+    """
+    def __init__(self, validity, keyid, expires):
+        self.fingerprint = None
+        self.validity = validity
+        self.expires = expires
+        self.uids = []
+
+        # Long key ids of the primary key and all of its subkeys, like b'0x1D07D43448FB8382'
+        self.keyids = [keyid]
+
+    @property
+    def revoked(self):
+        return self.validity == 'r'
+
+    @property
+    def expired(self):
+        # The listing might be older than the expiration date
+        if self.expires and self.expires <= datetime.datetime.now():
+            return True
+        return self.validity == 'e'
+
+
+class KeyringIndex(object):
+    """
+    An in-memory index of every public key in a keyring, built from a single
+    `gpg --with-colons --list-keys` listing. Maps fingerprints to KeyInfo
+    objects.
+    """
+    def __init__(self, listing):
+        self.keys = {}
+
+        key = None
+        expect_primary_fpr = False
+        for line in listing.split(b'\n'):
+            chunks = line.split(b':')
+            record_type = chunks[0]
+
+            if record_type == b'pub' and len(chunks) > 6:
+                expires = None
+                if chunks[6].isdigit():
+                    expires = datetime.datetime.fromtimestamp(int(chunks[6]))
+                key = KeyInfo(chunks[1].decode(), b'0x' + chunks[4], expires)
+                expect_primary_fpr = True
+
+            elif key is None:
+                continue
+
+            elif record_type == b'fpr' and expect_primary_fpr and len(chunks) > 9:
+                # The first fpr line after pub is the primary key's fingerprint
+                key.fingerprint = chunks[9].decode()
+                self.keys[key.fingerprint] = key
+                expect_primary_fpr = False
+
+            elif record_type == b'uid' and len(chunks) > 9:
+                key.uids.append(str(chunks[9], 'UTF-8', errors='replace'))
+
+            elif record_type == b'sub' and len(chunks) > 4:
+                key.keyids.append(b'0x' + chunks[4])
+                expect_primary_fpr = False
+
+    def get(self, fp):
+        """
+        Returns the KeyInfo for this fingerprint, or None if it's not in the keyring.
+        """
+        if isinstance(fp, bytes):
+            fp = fp.decode()
+        return self.keys.get(fp)
+
+    def __contains__(self, fp):
+        return self.get(fp) is not None
+
+    def __len__(self):
+        return len(self.keys)
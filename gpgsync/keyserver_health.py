@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+GPG Sync
+Helps users have up-to-date public keys for everyone in their organization
+https://github.com/firstlookmedia/gpgsync
+Copyright (C) 2016 First Look Media
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import time
+import random
+import threading
+
+from .gnupg import KeyserverError, RateLimited
+
+
+class KeyserverHealth(object):
+    """
+    Keeps track of how each keyserver is doing. Requests that fail get
+    retried with jittered exponential backoff. After FAILURE_THRESHOLD
+    failures in a row, the keyserver's circuit breaker opens, and requests to
+    it fail right away for COOL_DOWN seconds, instead of every key waiting
+    for its own timeout. After that, a single request is let through to see
+    if the keyserver has recovered.
+
+    Being rate limited doesn't count as failing. Those requests get retried
+    too, once the rate limiter lets them through again.
+    """
+    STATE_CLOSED = 'closed'
+    STATE_OPEN = 'open'
+    STATE_HALF_OPEN = 'half-open'
+
+    FAILURE_THRESHOLD = 5
+    COOL_DOWN = 120
+    RETRIES = 2
+    RETRY_DELAY = 1
+    MAX_RETRY_DELAY = 16
+
+    def __init__(self, common):
+        self.c = common
+        self.lock = threading.Lock()
+
+        # Maps keyservers to dicts with their state, how many times in a row
+        # they failed, and when the circuit breaker opened
+        self.keyservers = {}
+
+    def call(self, keyserver, func, deadline=None):
+        """
+        Call func, which talks to keyserver and raises KeyserverError if the
+        keyserver fails, and return what it returns. Failures are retried,
+        and if the circuit breaker is open, KeyserverError gets raised
+        without calling func at all.
+        """
+        for attempt in range(self.RETRIES + 1):
+            self.before_request(keyserver)
+            try:
+                value = func()
+            except RateLimited as e:
+                self.release_probe(keyserver)
+                if attempt == self.RETRIES:
+                    raise
+                self.c.log("KeyserverHealth", "call", "{} rate limited, retrying: {}".format(keyserver, e))
+            except KeyserverError as e:
+                self.record_failure(keyserver, e)
+                if attempt == self.RETRIES:
+                    raise
+                delay = self.get_retry_delay(attempt)
+                self.c.log("KeyserverHealth", "call", "{} failed, retrying in {:.1f} seconds: {}".format(keyserver, delay, e))
+                if deadline is None:
+                    time.sleep(delay)
+                else:
+                    deadline.sleep(delay)
+            except:
+                # Anything else (like the key not being there) means the
+                # keyserver is answering, or that the sync stopped
+                self.release_probe(keyserver)
+                raise
+            else:
+                self.record_success(keyserver)
+                return value
+
+    def get(self, keyserver):
+        if keyserver not in self.keyservers:
+            self.keyservers[keyserver] = {
+                'state': self.STATE_CLOSED,
+                'failures': 0,
+                'opened_at': None,
+                'probing': False
+            }
+        return self.keyservers[keyserver]
+
+    def get_state(self, keyserver):
+        with self.lock:
+            return self.get(keyserver)['state']
+
+    def get_retry_delay(self, attempt):
+        delay = min(self.RETRY_DELAY * (2 ** attempt), self.MAX_RETRY_DELAY)
+        return random.uniform(delay / 2, delay)
+
+    def before_request(self, keyserver):
+        with self.lock:
+            health = self.get(keyserver)
+            if health['state'] == self.STATE_CLOSED:
+                return
+
+            cool_down_left = health['opened_at'] + self.COOL_DOWN - time.monotonic()
+            if health['state'] == self.STATE_OPEN and cool_down_left <= 0:
+                self.c.log("KeyserverHealth", "before_request", "{} circuit half-open, trying one request".format(keyserver))
+                health['state'] = self.STATE_HALF_OPEN
+
+            if health['state'] == self.STATE_HALF_OPEN and not health['probing']:
+                health['probing'] = True
+                return
+
+            raise KeyserverError("{} is unavailable after {} failures in a row, not trying again for {} seconds".format(
+                keyserver, health['failures'], max(1, int(cool_down_left))))
+
+    def release_probe(self, keyserver):
+        with self.lock:
+            self.get(keyserver)['probing'] = False
+
+    def record_success(self, keyserver):
+        with self.lock:
+            health = self.get(keyserver)
+            if health['state'] != self.STATE_CLOSED:
+                self.c.log("KeyserverHealth", "record_success", "{} recovered, circuit closed".format(keyserver))
+            health['state'] = self.STATE_CLOSED
+            health['failures'] = 0
+            health['opened_at'] = None
+            health['probing'] = False
+
+    def record_failure(self, keyserver, e):
+        with self.lock:
+            health = self.get(keyserver)
+            health['failures'] += 1
+            health['probing'] = False
+
+            if health['state'] == self.STATE_HALF_OPEN or health['failures'] >= self.FAILURE_THRESHOLD:
+                if health['state'] != self.STATE_OPEN:
+                    self.c.log("KeyserverHealth", "record_failure", "{} failed {} times in a row, circuit open for {} seconds: {}".format(keyserver, health['failures'], self.COOL_DOWN, e))
+                health['state'] = self.STATE_OPEN
+                health['opened_at'] = time.monotonic()
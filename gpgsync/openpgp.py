@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+GPG Sync
+Helps users have up-to-date public keys for everyone in their organization
+https://github.com/firstlookmedia/gpgsync
+Copyright (C) 2016 First Look Media
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import base64
+import binascii
+import hashlib
+
+# Just enough of OpenPGP (RFC 4880 and RFC 9580) to split transferable public
+# keys into packets and compute key fingerprints, without spawning gpg. This
+# doesn't verify any signatures, gpg still does that when keys get imported.
+
+TAG_PUBLIC_KEY = 6
+TAG_PUBLIC_SUBKEY = 14
+
+
+class OpenPGPError(Exception):
+    pass
+
+
+class PublicKey(object):
+    """
+    A transferable public key: a primary key and its subkeys
+    """
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.subkey_fingerprints = []
+
+    def fingerprints(self):
+        return [self.fingerprint] + self.subkey_fingerprints
+
+
+def dearmor(data):
+    """
+    Decode ASCII-armored data into binary. If there are several armored
+    blocks, they get concatenated.
+
+    The CRC24 checksum line is skipped rather than checked (RFC 9580 makes it
+    optional). The fingerprint comparison and gpg's own parsing on import
+    catch corrupted data anyway.
+    """
+    binary = b''
+    lines = iter(data.replace(b'\r\n', b'\n').split(b'\n'))
+    found_block = False
+
+    for line in lines:
+        if not (line.startswith(b'-----BEGIN PGP ') and line.rstrip().endswith(b'-----')):
+            continue
+        found_block = True
+
+        # Skip armor headers, up to the blank line
+        body_lines = []
+        for line in lines:
+            line = line.strip()
+            if line == b'':
+                break
+            if b': ' not in line:
+                # No headers and no blank line, this is already the body
+                body_lines.append(line)
+                break
+
+        finished = False
+        for line in lines:
+            line = line.strip()
+            if line.startswith(b'-----END PGP '):
+                finished = True
+                break
+            if line != b'' and not line.startswith(b'='):
+                body_lines.append(line)
+
+        if not finished:
+            raise OpenPGPError('Armored block is missing its END line')
+
+        try:
+            block = base64.b64decode(b''.join(body_lines), validate=True)
+        except (binascii.Error, ValueError) as e:
+            raise OpenPGPError('Invalid base64 in armored block: {}'.format(e))
+
+        binary += block
+
+    if not found_block:
+        raise OpenPGPError('No armored block found')
+
+    return binary
+
+
+def is_armored(data):
+    return data.lstrip().startswith(b'-----BEGIN PGP ')
+
+
+def parse_packets(data):
+    """
+    Split binary OpenPGP data into a list of (tag, body) tuples.
+    """
+    packets = []
+    pos = 0
+    length = len(data)
+
+    while pos < length:
+        header = data[pos]
+        pos += 1
+        if not header & 0x80:
+            raise OpenPGPError('Invalid packet header at offset {}'.format(pos - 1))
+
+        if header & 0x40:
+            # New format packet
+            tag = header & 0x3F
+            body = b''
+            while True:
+                if pos >= length:
+                    raise OpenPGPError('Truncated packet length')
+                first = data[pos]
+                if first < 192:
+                    body_len = first
+                    pos += 1
+                    partial = False
+                elif first < 224:
+                    if pos + 2 > length:
+                        raise OpenPGPError('Truncated packet length')
+                    body_len = ((first - 192) << 8) + data[pos + 1] + 192
+                    pos += 2
+                    partial = False
+                elif first == 255:
+                    if pos + 5 > length:
+                        raise OpenPGPError('Truncated packet length')
+                    body_len = int.from_bytes(data[pos + 1:pos + 5], 'big')
+                    pos += 5
+                    partial = False
+                else:
+                    body_len = 1 << (first & 0x1F)
+                    pos += 1
+                    partial = True
+
+                if pos + body_len > length:
+                    raise OpenPGPError('Truncated packet body')
+                body += data[pos:pos + body_len]
+                pos += body_len
+
+                if not partial:
+                    break
+        else:
+            # Old format packet
+            tag = (header >> 2) & 0x0F
+            length_type = header & 0x03
+            if length_type == 3:
+                # Indeterminate length, the packet runs to the end of the data
+                body_len = length - pos
+            else:
+                num_octets = 1 << length_type
+                if pos + num_octets > length:
+                    raise OpenPGPError('Truncated packet length')
+                body_len = int.from_bytes(data[pos:pos + num_octets], 'big')
+                pos += num_octets
+
+            if pos + body_len > length:
+                raise OpenPGPError('Truncated packet body')
+            body = data[pos:pos + body_len]
+            pos += body_len
+
+        if tag == 0:
+            raise OpenPGPError('Packet has reserved tag 0')
+        packets.append((tag, body))
+
+    return packets
+
+
+def key_fingerprint(body):
+    """
+    Compute the fingerprint of a public key or public subkey packet body, as
+    an uppercase hex string.
+    """
+    if len(body) < 6:
+        raise OpenPGPError('Key packet is too short')
+
+    version = body[0]
+    if version == 4:
+        if len(body) > 0xFFFF:
+            raise OpenPGPError('Key packet is too long')
+        return hashlib.sha1(b'\x99' + len(body).to_bytes(2, 'big') + body).hexdigest().upper()
+    if version == 5:
+        return hashlib.sha256(b'\x9a' + len(body).to_bytes(4, 'big') + body).hexdigest().upper()
+    if version == 6:
+        return hashlib.sha256(b'\x9b' + len(body).to_bytes(4, 'big') + body).hexdigest().upper()
+
+    raise OpenPGPError('Unsupported key version {}'.format(version))
+
+
+def parse_public_keys(data):
+    """
+    Parse armored or binary transferable public keys. Returns a list of
+    PublicKey objects.
+    """
+    if is_armored(data):
+        data = dearmor(data)
+
+    keys = []
+    for tag, body in parse_packets(data):
+        if tag == TAG_PUBLIC_KEY:
+            keys.append(PublicKey(key_fingerprint(body)))
+        elif tag == TAG_PUBLIC_SUBKEY:
+            if not keys:
+                raise OpenPGPError('Public subkey packet without a primary key')
+            keys[-1].subkey_fingerprints.append(key_fingerprint(body))
+
+    return keys
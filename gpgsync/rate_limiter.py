@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+GPG Sync
+Helps users have up-to-date public keys for everyone in their organization
+https://github.com/firstlookmedia/gpgsync
+Copyright (C) 2016 First Look Media
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import time
+import threading
+import datetime
+import email.utils
+
+
+class EndpointLimiter(object):
+    """
+    Paces requests to a single API endpoint with a token bucket, and limits
+    how many can run at once. Both adapt to how the server is doing: they
+    shrink when it answers with 429 Too Many Requests or gets slow, and grow
+    again while it keeps up. Nothing gets sent until a Retry-After is over.
+    """
+    MAX_RATE = 20.0
+    MIN_RATE = 0.5
+    BURST = 5
+
+    # Responses count as the server struggling when they take longer than
+    # LATENCY_TARGET seconds and SLOW_FACTOR times the endpoint's usual
+    # latency, so endpoints that are always slow, like onion services over
+    # Tor, don't get throttled for being themselves
+    LATENCY_TARGET = 2.0
+    SLOW_FACTOR = 2.0
+
+    # How much each response moves the usual latency (an exponentially
+    # weighted moving average)
+    LATENCY_WEIGHT = 0.1
+
+    # How long to pause after a 429 without a Retry-After header, and the
+    # longest Retry-After to honor
+    DEFAULT_RETRY_AFTER = 5
+    MAX_RETRY_AFTER = 300
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, common, endpoint, max_concurrency):
+        self.c = common
+        self.endpoint = endpoint
+        self.cond = threading.Condition()
+
+        self.rate = self.MAX_RATE
+        self.tokens = float(self.BURST)
+        self.refilled_at = time.monotonic()
+
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = self.max_concurrency
+        self.active = 0
+        self.successes = 0
+
+        # The endpoint's usual latency, once there's been a response
+        self.baseline_latency = None
+
+        self.paused_until = 0
+
+    def acquire(self, deadline=None):
+        """
+        Wait until a request can be sent. Every acquire must be followed by
+        a release.
+        """
+        with self.cond:
+            while True:
+                if deadline is not None:
+                    deadline.check()
+
+                now = time.monotonic()
+                self.refill(now)
+
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.active >= self.concurrency:
+                    wait = None
+                elif self.tokens < 1:
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    self.tokens -= 1
+                    self.active += 1
+                    return
+
+                if deadline is not None:
+                    wait = self.POLL_INTERVAL if wait is None else min(wait, self.POLL_INTERVAL)
+                self.cond.wait(wait)
+
+    def release(self, latency=None, retry_after=None, rate_limited=False):
+        """
+        A request is done. latency is how long it took, if it got a response.
+        If it was rate limited, retry_after is the Retry-After header.
+        """
+        with self.cond:
+            self.active -= 1
+
+            if rate_limited:
+                pause = self.parse_retry_after(retry_after)
+                self.paused_until = max(self.paused_until, time.monotonic() + pause)
+                self.rate = max(self.MIN_RATE, self.rate / 2)
+                self.concurrency = max(1, self.concurrency // 2)
+                self.successes = 0
+                self.c.log("EndpointLimiter", "release", "{} rate limited, pausing {} seconds, now {} at once and {:.1f} per second".format(self.endpoint, pause, self.concurrency, self.rate))
+
+            elif latency is not None and self.is_slow(latency):
+                if self.concurrency > 1:
+                    self.concurrency -= 1
+                    self.c.log("EndpointLimiter", "release", "{} is slow ({:.1f} seconds), now {} at once".format(self.endpoint, latency, self.concurrency))
+                self.successes = 0
+
+            elif latency is not None:
+                # Speed back up after a full round of fast responses
+                self.successes += 1
+                if self.successes >= self.concurrency:
+                    self.successes = 0
+                    self.rate = min(self.MAX_RATE, self.rate * 2)
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+
+            if latency is not None:
+                if self.baseline_latency is None:
+                    self.baseline_latency = latency
+                else:
+                    self.baseline_latency += self.LATENCY_WEIGHT * (latency - self.baseline_latency)
+
+            self.cond.notify_all()
+
+    def is_slow(self, latency):
+        threshold = self.LATENCY_TARGET
+        if self.baseline_latency is not None:
+            threshold = max(threshold, self.baseline_latency * self.SLOW_FACTOR)
+        return latency > threshold
+
+    def refill(self, now):
+        self.tokens = min(float(self.BURST), self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def parse_retry_after(self, retry_after):
+        """
+        Retry-After is either a number of seconds or an HTTP date.
+        """
+        seconds = self.DEFAULT_RETRY_AFTER
+        if retry_after:
+            try:
+                seconds = int(retry_after)
+            except ValueError:
+                try:
+                    date = email.utils.parsedate_to_datetime(retry_after)
+                    seconds = (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    pass
+        return min(max(0, seconds), self.MAX_RETRY_AFTER)
+
+
+class RateLimiter(object):
+    """
+    An EndpointLimiter for each API endpoint, shared by all keylists, so
+    keys.openpgp.org's clearnet and onion endpoints get paced separately.
+    """
+    def __init__(self, common):
+        self.c = common
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def get(self, endpoint):
+        with self.lock:
+            if endpoint not in self.endpoints:
+                self.endpoints[endpoint] = EndpointLimiter(self.c, endpoint, int(self.c.settings.fetch_workers))
+            return self.endpoints[endpoint]
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+GPG Sync
+Helps users have up-to-date public keys for everyone in their organization
+https://github.com/firstlookmedia/gpgsync
+Copyright (C) 2016 First Look Media
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import datetime
+import random
+
+
+class Scheduler(object):
+    """
+    Works out when each keylist is next due to sync, so the GUI can sleep
+    until then instead of waking up every minute to ask every keylist.
+    """
+    # Never wake up more often than this, or sleep longer than this (in case
+    # the computer slept, or the clock changed)
+    MIN_SLEEP = 60
+    MAX_SLEEP = 60*60
+
+    # After a failed sync, wait this long before trying again
+    FAILED_RETRY = 15*60
+
+    # Syncs that were skipped (like when offline) or canceled don't update
+    # the keylist, so retry them after this long, doubling each time up to
+    # FAILED_RETRY
+    UNFINISHED_RETRY = 60
+
+    # Add up to this much random delay (but no more than a tenth of the update
+    # interval), so that every client doesn't hit the keylist host at once
+    MAX_JITTER = 10*60
+
+    def __init__(self, common):
+        self.c = common
+
+        # Maps keylists whose last sync didn't succeed to (when to try
+        # again, how many times in a row it didn't succeed)
+        self.retries = {}
+
+    def get_update_interval(self):
+        return datetime.timedelta(hours=float(self.c.settings.update_interval_hours))
+
+    def next_due(self, keylist):
+        """
+        Returns the datetime when this keylist should sync next, or None if
+        it should sync right away.
+        """
+        if not keylist.last_checked:
+            return None
+
+        due = keylist.last_checked + self.get_update_interval()
+
+        # Don't retry failed syncs too often
+        if keylist.last_failed and keylist.last_failed > keylist.last_checked:
+            due = max(due, keylist.last_failed + datetime.timedelta(seconds=self.FAILED_RETRY))
+
+        return due
+
+    def get_retry(self, keylist):
+        if keylist in self.retries:
+            return self.retries[keylist][0]
+        return None
+
+    def record_result(self, keylist, result, now=None):
+        """
+        Call this after each sync, so keylists that didn't sync successfully
+        don't get retried right away.
+        """
+        if result['type'] == 'success':
+            self.retries.pop(keylist, None)
+            return
+
+        if now is None:
+            now = datetime.datetime.now()
+        count = self.retries[keylist][1] + 1 if keylist in self.retries else 1
+        exponent = min(count - 1, 16)
+        seconds = min(self.UNFINISHED_RETRY * (2 ** exponent), self.FAILED_RETRY)
+        self.retries[keylist] = (now + datetime.timedelta(seconds=seconds), count)
+
+    def is_due(self, keylist, now=None):
+        if now is None:
+            now = datetime.datetime.now()
+        retry = self.get_retry(keylist)
+        if retry and retry > now:
+            return False
+        due = self.next_due(keylist)
+        return due is None or due <= now
+
+    def due_keylists(self, keylists, now=None):
+        return [keylist for keylist in keylists if not keylist.syncing and self.is_due(keylist, now)]
+
+    def seconds_until_next_sync(self, keylists, now=None):
+        """
+        How long to sleep before the next keylist is due, including jitter.
+        Keylists that are syncing right now get rescheduled when they finish.
+        """
+        if now is None:
+            now = datetime.datetime.now()
+
+        seconds = self.MAX_SLEEP
+        for keylist in keylists:
+            if keylist.syncing:
+                continue
+            due = self.next_due(keylist)
+            retry = self.get_retry(keylist)
+            if retry and (due is None or retry > due):
+                due = retry
+            if due is None:
+                seconds = 0
+                break
+            seconds = min(seconds, (due - now).total_seconds())
+
+        if seconds >= self.MAX_SLEEP:
+            return self.MAX_SLEEP
+
+        seconds += self.get_jitter()
+        return min(max(seconds, self.MIN_SLEEP), self.MAX_SLEEP)
+
+    def get_jitter(self):
+        max_jitter = min(self.MAX_JITTER, self.get_update_interval().total_seconds() / 10)
+        return random.uniform(0, max_jitter)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+GPG Sync
+Helps users have up-to-date public keys for everyone in their organization
+https://github.com/firstlookmedia/gpgsync
+Copyright (C) 2016 First Look Media
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import threading
+import requests
+
+
+class SessionManager(object):
+    """
+    Keeps one pooled, keep-alive requests.Session for each combination of
+    proxy configuration and CA bundle, so that keylists, signatures and keys
+    downloaded over the same route reuse their TCP and TLS connections.
+    """
+    def __init__(self, common):
+        self.c = common
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get_session(self, proxies=None, verify=None):
+        key = (tuple(sorted(proxies.items())) if proxies else None, verify)
+
+        with self.lock:
+            if key not in self.sessions:
+                self.c.log("SessionManager", "get_session", "creating session, proxies={}, verify={}".format(proxies, verify))
+                self.sessions[key] = self.new_session(proxies, verify)
+            return self.sessions[key]
+
+    def new_session(self, proxies, verify):
+        pool_size = max(1, int(self.c.settings.http_pool_size))
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        # Proxies and the CA bundle get passed with each request (see
+        # Common.requests_get), since environment proxies like HTTPS_PROXY
+        # would win over session.proxies. Proxied sessions don't look at the
+        # environment at all, so Tor traffic can never go anywhere else.
+        if proxies:
+            session.trust_env = False
+
+        return session
+
+    def close(self):
+        """
+        Close all sessions, for example after the pool size or proxy settings
+        change. New sessions get created the next time they're needed.
+        """
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
@@ -20,17 +20,34 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import os
 import json
+import atexit
 import pickle
 import shutil
+import threading
 import dateutil.parser as date_parser
 
 from .keylist import Keylist
 
 
 class Settings(object):
+    # Saves requested with save_later get written this many seconds later, so
+    # a burst of them (like many keylists finishing syncing at once) only
+    # writes settings.json once
+    SAVE_DELAY = 1.0
+
     def __init__(self, common):
         self.c = common
 
+        self.lock = threading.RLock()
+        self.dirty = False
+        self.save_timer = None
+
+        # What the autostart file was last configured for
+        self.configured_run_automatically = None
+
+        # Write any pending changes before quitting
+        atexit.register(self.flush)
+
         self.system = self.c.os
         if self.system == 'Windows':
             appdata = os.environ['APPDATA']
@@ -106,6 +123,50 @@ class Settings(object):
                     self.automatic_update_proxy_port = str.encode(self.settings['automatic_update_proxy_port'])
                 else:
                     self.automatic_update_proxy_port = b'9050'
+                if 'fetch_workers' in self.settings:
+                    self.fetch_workers = self.settings['fetch_workers']
+                else:
+                    self.fetch_workers = 8
+                if 'http_pool_size' in self.settings:
+                    self.http_pool_size = self.settings['http_pool_size']
+                else:
+                    self.http_pool_size = 10
+                if 'key_refresh_age_hours' in self.settings:
+                    self.key_refresh_age_hours = self.settings['key_refresh_age_hours']
+                else:
+                    self.key_refresh_age_hours = 24
+                if 'connect_timeout' in self.settings:
+                    self.connect_timeout = self.settings['connect_timeout']
+                else:
+                    self.connect_timeout = 10
+                if 'read_timeout' in self.settings:
+                    self.read_timeout = self.settings['read_timeout']
+                else:
+                    self.read_timeout = 30
+                if 'sync_timeout_minutes' in self.settings:
+                    self.sync_timeout_minutes = self.settings['sync_timeout_minutes']
+                else:
+                    self.sync_timeout_minutes = 60
+                if 'max_concurrent_syncs' in self.settings:
+                    self.max_concurrent_syncs = self.settings['max_concurrent_syncs']
+                else:
+                    self.max_concurrent_syncs = 4
+                if 'max_gpg_processes' in self.settings:
+                    self.max_gpg_processes = self.settings['max_gpg_processes']
+                else:
+                    self.max_gpg_processes = 4
+                if 'notfound_max_backoff_hours' in self.settings:
+                    self.notfound_max_backoff_hours = self.settings['notfound_max_backoff_hours']
+                else:
+                    self.notfound_max_backoff_hours = 168
+                if 'connectivity_probe' in self.settings:
+                    self.connectivity_probe = self.settings['connectivity_probe']
+                else:
+                    self.connectivity_probe = 'www.example.com:80'
+                if 'authority_key_max_age_hours' in self.settings:
+                    self.authority_key_max_age_hours = self.settings['authority_key_max_age_hours']
+                else:
+                    self.authority_key_max_age_hours = 24
 
                 self.configure_run_automatically()
 
@@ -133,6 +194,17 @@ class Settings(object):
             self.automatic_update_use_proxy = False
             self.automatic_update_proxy_host = b'127.0.0.1'
             self.automatic_update_proxy_port = b'9050'
+            self.fetch_workers = 8
+            self.http_pool_size = 10
+            self.key_refresh_age_hours = 24
+            self.connect_timeout = 10
+            self.read_timeout = 30
+            self.sync_timeout_minutes = 60
+            self.max_concurrent_syncs = 4
+            self.max_gpg_processes = 4
+            self.notfound_max_backoff_hours = 168
+            self.connectivity_probe = 'www.example.com:80'
+            self.authority_key_max_age_hours = 24
             self.save()
             self.configure_run_automatically()
 
@@ -140,8 +212,36 @@ class Settings(object):
         if resave_settings:
             self.save()
 
+    def save_later(self):
+        """
+        Mark the settings as changed, and save them in the background soon.
+        """
+        with self.lock:
+            self.dirty = True
+            if self.save_timer is None:
+                self.save_timer = threading.Timer(self.SAVE_DELAY, self.flush)
+                self.save_timer.daemon = True
+                self.save_timer.start()
+
+    def flush(self):
+        """
+        If there are changes waiting to be saved, save them now.
+        """
+        with self.lock:
+            if self.save_timer is not None:
+                self.save_timer.cancel()
+                self.save_timer = None
+            if not self.dirty:
+                return True
+            return self.save()
+
     def save(self):
+        with self.lock:
+            return self._save()
+
+    def _save(self):
         self.c.log("Settings", "save")
+        self.dirty = False
         self.settings = {
             'keylists': [e.serialize() for e in self.keylists],
             'run_automatically': self.run_automatically,
@@ -151,17 +251,29 @@ class Settings(object):
             'update_interval_hours': self.update_interval_hours,
             'automatic_update_use_proxy': self.automatic_update_use_proxy,
             'automatic_update_proxy_host': self.automatic_update_proxy_host,
-            'automatic_update_proxy_port': self.automatic_update_proxy_port
-
+            'automatic_update_proxy_port': self.automatic_update_proxy_port,
+            'fetch_workers': self.fetch_workers,
+            'http_pool_size': self.http_pool_size,
+            'key_refresh_age_hours': self.key_refresh_age_hours,
+            'connect_timeout': self.connect_timeout,
+            'read_timeout': self.read_timeout,
+            'sync_timeout_minutes': self.sync_timeout_minutes,
+            'max_concurrent_syncs': self.max_concurrent_syncs,
+            'max_gpg_processes': self.max_gpg_processes,
+            'notfound_max_backoff_hours': self.notfound_max_backoff_hours,
+            'connectivity_probe': self.connectivity_probe,
+            'authority_key_max_age_hours': self.authority_key_max_age_hours
         }
 
         if not os.path.exists(self.appdata_path):
             os.makedirs(self.appdata_path)
 
-        with open(os.path.join(self.appdata_path, 'settings.json'), 'w') as settings_file:
-            json.dump(self.settings, settings_file, default=self.c.serialize_settings, indent=4)
+        settings_filename = os.path.join(self.appdata_path, 'settings.json')
+        data = json.dumps(self.settings, default=self.c.serialize_settings, indent=4)
+        self.c.write_file_atomic(settings_filename, data.encode())
 
-        self.configure_run_automatically()
+        if self.run_automatically != self.configured_run_automatically:
+            self.configure_run_automatically()
         return True
 
     def configure_run_automatically(self):
@@ -194,11 +306,14 @@ class Settings(object):
                         self.c.log("Settings", "configure_run_automatically", "GPG Sync not installed, skipping run automatically")
                 else:
                     buf = open(self.c.get_resource_path(share_filename)).read()
-                    open(autorun_filename, 'w').write(buf)
+                    if not os.path.exists(autorun_filename) or open(autorun_filename).read() != buf:
+                        open(autorun_filename, 'w').write(buf)
             else:
                 if os.path.exists(autorun_filename):
                     os.remove(autorun_filename)
 
+        self.configured_run_automatically = self.run_automatically
+
 
     """
     If necessary, migrate settings from 0.1.0 (in an old location and in pickle
@@ -273,6 +388,17 @@ class Settings(object):
                     self.automatic_update_proxy_port = settings['automatic_update_proxy_port']
                 else:
                     self.automatic_update_proxy_port = b'9050'
+                self.fetch_workers = 8
+                self.http_pool_size = 10
+                self.key_refresh_age_hours = 24
+                self.connect_timeout = 10
+                self.read_timeout = 30
+                self.sync_timeout_minutes = 60
+                self.max_concurrent_syncs = 4
+                self.max_gpg_processes = 4
+                self.notfound_max_backoff_hours = 168
+                self.connectivity_probe = 'www.example.com:80'
+                self.authority_key_max_age_hours = 24
 
                 # Save the settings into new location, and delete the old settings file
                 self.save()
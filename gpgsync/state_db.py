@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+GPG Sync
+Helps users have up-to-date public keys for everyone in their organization
+https://github.com/firstlookmedia/gpgsync
+Copyright (C) 2016 First Look Media
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import sqlite3
+import threading
+
+
+class StateDB(object):
+    """
+    An SQLite database in the appdata directory, for state that's about
+    individual keys and keylists rather than settings: when each key was
+    last fetched and how that went, when each keylist was last synced and
+    which keys it includes, when authority keys were validated, and HTTP
+    cache validators. Everything is looked up by indexed columns.
+
+    One connection is shared by all threads, guarded by a lock. Each write
+    is committed right away in its own short transaction, since the GUI and
+    a cron --sync can use the same database at the same time, and a
+    transaction left open during a long sync would lock the other one out.
+    With WAL and synchronous=NORMAL, commits don't wait for the disk.
+    """
+    SCHEMA_VERSION = 1
+
+    # How long to wait for another process to finish writing, in seconds
+    BUSY_TIMEOUT = 30
+
+    def __init__(self, common, appdata_path):
+        self.c = common
+        self.appdata_path = appdata_path
+        self.filename = os.path.join(appdata_path, 'state.db')
+        self.lock = threading.Lock()
+
+        if not os.path.exists(appdata_path):
+            os.makedirs(appdata_path)
+
+        self.conn = sqlite3.connect(self.filename, timeout=self.BUSY_TIMEOUT, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.create_schema()
+
+    def create_schema(self):
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= self.SCHEMA_VERSION:
+            return
+
+        self.c.log("StateDB", "create_schema", "creating schema version {}".format(self.SCHEMA_VERSION))
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS keys (
+                fingerprint TEXT PRIMARY KEY,
+                last_fetched TEXT,
+                result TEXT,
+                notfound_count INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                content_hash TEXT
+            );
+            CREATE TABLE IF NOT EXISTS keylists (
+                keylist_id TEXT PRIMARY KEY,
+                url TEXT,
+                fingerprint TEXT,
+                last_checked TEXT,
+                last_synced TEXT,
+                last_failed TEXT,
+                error TEXT,
+                warning TEXT,
+                key_count INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS keylist_keys (
+                keylist_id TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                PRIMARY KEY (keylist_id, fingerprint)
+            );
+            CREATE INDEX IF NOT EXISTS keylist_keys_fingerprint ON keylist_keys (fingerprint);
+            CREATE TABLE IF NOT EXISTS http_cache (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT
+            );
+            CREATE TABLE IF NOT EXISTS authority_keys (
+                fingerprint TEXT PRIMARY KEY,
+                validated_at TEXT
+            );
+        ''')
+        self.conn.execute('PRAGMA user_version = {}'.format(self.SCHEMA_VERSION))
+        self.conn.commit()
+
+    def load_keylist_status(self, settings):
+        """
+        Load the sync status of each keylist in settings. Older versions saved
+        it in settings.json, so keylists the database doesn't know about yet
+        keep the status that was loaded from there, which gets moved into the
+        database, and settings.json is saved again without it.
+        """
+        migrated = False
+        for keylist in settings.keylists:
+            with self.lock:
+                row = self.conn.execute('SELECT {} FROM keylists WHERE keylist_id=?'.format(', '.join(keylist.STATUS_KEYS)),
+                    (self.get_keylist_id(keylist),)).fetchone()
+            if row is not None:
+                keylist.load(dict(row))
+            elif any(getattr(keylist, k) is not None for k in keylist.STATUS_KEYS):
+                self.save_keylist_status(keylist)
+                migrated = True
+
+        if migrated:
+            self.c.log("StateDB", "load_keylist_status", "migrated keylist status from settings.json")
+            settings.save()
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+    # Keys
+
+    def get_key(self, fp):
+        """
+        Returns the row for this fingerprint, or None.
+        """
+        with self.lock:
+            return self.conn.execute('SELECT * FROM keys WHERE fingerprint=?', (fp,)).fetchone()
+
+    def record_key(self, fp, result, last_fetched, error=None):
+        notfound = 1 if result == 'notfound' else 0
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO keys (fingerprint) VALUES (?)', (fp,))
+            self.conn.execute('''
+                UPDATE keys SET
+                    last_fetched=?,
+                    result=?,
+                    last_error=?,
+                    notfound_count=CASE WHEN ? THEN notfound_count+1 ELSE 0 END
+                WHERE fingerprint=?
+            ''', (last_fetched, result, error, notfound, fp))
+
+    def get_key_hash(self, fp):
+        """
+        Returns the SHA-256 of the last imported copy of this key, or None.
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT content_hash FROM keys WHERE fingerprint=?', (fp,)).fetchone()
+        if row is None:
+            return None
+        return row['content_hash']
+
+    def set_key_hash(self, fp, content_hash):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO keys (fingerprint) VALUES (?)', (fp,))
+            self.conn.execute('UPDATE keys SET content_hash=? WHERE fingerprint=?', (content_hash, fp))
+
+    # Keylists
+
+    def get_keylist_id(self, keylist):
+        return '{}:{}'.format(self.c.clean_fp(keylist.fingerprint).decode(), keylist.url.decode())
+
+    def record_keylist(self, keylist, fingerprints, last_synced):
+        """
+        Remember which keys are in a keylist, after it synced.
+        """
+        keylist_id = self.get_keylist_id(keylist)
+        with self.lock, self.conn:
+            self.insert_keylist(keylist_id, keylist)
+            self.conn.execute('UPDATE keylists SET last_synced=?, key_count=? WHERE keylist_id=?', (last_synced, len(fingerprints), keylist_id))
+            self.conn.execute('DELETE FROM keylist_keys WHERE keylist_id=?', (keylist_id,))
+            self.conn.executemany('INSERT OR IGNORE INTO keylist_keys (keylist_id, fingerprint) VALUES (?, ?)',
+                [(keylist_id, fp) for fp in fingerprints])
+
+    def save_keylist_status(self, keylist):
+        """
+        Save when a keylist was last checked, synced and failed, and its error
+        and warning.
+        """
+        keylist_id = self.get_keylist_id(keylist)
+        status = keylist.serialize_status()
+        with self.lock, self.conn:
+            self.insert_keylist(keylist_id, keylist)
+            self.conn.execute('UPDATE keylists SET {} WHERE keylist_id=?'.format(', '.join('{}=?'.format(k) for k in keylist.STATUS_KEYS)),
+                [status.get(k) for k in keylist.STATUS_KEYS] + [keylist_id])
+
+    def insert_keylist(self, keylist_id, keylist):
+        self.conn.execute('INSERT OR IGNORE INTO keylists (keylist_id, url, fingerprint) VALUES (?, ?, ?)',
+            (keylist_id, keylist.url.decode(), self.c.clean_fp(keylist.fingerprint).decode()))
+
+    def get_keylist_fingerprints(self, keylist):
+        with self.lock:
+            rows = self.conn.execute('SELECT fingerprint FROM keylist_keys WHERE keylist_id=? ORDER BY fingerprint', (self.get_keylist_id(keylist),)).fetchall()
+        return [row['fingerprint'] for row in rows]
+
+    def get_fingerprint_keylists(self, fp):
+        """
+        Returns the ids of the keylists that include this fingerprint.
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT keylist_id FROM keylist_keys WHERE fingerprint=? ORDER BY keylist_id', (fp,)).fetchall()
+        return [row['keylist_id'] for row in rows]
+
+    # Authority keys
+
+    def get_authority_key_validated(self, fp):
+        """
+        Returns when this authority key was last successfully validated, or None.
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT validated_at FROM authority_keys WHERE fingerprint=?', (fp,)).fetchone()
+        if row is None:
+            return None
+        return row['validated_at']
+
+    def record_authority_key_validated(self, fp, validated_at):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO authority_keys (fingerprint, validated_at) VALUES (?, ?)', (fp, validated_at))
+
+    # HTTP cache
+
+    def get_http_validators(self, url):
+        """
+        Returns (etag, last_modified), or None if the url isn't cached.
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT etag, last_modified FROM http_cache WHERE url=?', (url,)).fetchone()
+        if row is None:
+            return None
+        return row['etag'], row['last_modified']
+
+    def set_http_validators(self, url, etag, last_modified):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO http_cache (url, etag, last_modified) VALUES (?, ?, ?)', (url, etag, last_modified))
+
+    def delete_http_validators(self, url):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM http_cache WHERE url=?', (url,))
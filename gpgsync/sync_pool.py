@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+GPG Sync
+Helps users have up-to-date public keys for everyone in their organization
+https://github.com/firstlookmedia/gpgsync
+Copyright (C) 2016 First Look Media
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import concurrent.futures
+
+from .keylist import Keylist
+
+
+class SyncPool(object):
+    """
+    The pool of threads that keylists sync in, shared by the GUI, --sync and
+    --daemon, so that only settings.max_concurrent_syncs keylists sync at
+    once. Other keylists wait their turn.
+    """
+    def __init__(self, common):
+        self.c = common
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(self.c.settings.max_concurrent_syncs)))
+
+    def submit(self, keylist, cancel_q, force=False):
+        """
+        Queue up a keylist to sync. Returns a Future of Keylist.refresh's
+        result object.
+        """
+        return self.executor.submit(self.refresh, keylist, cancel_q, force)
+
+    def refresh(self, keylist, cancel_q, force):
+        # Don't bother starting if it got canceled while waiting
+        if cancel_q.qsize() > 0:
+            self.c.log("SyncPool", "refresh", "canceled before starting {}".format(keylist.url.decode()))
+            return keylist.result_object('cancel')
+
+        return Keylist.refresh(self.c, cancel_q, keylist, force=force)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+GPG Sync
+Helps users have up-to-date public keys for everyone in their organization
+https://github.com/firstlookmedia/gpgsync
+Copyright (C) 2016 First Look Media
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import datetime
+import dateutil.parser as date_parser
+
+
+class SyncState(object):
+    """
+    Remembers when each fingerprint was last fetched from a keyserver, and
+    how that went, so that normal syncs only need to fetch the keys that are
+    actually due. It's stored in the StateDB.
+    """
+    RESULT_SUCCESS = 'success'
+    RESULT_NOTFOUND = 'notfound'
+    RESULT_ERROR = 'error'
+
+    # Keys that expire this soon get fetched every sync, to pick up new
+    # expiration dates as soon as possible
+    EXPIRING_SOON = datetime.timedelta(days=7)
+
+    # Keys that aren't on the keyserver get looked up again after this long,
+    # doubling each time they're still not found, up to
+    # settings.notfound_max_backoff_hours
+    NOTFOUND_BACKOFF = datetime.timedelta(hours=1)
+
+    def __init__(self, common, state_db):
+        self.c = common
+        self.db = state_db
+
+    def record(self, fp, result, error=None):
+        fp = self.c.clean_fp(fp).decode()
+        self.db.record_key(fp, result, datetime.datetime.now().isoformat(), error)
+
+    def is_due(self, fp, keyring):
+        """
+        Should this fingerprint be fetched in a normal (not forced) sync?
+        keyring is a KeyringIndex of the default keyring.
+        """
+        fp = self.c.clean_fp(fp).decode()
+        state = self.db.get_key(fp)
+
+        # New to the keylist
+        if not state:
+            return True
+
+        # Not on the keyserver last time
+        if state['result'] == self.RESULT_NOTFOUND:
+            return not self.is_notfound_cached(fp)
+
+        # Not successfully fetched last time
+        if state['result'] != self.RESULT_SUCCESS:
+            return True
+
+        # Missing from the keyring
+        key = keyring.get(fp)
+        if key is None:
+            return True
+
+        # Expired, or expiring soon
+        now = datetime.datetime.now()
+        if key.expired or (key.expires and key.expires - now <= self.EXPIRING_SOON):
+            return True
+
+        # Hasn't been fetched for a while
+        max_age = datetime.timedelta(hours=float(self.c.settings.key_refresh_age_hours))
+        try:
+            last_fetched = date_parser.parse(state['last_fetched'])
+        except:
+            return True
+        return now - last_fetched >= max_age
+
+    def get_notfound_backoff(self, notfound_count):
+        max_backoff = datetime.timedelta(hours=float(self.c.settings.notfound_max_backoff_hours))
+        exponent = min(max(notfound_count - 1, 0), 32)
+        return min(self.NOTFOUND_BACKOFF * (2 ** exponent), max_backoff)
+
+    def is_notfound_cached(self, fp):
+        """
+        Was this fingerprint recently not found on the keyserver, so that
+        it's not worth looking up again yet?
+        """
+        fp = self.c.clean_fp(fp).decode()
+        state = self.db.get_key(fp)
+        if not state or state['result'] != self.RESULT_NOTFOUND:
+            return False
+
+        try:
+            last_fetched = date_parser.parse(state['last_fetched'])
+        except:
+            return False
+        return datetime.datetime.now() - last_fetched < self.get_notfound_backoff(state['notfound_count'])
+
+    def save(self):
+        self.db.commit()
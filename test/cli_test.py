@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import os
+import signal
+import datetime
+import threading
+import pytest
+
+from gpgsync import cli
+from gpgsync.keylist import Keylist
+
+
+@pytest.fixture
+def restore_signals():
+    handlers = {signum: signal.getsignal(signum) for signum in [signal.SIGTERM, signal.SIGINT, signal.SIGHUP]}
+    yield
+    for signum, handler in handlers.items():
+        signal.signal(signum, handler)
+
+
+def new_keylist(common, url, last_checked=None):
+    keylist = Keylist(common)
+    keylist.url = url
+    keylist.last_checked = last_checked
+    return keylist
+
+
+def test_describe_result(keylist):
+    keylist.warning = 'Fingerprints not found: AAAA'
+    assert cli.describe_result({'type': 'success'}, keylist) == 'Sync successful. Warning: Fingerprints not found: AAAA'
+    key_changes = {'new': 1, 'updated': 2, 'unchanged': 3}
+    assert cli.describe_result({'type': 'success', 'data': {'key_changes': key_changes}}, keylist) == 'Sync successful. Keys: 1 new, 2 updated, 3 unchanged. Warning: Fingerprints not found: AAAA'
+    keylist.error = 'Invalid keyserver'
+    assert cli.describe_result({'type': 'error'}, keylist) == 'Sync failed. Error: Invalid keyserver'
+    assert cli.describe_result({'type': 'cancel'}, keylist) == 'Sync canceled.'
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGHUP'), reason="needs POSIX signals")
+def test_daemon_syncs_due_keylists(common, monkeypatch, restore_signals):
+    due = new_keylist(common, b'https://www.example.com/due.json')
+    not_due = new_keylist(common, b'https://www.example.com/not_due.json', datetime.datetime.now())
+    common.settings.keylists = [due, not_due]
+
+    synced = []
+
+    def refresh(common, cancel_q, keylist, force=False):
+        synced.append(keylist)
+        os.kill(os.getpid(), signal.SIGTERM)
+        return keylist.result_object('skip')
+
+    monkeypatch.setattr(Keylist, 'refresh', staticmethod(refresh))
+    monkeypatch.setattr(Keylist, 'interpret_result', lambda self, result: None)
+
+    cli.Daemon(common).run()
+    assert synced == [due]
+    assert not due.syncing
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGHUP'), reason="needs POSIX signals")
+def test_daemon_skipped_sync_not_retried_right_away(common, monkeypatch, restore_signals):
+    keylist = new_keylist(common, b'https://www.example.com/offline.json')
+    common.settings.keylists = [keylist]
+
+    synced = []
+
+    def refresh(common, cancel_q, keylist, force=False):
+        # Like when the internet isn't available
+        synced.append(keylist)
+        return keylist.result_object('skip')
+
+    monkeypatch.setattr(Keylist, 'refresh', staticmethod(refresh))
+    monkeypatch.setattr(Keylist, 'interpret_result', lambda self, result: None)
+
+    timer = threading.Timer(0.5, os.kill, [os.getpid(), signal.SIGTERM])
+    timer.start()
+    try:
+        cli.Daemon(common).run()
+    finally:
+        timer.cancel()
+    assert synced == [keylist]
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGHUP'), reason="needs POSIX signals")
+def test_daemon_reloads_settings(common, monkeypatch, restore_signals):
+    old_keylist = new_keylist(common, b'https://www.example.com/old.json')
+    new_keylist_ = new_keylist(common, b'https://www.example.com/new.json')
+    common.settings.keylists = [old_keylist]
+
+    events = []
+
+    def refresh(common, cancel_q, keylist, force=False):
+        events.append(keylist.url)
+        if keylist is old_keylist:
+            # Reloading waits for this sync to finish
+            os.kill(os.getpid(), signal.SIGHUP)
+        else:
+            os.kill(os.getpid(), signal.SIGTERM)
+        return keylist.result_object('skip')
+
+    def load():
+        events.append('load')
+        common.settings.keylists = [new_keylist_]
+
+    monkeypatch.setattr(Keylist, 'refresh', staticmethod(refresh))
+    monkeypatch.setattr(Keylist, 'interpret_result', lambda self, result: None)
+    monkeypatch.setattr(common.settings, 'load', load)
+
+    cli.Daemon(common).run()
+    assert events == [old_keylist.url, 'load', new_keylist_.url]
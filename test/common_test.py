@@ -1,4 +1,12 @@
 # -*- coding: utf-8 -*-
+import io
+import os
+import queue
+import pytest
+import requests
+
+from gpgsync.deadline import Deadline, SyncCanceled
+
 
 def test_valid_fp(common):
     assert common.valid_fp(b'734F 6E70 7434 ECA6 C007  E1AE 82BD 6C96 16DA BB79')
@@ -31,3 +39,125 @@ def test_clean_keyserver(common):
     assert common.clean_keyserver(b'hkps://hkps.pool.sks-keyservers.net/') == b'hkps://hkps.pool.sks-keyservers.net:443'
     assert common.clean_keyserver(b'hkps://hkps.pool.sks-keyservers.net:4444') == b'hkps://hkps.pool.sks-keyservers.net:4444'
     assert common.clean_keyserver(b'ldap://somekeyserver') == b'hkp://somekeyserver:80'
+
+
+def test_sessions_are_reused(common):
+    proxies = {'https': 'socks5h://127.0.0.1:9050', 'http': 'socks5h://127.0.0.1:9050'}
+    session = common.sessions.get_session()
+    assert common.sessions.get_session() is session
+    assert common.sessions.get_session(dict(proxies)) is common.sessions.get_session(dict(proxies))
+    assert common.sessions.get_session(proxies) is not session
+    assert common.sessions.get_session(verify='/tmp/cacert.pem') is not session
+
+
+def test_requests_get_proxies_beat_environment(common, monkeypatch):
+    proxies = {'https': 'socks5h://127.0.0.1:9050', 'http': 'socks5h://127.0.0.1:9050'}
+    monkeypatch.setenv('HTTPS_PROXY', 'http://corp-proxy:3128')
+    monkeypatch.setenv('HTTP_PROXY', 'http://corp-proxy:3128')
+    sent = []
+
+    def send(self, request, **kwargs):
+        sent.append(kwargs['proxies'])
+        response = requests.Response()
+        response.status_code = 200
+        response.request = request
+        return response
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, 'send', send)
+
+    # Tor requests always go through Tor
+    common.requests_get('https://keys.openpgp.org/', proxies)
+    assert sent[-1]['https'] == 'socks5h://127.0.0.1:9050'
+
+    # Requests without a proxy still use the environment
+    common.requests_get('https://keys.openpgp.org/')
+    assert sent[-1]['https'] == 'http://corp-proxy:3128'
+
+
+def test_requests_get_deadline(common, monkeypatch):
+    common.settings.connect_timeout = 10
+    common.settings.read_timeout = 30
+    sent = []
+
+    def send(self, request, **kwargs):
+        sent.append(kwargs)
+        response = requests.Response()
+        response.status_code = 200
+        response.request = request
+        response.raw = io.BytesIO(b'x' * 50000)
+        return response
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, 'send', send)
+
+    # The request is bounded by the time the sync has left
+    r = common.requests_get('https://keys.openpgp.org/', deadline=Deadline(common, queue.Queue(), 5))
+    assert r.content == b'x' * 50000
+    assert sent[-1]['stream']
+    assert 0 < sent[-1]['timeout'][1] <= 5
+
+    # A canceled sync doesn't start the request
+    cancel_q = queue.Queue()
+    cancel_q.put(True)
+    with pytest.raises(SyncCanceled):
+        common.requests_get('https://keys.openpgp.org/', deadline=Deadline(common, cancel_q, 5))
+    assert len(sent) == 1
+
+
+def test_write_file_atomic(common, tmpdir):
+    filename = os.path.join(str(tmpdir), 'settings.json')
+    common.write_file_atomic(filename, b'old')
+    common.write_file_atomic(filename, b'new')
+    assert open(filename, 'rb').read() == b'new'
+
+    # No temp files left behind
+    assert [f for f in os.listdir(str(tmpdir)) if f.endswith('.tmp')] == []
+
+
+def test_sessions_pool_size(common):
+    common.settings.http_pool_size = 3
+    common.sessions.close()
+    adapter = common.sessions.get_session().get_adapter('https://keys.openpgp.org/')
+    assert adapter._pool_maxsize == 3
+
+
+def test_vks_get_by_fingerprint_verifies_fingerprint(common, monkeypatch):
+    pubkey = open('test/gpg_files/gpgsync_test_pubkey.asc', 'rb').read()
+
+    class FakeResponse(object):
+        status_code = 200
+        content = pubkey
+
+    monkeypatch.setattr(common, 'requests_get', lambda url, proxies=None, deadline=None: FakeResponse())
+    process_count = common.gpg.process_count
+
+    assert common.vks_get_by_fingerprint('3B72C32B49CBB5BBDD57440E1D07D43448FB8382', False, None, None) == pubkey
+    assert common.vks_get_by_fingerprint('D86B4D4BB5DFDD378B58D4D3F121AC6230396C33', False, None, None) is None
+
+    # Verifying fingerprints doesn't spawn gpg
+    assert common.gpg.process_count == process_count
+
+
+def test_vks_get_by_fingerprint_rate_limited(common, monkeypatch):
+    pubkey = open('test/gpg_files/gpgsync_test_pubkey.asc', 'rb').read()
+    responses = []
+
+    class FakeResponse(object):
+        def __init__(self, status_code, content=b'', headers=None):
+            self.status_code = status_code
+            self.content = content
+            self.headers = headers or {}
+            self.text = content.decode()
+
+    def requests_get(url, proxies=None, deadline=None):
+        if not responses:
+            responses.append(429)
+            return FakeResponse(429, b'rate limited', {'Retry-After': '0'})
+        responses.append(200)
+        return FakeResponse(200, pubkey)
+
+    monkeypatch.setattr(common, 'requests_get', requests_get)
+
+    # Rate limited requests get retried, and slow down later ones
+    assert common.vks_get_by_fingerprint('3B72C32B49CBB5BBDD57440E1D07D43448FB8382', False, None, None) == pubkey
+    assert responses == [429, 200]
+    limiter = common.rate_limiter.get('https://keys.openpgp.org/vks/v1')
+    assert limiter.concurrency < limiter.max_concurrency
+    assert common.keyserver_health.get_state('https://keys.openpgp.org/vks/v1') == common.keyserver_health.STATE_CLOSED
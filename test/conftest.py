@@ -1,10 +1,8 @@
 # -*- coding: utf-8 -*-
 import pytest
 import sys
-import tempfile
 
 from gpgsync.common import Common
-from gpgsync.gnupg import GnuPG
 from gpgsync.keylist import Keylist, LegacyKeylist
 
 # Set GPG Sync to dev mode, so it looks for resources in the right place
@@ -13,12 +11,12 @@ sys.gpgsync_dev = True
 
 # Generate a Common singleton
 @pytest.fixture
-def common():
-    appdata_path = tempfile.mkdtemp()
-
-    common = Common(verbose=True)
-    common.gpg = GnuPG(common, appdata_path=appdata_path)
-    return common
+def common(tmp_path, monkeypatch):
+    # Keep the settings, state database, homedir and default keyring out of
+    # the real profile
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setenv('APPDATA', str(tmp_path))
+    return Common(verbose=True)
 
 
 # Generate an keylist
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from gpgsync.connectivity import ConnectivityMonitor
+
+
+def test_connectivity_is_cached(common, monkeypatch):
+    monitor = ConnectivityMonitor(common)
+    probes = []
+    monkeypatch.setattr(monitor, 'probe', lambda probe, proxy: probes.append((probe, proxy)) or True)
+
+    assert monitor.is_available()
+    assert monitor.is_available()
+    assert probes == [('www.example.com:80', None)]
+
+    # Each proxy gets its own probe
+    assert monitor.is_available(True, b'127.0.0.1', b'9050')
+    assert probes[-1] == ('www.example.com:80', (b'127.0.0.1', b'9050'))
+    assert len(probes) == 2
+
+    # Until the cache expires
+    monitor.invalidate()
+    assert monitor.is_available()
+    assert len(probes) == 3
+
+
+def test_connectivity_shares_probes(common, monkeypatch):
+    monitor = ConnectivityMonitor(common)
+    probes = []
+    release = threading.Event()
+
+    def probe(probe, proxy):
+        probes.append(probe)
+        release.wait(5)
+        return False
+
+    monkeypatch.setattr(monitor, 'probe', probe)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(monitor.is_available())) for _ in range(4)]
+    for t in threads:
+        t.start()
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert probes == ['www.example.com:80']
+    assert results == [False] * 4
+
+
+def test_connectivity_probe_target(common, monkeypatch):
+    monitor = ConnectivityMonitor(common)
+    connections = []
+
+    class FakeSocket(object):
+        def close(self):
+            pass
+
+    def create_connection(address, timeout=None):
+        connections.append(address)
+        return FakeSocket()
+
+    monkeypatch.setattr('gpgsync.connectivity.socket.create_connection', create_connection)
+    common.settings.connectivity_probe = 'intranet.example.org:443'
+    assert monitor.is_available()
+    assert connections == [('intranet.example.org', 443)]
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import sys
+import time
+import queue
+import subprocess
+import pytest
+
+from gpgsync.deadline import Deadline, SyncCanceled, DeadlineExceeded
+
+
+def test_deadline_check(common):
+    cancel_q = queue.Queue()
+    Deadline(common, cancel_q, 60).check()
+
+    with pytest.raises(DeadlineExceeded):
+        Deadline(common, cancel_q, 0).check()
+
+    cancel_q.put(True)
+    with pytest.raises(SyncCanceled):
+        Deadline(common, cancel_q, 60).check()
+
+
+def test_deadline_default_length(common):
+    common.settings.sync_timeout_minutes = 2
+    assert Deadline(common, queue.Queue()).seconds == 120
+
+
+def test_deadline_timeout(common):
+    common.settings.connect_timeout = 10
+    common.settings.read_timeout = 30
+    connect_timeout, read_timeout = Deadline(common, queue.Queue(), 5).timeout()
+    assert 0 < connect_timeout <= 5
+    assert 0 < read_timeout <= 5
+
+    assert Deadline(common, queue.Queue(), 600).timeout() == (10, 30)
+
+
+class FakeResponse(object):
+    def __init__(self, chunks, cancel_q=None):
+        self.chunks = chunks
+        self.cancel_q = cancel_q
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            yield chunk
+            if self.cancel_q is not None:
+                self.cancel_q.put(True)
+
+    def close(self):
+        self.closed = True
+
+
+def test_deadline_download(common):
+    deadline = Deadline(common, queue.Queue(), 60)
+    assert deadline.download(FakeResponse([b'abc', b'def'])) == b'abcdef'
+
+
+def test_deadline_download_cancel(common):
+    # The sync gets canceled after the first chunk arrives
+    cancel_q = queue.Queue()
+    deadline = Deadline(common, cancel_q, 60)
+    r = FakeResponse([b'abc', b'def', b'ghi'], cancel_q)
+    with pytest.raises(SyncCanceled):
+        deadline.download(r)
+    assert r.closed
+
+
+def test_deadline_communicate_kills_process(common):
+    deadline = Deadline(common, queue.Queue(), 0.5)
+    p = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'],
+        stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        deadline.communicate(p, b'input')
+    assert time.monotonic() - start < 5
+    assert p.returncode is not None
+
+
+def test_deadline_communicate(common):
+    deadline = Deadline(common, queue.Queue(), 60)
+    p = subprocess.Popen([sys.executable, '-c', 'import sys; sys.stdout.write(sys.stdin.read())'],
+        stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert deadline.communicate(p, b'hello') == (b'hello', b'')
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+import queue
+import threading
+import pytest
+
+from gpgsync.gnupg import KeyserverError, NotFoundOnKeyserver, ImportStreamClosed
+from gpgsync.deadline import Deadline, SyncCanceled
+from gpgsync.keyring import KeyringIndex
+from gpgsync.keylist import Keylist, RefresherMessageQueue
+
+
+class FakeImportStream(object):
+    def __init__(self, rejected=()):
+        self.imported = []
+        self.closed = False
+        self.rejected = rejected
+        self.on_imported = []
+
+    def write(self, pubkey, fp=None, on_imported=None):
+        if self.closed:
+            return False
+        self.imported.append(pubkey)
+        if pubkey not in self.rejected and on_imported is not None:
+            self.on_imported.append(on_imported)
+        return True
+
+    def close(self):
+        self.closed = True
+        for on_imported in self.on_imported:
+            on_imported()
+        return b'', b''
+
+
+def fetch_in_thread(coordinator, fp, import_stream, results, deadline=None):
+    def fetch():
+        try:
+            results.append(coordinator.fetch(fp, False, None, None, import_stream, deadline=deadline))
+        except Exception as e:
+            results.append(e)
+
+    t = threading.Thread(target=fetch)
+    t.start()
+    return t
+
+
+def test_fetch_coordinator_shares_downloads(common, monkeypatch):
+    coordinator = common.fetch_coordinator
+    downloads = []
+    release = threading.Event()
+
+    def vks_get_by_fingerprint(fp, use_proxy, proxy_host, proxy_port, deadline=None):
+        downloads.append(fp)
+        release.wait(5)
+        return fp.encode()
+
+    monkeypatch.setattr(common, 'vks_get_by_fingerprint', vks_get_by_fingerprint)
+    import_stream = FakeImportStream()
+    results = []
+
+    coordinator.begin()
+    coordinator.begin()
+    threads = [fetch_in_thread(coordinator, 'A' * 40, import_stream, results) for _ in range(3)]
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert downloads == ['A' * 40]
+    assert results == [(b'A' * 40, 'new')] * 3
+    assert import_stream.imported == [b'A' * 40]
+
+    # Already fetched during this sync
+    assert coordinator.fetch('A' * 40, False, None, None, import_stream) == (b'A' * 40, 'new')
+    assert downloads == ['A' * 40]
+
+    # Once every keylist is done, keys get fetched again
+    coordinator.end()
+    coordinator.end()
+    coordinator.begin()
+    coordinator.fetch('A' * 40, False, None, None, import_stream)
+    coordinator.end()
+    assert downloads == ['A' * 40, 'A' * 40]
+
+
+def test_fetch_coordinator_errors(common, monkeypatch):
+    coordinator = common.fetch_coordinator
+    downloads = []
+
+    def vks_get_by_fingerprint(fp, use_proxy, proxy_host, proxy_port, deadline=None):
+        downloads.append(fp)
+        if fp == 'A' * 40:
+            raise NotFoundOnKeyserver(fp)
+        raise KeyserverError('keys.openpgp.org: rate limited')
+
+    monkeypatch.setattr(common, 'vks_get_by_fingerprint', vks_get_by_fingerprint)
+    import_stream = FakeImportStream()
+
+    coordinator.begin()
+    for _ in range(2):
+        with pytest.raises(NotFoundOnKeyserver):
+            coordinator.fetch('A' * 40, False, None, None, import_stream)
+        with pytest.raises(KeyserverError):
+            coordinator.fetch('B' * 40, False, None, None, import_stream)
+    coordinator.end()
+
+    # Not found is remembered, keyserver errors get retried
+    assert downloads == ['A' * 40, 'B' * 40, 'B' * 40]
+
+
+def test_fetch_coordinator_owner_canceled(common, monkeypatch):
+    coordinator = common.fetch_coordinator
+    owner_started = threading.Event()
+
+    def vks_get_by_fingerprint(fp, use_proxy, proxy_host, proxy_port, deadline=None):
+        if deadline is not None:
+            # The owner's download hangs until its sync gets canceled
+            owner_started.set()
+            deadline.sleep(5)
+        return fp.encode()
+
+    monkeypatch.setattr(common, 'vks_get_by_fingerprint', vks_get_by_fingerprint)
+    import_stream = FakeImportStream()
+    cancel_q = queue.Queue()
+
+    coordinator.begin()
+    owner_results = []
+    owner = fetch_in_thread(coordinator, 'A' * 40, import_stream, owner_results, Deadline(common, cancel_q, 60))
+    assert owner_started.wait(5)
+
+    waiter_results = []
+    waiter = fetch_in_thread(coordinator, 'A' * 40, import_stream, waiter_results)
+    cancel_q.put(True)
+    owner.join()
+    waiter.join()
+    coordinator.end()
+
+    assert isinstance(owner_results[0], SyncCanceled)
+    assert waiter_results == [(b'A' * 40, 'new')]
+    assert import_stream.imported == [b'A' * 40]
+
+
+def test_fetch_coordinator_owner_stream_closed(common, monkeypatch):
+    coordinator = common.fetch_coordinator
+    owner_started = threading.Event()
+    release = threading.Event()
+    downloads = []
+
+    def vks_get_by_fingerprint(fp, use_proxy, proxy_host, proxy_port, deadline=None):
+        downloads.append(fp)
+        if len(downloads) == 1:
+            # The owner's download finishes after its sync stopped
+            owner_started.set()
+            release.wait(5)
+        return fp.encode()
+
+    monkeypatch.setattr(common, 'vks_get_by_fingerprint', vks_get_by_fingerprint)
+    owner_stream = FakeImportStream()
+    waiter_stream = FakeImportStream()
+
+    coordinator.begin()
+    coordinator.begin()
+    owner_results = []
+    owner = fetch_in_thread(coordinator, 'A' * 40, owner_stream, owner_results)
+    assert owner_started.wait(5)
+
+    waiter_results = []
+    waiter = fetch_in_thread(coordinator, 'A' * 40, waiter_stream, waiter_results)
+    owner_stream.close()
+    release.set()
+    owner.join()
+    waiter.join()
+    coordinator.end()
+    coordinator.end()
+
+    # The waiter imports it into its own stream instead
+    assert isinstance(owner_results[0], ImportStreamClosed)
+    assert waiter_results == [(b'A' * 40, 'new')]
+    assert owner_stream.imported == []
+    assert waiter_stream.imported == [b'A' * 40]
+    assert len(downloads) == 2
+
+
+def test_refresh_fetch_fingerprints_shared_between_keylists(common, monkeypatch):
+    downloads = []
+    lock = threading.Lock()
+
+    def vks_get_by_fingerprint(fp, use_proxy, proxy_host, proxy_port, deadline=None):
+        with lock:
+            downloads.append(fp)
+        return fp.encode()
+
+    monkeypatch.setattr(common, 'vks_get_by_fingerprint', vks_get_by_fingerprint)
+    import_streams = []
+
+    def start_import_to_default_homedir():
+        import_streams.append(FakeImportStream())
+        return import_streams[-1]
+    monkeypatch.setattr(common.gpg, 'start_import_to_default_homedir', start_import_to_default_homedir)
+
+    # Both keylists start fetching before either one finishes
+    common.fetch_coordinator.begin()
+    results = []
+    threads = []
+    for fingerprints in [[b'A' * 40, b'B' * 40, b'C' * 40], [b'B' * 40, b'C' * 40, b'D' * 40]]:
+        keylist = Keylist(common)
+        keylist.q = RefresherMessageQueue()
+        t = threading.Thread(target=lambda k=keylist, f=fingerprints: results.append(k.refresh_fetch_fingerprints(f, len(f), queue.Queue())))
+        threads.append(t)
+        t.start()
+    for t in threads:
+        t.join()
+    common.fetch_coordinator.end()
+
+    assert [result['type'] for result in results] == ['success', 'success']
+    assert sorted(downloads) == ['A' * 40, 'B' * 40, 'C' * 40, 'D' * 40]
+    assert sorted(import_streams[0].imported + import_streams[1].imported) == [b'A' * 40, b'B' * 40, b'C' * 40, b'D' * 40]
+
+
+def test_fetch_coordinator_skips_unchanged_keys(common, monkeypatch):
+    coordinator = common.fetch_coordinator
+    pubkeys = {'A' * 40: b'old', 'B' * 40: b'old', 'C' * 40: b'old'}
+    monkeypatch.setattr(common, 'vks_get_by_fingerprint', lambda fp, use_proxy, proxy_host, proxy_port, deadline=None: pubkeys[fp])
+    keyring = KeyringIndex('\n'.join(['pub:-:4096:1:{0}:1474591596:::-:::scESC::::::23::0:\nfpr:::::::::{1}:'.format(fp[-16:], fp) for fp in ['A' * 40, 'B' * 40]]).encode())
+
+    def fetch(fp):
+        coordinator.begin()
+        try:
+            return coordinator.fetch(fp, False, None, None, import_stream, keyring=keyring)
+        finally:
+            coordinator.end()
+
+    import_stream = FakeImportStream()
+    assert [fetch(fp)[1] for fp in sorted(pubkeys)] == ['new', 'new', 'new']
+    assert import_stream.imported == [b'old', b'old', b'old']
+    import_stream.close()
+
+    # Unchanged keys aren't imported again, unless they're missing from the keyring
+    pubkeys['B' * 40] = b'new'
+    import_stream = FakeImportStream()
+    assert [fetch(fp)[1] for fp in sorted(pubkeys)] == ['unchanged', 'updated', 'new']
+    assert import_stream.imported == [b'new', b'old']
+
+
+def test_fetch_coordinator_retries_rejected_keys(common, monkeypatch):
+    coordinator = common.fetch_coordinator
+    pubkeys = {'A' * 40: b'good', 'B' * 40: b'bad'}
+    monkeypatch.setattr(common, 'vks_get_by_fingerprint', lambda fp, use_proxy, proxy_host, proxy_port, deadline=None: pubkeys[fp])
+    keyring = KeyringIndex('\n'.join(['pub:-:4096:1:{0}:1474591596:::-:::scESC::::::23::0:\nfpr:::::::::{1}:'.format(fp[-16:], fp) for fp in sorted(pubkeys)]).encode())
+
+    def sync(import_stream):
+        coordinator.begin()
+        try:
+            return [coordinator.fetch(fp, False, None, None, import_stream, keyring=keyring)[1] for fp in sorted(pubkeys)]
+        finally:
+            coordinator.end()
+            import_stream.close()
+
+    # gpg rejects the key data, so it isn't remembered as imported
+    import_stream = FakeImportStream(rejected=[b'bad'])
+    assert sync(import_stream) == ['new', 'new']
+    assert common.state_db.get_key_hash('A' * 40) is not None
+    assert common.state_db.get_key_hash('B' * 40) is None
+
+    # And the next sync imports it again
+    import_stream = FakeImportStream()
+    assert sync(import_stream) == ['unchanged', 'new']
+    assert import_stream.imported == [b'bad']
@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
 import os
+import queue
+import datetime
+import threading
 import subprocess
 import pytest
 
 from gpgsync.gnupg import GnuPG, InvalidFingerprint, InvalidKeyserver, \
     KeyserverError, NotFoundOnKeyserver, NotFoundInKeyring, RevokedKey, \
     ExpiredKey, VerificationError, BadSignature, SignedWithWrongKey
+from gpgsync.deadline import Deadline, SyncCanceled
+from gpgsync.keyring import KeyringIndex
 
 # Test fingerprint
 test_key_fp = b'3B72C32B49CBB5BBDD57440E1D07D43448FB8382'
@@ -83,6 +88,28 @@ def test_gpg_verify(common):
     common.gpg.verify(msg_sig, msg, b'3B72C32B49CBB5BBDD57440E1D07D43448FB8382')
 
 
+def test_gpg_verify_without_temp_files(common, monkeypatch):
+    import_key('gpgsync_test_pubkey.asc', common.gpg.homedir)
+    msg = open(get_gpg_file('signed_message-valid.txt'), 'rb').read()
+    msg_sig = open(get_gpg_file('signed_message-valid.txt.sig'), 'rb').read()
+
+    def no_temp_files(*args, **kwargs):
+        raise AssertionError('verify wrote a temp file')
+
+    monkeypatch.setattr('gpgsync.gnupg.tempfile.NamedTemporaryFile', no_temp_files)
+    common.gpg.verify(msg_sig, msg, b'3B72C32B49CBB5BBDD57440E1D07D43448FB8382')
+    with pytest.raises(BadSignature):
+        common.gpg.verify(msg_sig, msg + b'tampered', b'3B72C32B49CBB5BBDD57440E1D07D43448FB8382')
+
+
+def test_gpg_verify_with_files(common):
+    import_key('gpgsync_test_pubkey.asc', common.gpg.homedir)
+    msg = open(get_gpg_file('signed_message-valid.txt'), 'rb').read()
+    msg_sig = open(get_gpg_file('signed_message-valid.txt.sig'), 'rb').read()
+    events, err = common.gpg.verify_with_files(msg_sig, msg)
+    assert events.get('VALIDSIG').primary_fingerprint == '3B72C32B49CBB5BBDD57440E1D07D43448FB8382'
+
+
 def test_gpg_verify_invalid_sig(common):
     with pytest.raises(BadSignature):
         # test a message with an invalid sig
@@ -178,3 +205,167 @@ def test_gpg_delete_pubkey_from_disk(common, tmpdir):
     # Delete it, and it shouldn't exist again
     common.gpg.delete_pubkey_from_disk(fp)
     assert os.path.isfile(filename) == False
+
+
+def test_gpg_keyring_index(common):
+    import_key('gpgsync_test_pubkey.asc', common.gpg.homedir)
+    import_key('expired_pubkey.asc', common.gpg.homedir)
+    import_key('revoked_pubkey.asc', common.gpg.homedir)
+
+    index = common.gpg.get_keyring_index()
+    assert len(index) == 3
+    assert index.get(b'3B72C32B49CBB5BBDD57440E1D07D43448FB8382').uids == ['GPG Sync Unit Test Key (not secure in any way)']
+    assert index.get('30996DFF545AD6A02462639624C6564F385E35F8').expired
+    assert index.get('79358BDE97F831D6027B8FFBDB2F866200EBDDE9').revoked
+    assert '0000000000000000000000000000000000000000' not in index
+
+    # Querying keys doesn't spawn any more processes
+    process_count = common.gpg.process_count
+    common.gpg.test_key(b'3B72C32B49CBB5BBDD57440E1D07D43448FB8382')
+    common.gpg.get_uid(b'3B72C32B49CBB5BBDD57440E1D07D43448FB8382')
+    common.gpg.list_all_keyids(b'3B72C32B49CBB5BBDD57440E1D07D43448FB8382')
+    assert common.gpg.process_count == process_count
+
+
+def test_gpg_keyring_index_expires(common, monkeypatch):
+    assert test_key_fp.decode() not in common.gpg.get_keyring_index()
+    import_key('gpgsync_test_pubkey.asc', common.gpg.homedir)
+    assert test_key_fp.decode() not in common.gpg.get_keyring_index()
+
+    # Listed again after a while, even without importing through GnuPG
+    monkeypatch.setattr(common.gpg, 'KEYRING_INDEX_MAX_AGE', 0)
+    assert test_key_fp.decode() in common.gpg.get_keyring_index()
+
+
+def test_keyring_index_expired_since_listing():
+    expires = int((datetime.datetime.now() - datetime.timedelta(minutes=1)).timestamp())
+    index = KeyringIndex('pub:-:4096:1:{0}:1474591596:{1}::-:::scESC::::::23::0:\nfpr:::::::::{2}:'.format(test_key_fp[-16:].decode(), expires, test_key_fp.decode()).encode())
+
+    # gpg didn't list it as expired, but it has expired since
+    assert index.get(test_key_fp).validity == '-'
+    assert index.get(test_key_fp).expired
+
+
+def test_gpg_import_stream(common, tmpdir, monkeypatch):
+    # Use a temporary default homedir
+    monkeypatch.setenv('GNUPGHOME', str(tmpdir))
+
+    import_stream = common.gpg.start_import_to_default_homedir()
+    assert import_stream.write(open(get_gpg_file('gpgsync_test_pubkey.asc'), 'rb').read())
+    assert import_stream.write(open(get_gpg_file('pgpsync_multiple_uids.asc'), 'rb').read())
+    import_stream.close()
+    assert import_stream.import_result.count == 2
+    assert import_stream.import_result.imported == 2
+
+    # Keys written after it's closed don't get imported
+    assert not import_stream.write(open(get_gpg_file('gpgsync_test_pubkey.asc'), 'rb').read())
+
+    keyring = common.gpg.get_default_keyring_index()
+    assert '3B72C32B49CBB5BBDD57440E1D07D43448FB8382' in keyring
+    assert 'D86B4D4BB5DFDD378B58D4D3F121AC6230396C33' in keyring
+
+
+def test_gpg_import_stream_confirms_imported_keys(common, tmpdir, monkeypatch):
+    # Use a temporary default homedir
+    monkeypatch.setenv('GNUPGHOME', str(tmpdir))
+
+    confirmed = []
+    import_stream = common.gpg.start_import_to_default_homedir()
+    assert import_stream.write(open(get_gpg_file('gpgsync_test_pubkey.asc'), 'rb').read(), test_key_fp.decode(), lambda: confirmed.append('good'))
+    import_stream.close()
+    assert confirmed == ['good']
+
+    # Keys gpg rejects don't get confirmed
+    import_stream = common.gpg.start_import_to_default_homedir()
+    assert import_stream.write(b'-----BEGIN PGP PUBLIC KEY BLOCK-----\n\nnot a key\n-----END PGP PUBLIC KEY BLOCK-----', 'D86B4D4BB5DFDD378B58D4D3F121AC6230396C33', lambda: confirmed.append('bad'))
+    import_stream.close()
+    assert confirmed == ['good']
+
+
+def test_gpg_import_stream_without_keys(common):
+    # Closing an import stream that never got any keys doesn't run gpg
+    process_count = common.gpg.process_count
+    assert common.gpg.start_import_to_default_homedir().close() == (b'', b'')
+    assert common.gpg.process_count == process_count
+
+
+def test_gpg_recv_keys(common):
+    homedir = common.gpg.create_temp_homedir()
+    notfound = common.gpg.recv_keys(b'hkp://keyserver.ubuntu.com', [test_key_fp, b'0000000000000000000000000000000000000000'], homedir)
+    assert notfound == ['0000000000000000000000000000000000000000']
+
+    # Keylist members don't end up in the persistent homedir
+    assert test_key_fp.decode() not in common.gpg.get_keyring_index()
+    out, err = common.gpg._gpg(['--with-colons', '--list-keys'], homedir=homedir)
+    assert test_key_fp in out
+    common.gpg.delete_temp_homedir(homedir)
+
+
+def test_gpg_recv_keys_invalid_keyserver(common):
+    homedir = common.gpg.create_temp_homedir()
+    with pytest.raises(KeyserverError):
+        common.gpg.recv_keys(b'hkp://fakekeyserver', [test_key_fp], homedir)
+    common.gpg.delete_temp_homedir(homedir)
+
+
+def test_gpg_processes_are_limited(common):
+    common.settings.max_gpg_processes = 1
+    gpg = GnuPG(common, appdata_path=common.settings.get_appdata_path())
+
+    # With the only slot taken, gpg has to wait, until the sync is canceled
+    gpg.acquire_gpg_slot()
+    cancel_q = queue.Queue()
+    threading.Timer(0.2, cancel_q.put, args=(True,)).start()
+    with pytest.raises(SyncCanceled):
+        gpg._gpg(['--version'], deadline=Deadline(common, cancel_q, 60))
+    gpg.gpg_semaphore.release()
+
+    out, err = gpg._gpg(['--version'])
+    assert b'gpg (GnuPG)' in out
+
+
+def test_gpg_homedir_is_persistent(common, tmpdir):
+    gpg = GnuPG(common, appdata_path=str(tmpdir))
+    assert gpg.homedir == os.path.join(str(tmpdir), 'homedir')
+    import_key('gpgsync_test_pubkey.asc', gpg.homedir)
+
+    # Another process (or GnuPG object) can't share it while it's in use
+    other_gpg = GnuPG(common, appdata_path=str(tmpdir))
+    assert other_gpg.homedir != gpg.homedir
+    del other_gpg
+
+    # Keys are still there after a restart
+    del gpg
+    gpg = GnuPG(common, appdata_path=str(tmpdir))
+    assert gpg.homedir == os.path.join(str(tmpdir), 'homedir')
+    gpg.test_key(test_key_fp)
+
+
+def test_gpg_authority_key_is_fresh(common):
+    import_key('gpgsync_test_pubkey.asc', common.gpg.homedir)
+    common.gpg.export_pubkey_to_disk(test_key_fp)
+    assert not common.gpg.authority_key_is_fresh(test_key_fp)
+
+    common.gpg.record_authority_key_validated(test_key_fp)
+    assert common.gpg.authority_key_is_fresh(test_key_fp)
+
+    validated_at = datetime.datetime.now() - datetime.timedelta(hours=float(common.settings.authority_key_max_age_hours) + 1)
+    common.state_db.record_authority_key_validated(test_key_fp.decode(), validated_at.isoformat())
+    assert not common.gpg.authority_key_is_fresh(test_key_fp)
+
+    # Keys that failed validation get validated again
+    common.gpg.record_authority_key_validated(test_key_fp)
+    common.gpg.record_authority_key_validated(test_key_fp, False)
+    assert not common.gpg.authority_key_is_fresh(test_key_fp)
+
+    # So do keys that aren't exported to disk any more
+    common.gpg.record_authority_key_validated(test_key_fp)
+    common.gpg.delete_pubkey_from_disk(test_key_fp)
+    assert not common.gpg.authority_key_is_fresh(test_key_fp)
+
+    # Revoked keys always get fetched again
+    import_key('revoked_pubkey.asc', common.gpg.homedir)
+    common.gpg.invalidate_keyring_index()
+    common.gpg.export_pubkey_to_disk(b'79358BDE97F831D6027B8FFBDB2F866200EBDDE9')
+    common.gpg.record_authority_key_validated(b'79358BDE97F831D6027B8FFBDB2F866200EBDDE9')
+    assert not common.gpg.authority_key_is_fresh(b'79358BDE97F831D6027B8FFBDB2F866200EBDDE9')
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from gpgsync.gpg_status import parse_status, ValidSig, ImportOk, ImportRes
+
+
+def test_parse_status():
+    events = parse_status(b'\n'.join([
+        b'[GNUPG:] NEWSIG',
+        b'gpg: not a status line',
+        b'[GNUPG:] GOODSIG 1D07D43448FB8382 GPG Sync Unit Test Key',
+        b'[GNUPG:] VALIDSIG 0123456789ABCDEF0123456789ABCDEF01234567 2016-09-23 1474591596 0 4 0 1 8 00 3B72C32B49CBB5BBDD57440E1D07D43448FB8382',
+        b'[GNUPG:] IMPORT_OK 1 D86B4D4BB5DFDD378B58D4D3F121AC6230396C33',
+        b'[GNUPG:] IMPORT_RES 3 0 1 0 2 0 0 0 1 0 0 0 0 0 0',
+        b''
+    ]))
+
+    assert [event.keyword for event in events] == ['NEWSIG', 'GOODSIG', 'VALIDSIG', 'IMPORT_OK', 'IMPORT_RES']
+    assert events.has('GOODSIG')
+    assert not events.has('BADSIG', 'ERRSIG')
+    assert events.get('BADSIG') is None
+
+    validsig = events.get('VALIDSIG')
+    assert isinstance(validsig, ValidSig)
+    assert validsig.fingerprint == '0123456789ABCDEF0123456789ABCDEF01234567'
+    assert validsig.primary_fingerprint == '3B72C32B49CBB5BBDD57440E1D07D43448FB8382'
+
+    assert isinstance(events.get('IMPORT_OK'), ImportOk)
+    assert events.imported_fingerprints() == ['D86B4D4BB5DFDD378B58D4D3F121AC6230396C33']
+
+    import_res = events.get('IMPORT_RES')
+    assert isinstance(import_res, ImportRes)
+    assert (import_res.count, import_res.imported, import_res.unchanged, import_res.revocations) == (3, 1, 2, 1)
+
+
+def test_parse_status_import_res_fields():
+    # A full IMPORT_RES line, with a different value in every field:
+    # count no_user_id imported imported_rsa unchanged n_uids n_subk n_sigs
+    # n_revoc sec_read sec_imported sec_dups skipped_new_keys not_imported
+    # skipped_v3_keys
+    events = parse_status(b'[GNUPG:] IMPORT_RES 20 1 2 3 4 5 6 7 8 9 10 11 12 13 14\n')
+    import_res = events.get('IMPORT_RES')
+    assert import_res.count == 20
+    assert import_res.imported == 2
+    assert import_res.unchanged == 4
+    assert import_res.revocations == 8
+    assert import_res.not_imported == 13
+
+
+def test_parse_status_short_lines():
+    # Missing arguments don't crash anything
+    events = parse_status(b'[GNUPG:] VALIDSIG ABCD\n[GNUPG:] IMPORT_RES\n')
+    assert events.get('VALIDSIG').primary_fingerprint == 'ABCD'
+    assert events.get('IMPORT_RES').count == 0
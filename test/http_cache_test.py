@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import os
+
+from gpgsync.state_db import StateDB
+from gpgsync.http_cache import HTTPCache
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+
+def test_http_cache_store_and_get(common, tmpdir):
+    cache = HTTPCache(common, StateDB(common, str(tmpdir)))
+    url = 'https://example.com/keylist.json'
+
+    assert cache.conditional_headers(url) == {}
+    assert cache.get(url) is None
+
+    cache.store(url, {'ETag': '"abc"', 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}, b'keylist')
+    assert cache.conditional_headers(url) == {
+        'If-None-Match': '"abc"',
+        'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'
+    }
+    assert cache.get(url) == b'keylist'
+
+    # Bytes urls are the same as str urls
+    assert cache.get(url.encode()) == b'keylist'
+
+
+def test_http_cache_persists(common, tmpdir):
+    url = 'https://example.com/keylist.json.asc'
+    HTTPCache(common, StateDB(common, str(tmpdir))).store(url, {'ETag': '"abc"'}, b'signature')
+
+    cache = HTTPCache(common, StateDB(common, str(tmpdir)))
+    assert cache.conditional_headers(url) == {'If-None-Match': '"abc"'}
+    assert cache.get(url) == b'signature'
+
+
+def test_http_cache_no_validators(common, tmpdir):
+    cache = HTTPCache(common, StateDB(common, str(tmpdir)))
+    url = 'https://example.com/keylist.json'
+
+    cache.store(url, {'ETag': '"abc"'}, b'old')
+    cache.store(url, {}, b'new')
+    assert cache.conditional_headers(url) == {}
+    assert cache.get(url) is None
+
+
+def test_fetch_url_not_modified(keylist, tmpdir, monkeypatch):
+    keylist.c.http_cache = HTTPCache(keylist.c, StateDB(keylist.c, str(tmpdir)))
+    url = 'https://example.com/keylist.json'
+    requests_made = []
+
+    def requests_get(url, proxies=None, headers=None, deadline=None):
+        requests_made.append(headers)
+        if headers and headers.get('If-None-Match') == '"abc"':
+            return FakeResponse(304)
+        return FakeResponse(200, b'keylist', {'ETag': '"abc"'})
+
+    monkeypatch.setattr(keylist.c, 'requests_get', requests_get)
+
+    assert keylist.fetch_url(url) == b'keylist'
+    assert keylist.fetch_url(url) == b'keylist'
+    assert requests_made == [{}, {'If-None-Match': '"abc"'}]
+
+    # If the cached body is lost, download it again
+    os.remove(keylist.c.http_cache.get_body_filename(url))
+    assert keylist.fetch_url(url) == b'keylist'
+    assert requests_made[-1] == {}
@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 import os
+import queue
+import sqlite3
+import threading
 import pytest
 
+from gpgsync.gnupg import KeyserverError, NotFoundOnKeyserver
+from gpgsync.keyring import KeyringIndex
 from gpgsync.keylist import URLDownloadError, ProxyURLDownloadError, \
-    KeylistNotJson, KeylistInvalid, Keylist, ValidatorMessageQueue, \
-    RefresherMessageQueue
+    KeylistNotJson, KeylistInvalid, Keylist, LegacyKeylist, \
+    ValidatorMessageQueue, RefresherMessageQueue
 
 
 # Load an keylist test file
@@ -121,3 +126,210 @@ def test_refresher_message_queue_add_message():
         'total_keys': 0,
         'current_key': 0
     }
+
+
+class FakeImportStream(object):
+    def __init__(self, imported):
+        self.imported = imported
+
+    def write(self, pubkey, fp=None, on_imported=None):
+        self.imported.append(pubkey)
+        return True
+
+    def close(self):
+        return b'', b''
+
+
+def test_refresh_fetch_fingerprints_concurrent(keylist, monkeypatch):
+    fingerprints = [str(i).encode() * 40 for i in range(10)]
+    imported = []
+
+    def vks_get_by_fingerprint(fp, use_proxy, proxy_host, proxy_port, deadline=None):
+        if fp in ['3' * 40, '7' * 40]:
+            raise NotFoundOnKeyserver(fp)
+        return fp.encode()
+
+    monkeypatch.setattr(keylist.c, 'vks_get_by_fingerprint', vks_get_by_fingerprint)
+    monkeypatch.setattr(keylist.c.gpg, 'start_import_to_default_homedir', lambda: FakeImportStream(imported))
+    keylist.c.settings.fetch_workers = 4
+    keylist.q = RefresherMessageQueue()
+
+    result = keylist.refresh_fetch_fingerprints(fingerprints, len(fingerprints), queue.Queue())
+    assert result['type'] == 'success'
+    assert result['data']['notfound_fingerprints'] == ['3' * 40, '7' * 40]
+    assert sorted(imported) == sorted([fp for fp in fingerprints if fp not in [b'3' * 40, b'7' * 40]])
+
+    # The last progress message should account for every key
+    assert keylist.q.get(False)['current_key'] == len(fingerprints)
+
+
+def test_refresh_fetch_fingerprints_keyserver_error(keylist, monkeypatch):
+    def vks_get_by_fingerprint(fp, use_proxy, proxy_host, proxy_port, deadline=None):
+        raise KeyserverError('keys.openpgp.org: rate limited')
+
+    monkeypatch.setattr(keylist.c, 'vks_get_by_fingerprint', vks_get_by_fingerprint)
+    keylist.q = RefresherMessageQueue()
+
+    result = keylist.refresh_fetch_fingerprints([b'A' * 40, b'B' * 40], 2, queue.Queue())
+    assert result['type'] == 'error'
+    assert result['message'] == 'keys.openpgp.org: rate limited'
+
+
+def test_refresh_fetch_fingerprints_cancel(keylist, monkeypatch):
+    monkeypatch.setattr(keylist.c, 'vks_get_by_fingerprint', lambda fp, use_proxy, proxy_host, proxy_port, deadline=None: fp.encode())
+    keylist.q = RefresherMessageQueue()
+    cancel_q = queue.Queue()
+    cancel_q.put(True)
+
+    result = keylist.refresh_fetch_fingerprints([b'A' * 40, b'B' * 40], 2, cancel_q)
+    assert result['type'] == 'cancel'
+
+
+def prepare_refresh(keylist, monkeypatch):
+    keylist.url = b'https://www.example.com/keylist.json'
+    keylist.fingerprint = b'3B72C32B49CB8E2C9C7A2B19D4E57F9E5F6D8A3C'
+    keylist.q = RefresherMessageQueue()
+    monkeypatch.setattr(keylist.c, 'internet_available', lambda use_proxy=False, proxy_host=None, proxy_port=None: True)
+
+
+def test_refresh_fetches_authority_key_during_download(keylist, monkeypatch):
+    prepare_refresh(keylist, monkeypatch)
+    authority_started = threading.Event()
+
+    def refresh_keylist_uri():
+        # Only finishes once the authority key fetch is underway
+        assert authority_started.wait(5)
+        return keylist.result_object('error', 'download failed')
+
+    def validate_authority_key(force=False):
+        authority_started.set()
+        return keylist.result_object('success')
+
+    monkeypatch.setattr(keylist, 'refresh_keylist_uri', refresh_keylist_uri)
+    monkeypatch.setattr(keylist, 'validate_authority_key', validate_authority_key)
+
+    result = Keylist.refresh(keylist.c, queue.Queue(), keylist, force=True)
+    assert result['type'] == 'error'
+    assert result['message'] == 'download failed'
+
+
+def test_refresh_cancel_during_download(keylist, monkeypatch):
+    prepare_refresh(keylist, monkeypatch)
+    release = threading.Event()
+
+    def refresh_keylist_uri():
+        release.wait(5)
+        return keylist.result_object('error', 'download failed')
+
+    monkeypatch.setattr(keylist, 'refresh_keylist_uri', refresh_keylist_uri)
+    monkeypatch.setattr(keylist, 'validate_authority_key', lambda force=False: keylist.result_object('success'))
+
+    cancel_q = queue.Queue()
+    cancel_q.put(True)
+    try:
+        result = Keylist.refresh(keylist.c, cancel_q, keylist, force=True)
+        assert result['type'] == 'cancel'
+    finally:
+        release.set()
+
+
+def test_refresh_legacy_keylist_reuses_download(keylist, monkeypatch):
+    prepare_refresh(keylist, monkeypatch)
+    downloads = []
+
+    def refresh_keylist_uri():
+        downloads.append(keylist.url)
+        return keylist.result_object('success', data=b'# legacy keylist\n' + keylist.fingerprint + b'\n')
+
+    monkeypatch.setattr(keylist, 'refresh_keylist_uri', refresh_keylist_uri)
+    monkeypatch.setattr(keylist, 'validate_authority_key', lambda force=False: keylist.result_object('success'))
+    monkeypatch.setattr(LegacyKeylist, 'refresh_keylist_signature_uri', lambda self: self.result_object('error', 'signature failed'))
+
+    result = Keylist.refresh(keylist.c, queue.Queue(), keylist, force=True)
+    assert result['type'] == 'error'
+    assert result['message'] == 'signature failed'
+    assert downloads == [keylist.url]
+
+
+def test_refresh_deadline_exceeded(keylist, monkeypatch):
+    prepare_refresh(keylist, monkeypatch)
+    keylist.c.settings.sync_timeout_minutes = 0
+    release = threading.Event()
+
+    def refresh_keylist_uri():
+        release.wait(5)
+        return keylist.result_object('error', 'download failed')
+
+    monkeypatch.setattr(keylist, 'refresh_keylist_uri', refresh_keylist_uri)
+    monkeypatch.setattr(keylist, 'validate_authority_key', lambda force=False: keylist.result_object('success'))
+
+    try:
+        result = Keylist.refresh(keylist.c, queue.Queue(), keylist, force=True)
+        assert result['type'] == 'error'
+        assert result['message'] == 'Sync took longer than 0 minutes'
+    finally:
+        release.set()
+
+
+def test_refresh_state_db_locked(keylist, monkeypatch):
+    prepare_refresh(keylist, monkeypatch)
+
+    def refresh_keylist_uri():
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(keylist, 'refresh_keylist_uri', refresh_keylist_uri)
+    monkeypatch.setattr(keylist, 'validate_authority_key', lambda force=False: keylist.result_object('success'))
+
+    # It's an error result, not an exception
+    result = Keylist.refresh(keylist.c, queue.Queue(), keylist, force=True)
+    assert result['type'] == 'error'
+    assert result['message'] == 'Error updating sync state: database is locked'
+
+
+def test_validate_authority_key_skips_fresh_key(keylist, monkeypatch):
+    keylist.fingerprint = b'3B72C32B49CBB5BBDD57440E1D07D43448FB8382'
+    fetched = []
+    monkeypatch.setattr(keylist.c.gpg, 'authority_key_is_fresh', lambda fp: True)
+    monkeypatch.setattr(keylist.c.gpg, 'recv_key', lambda *args, **kwargs: fetched.append(args[2]))
+    monkeypatch.setattr(keylist.c.gpg, 'test_key', lambda fp: None)
+    monkeypatch.setattr(keylist.c.gpg, 'export_pubkey_to_disk', lambda fp: None)
+
+    assert keylist.validate_authority_key()['type'] == 'success'
+    assert fetched == []
+
+    # Forced syncs fetch it again, in case it's been revoked
+    assert keylist.validate_authority_key(force=True)['type'] == 'success'
+    assert fetched == [keylist.fingerprint]
+
+
+def test_validate_authority_key_shared_between_keylists(common, monkeypatch):
+    fp = b'3B72C32B49CBB5BBDD57440E1D07D43448FB8382'
+    fetched = []
+    release = threading.Event()
+
+    def recv_key(*args, **kwargs):
+        fetched.append(args[2])
+        release.wait(1)
+
+    monkeypatch.setattr(common.gpg, 'recv_key', recv_key)
+    monkeypatch.setattr(common.gpg, 'test_key', lambda fp: None)
+    monkeypatch.setattr(common.gpg, 'get_uid', lambda fp: None)
+    monkeypatch.setattr(common.gpg, 'export_pubkey_to_disk', lambda fp: open(common.gpg.get_pubkey_filename_on_disk(fp), 'w').write('pubkey'))
+    monkeypatch.setattr(common.gpg, 'get_keyring_index', lambda: KeyringIndex('pub:-:4096:1:{0}:1474591596:::-:::scESC::::::23::0:\nfpr:::::::::{1}:'.format(fp[-16:].decode(), fp.decode()).encode()))
+
+    # Keylists with the same authority key validate it once
+    results = []
+    threads = []
+    for _ in range(4):
+        keylist = Keylist(common)
+        keylist.fingerprint = fp
+        t = threading.Thread(target=lambda k=keylist: results.append(k.validate_authority_key()))
+        t.start()
+        threads.append(t)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert [result['type'] for result in results] == ['success'] * 4
+    assert fetched == [fp]
+    assert common.state_db.get_authority_key_validated(fp.decode()) is not None
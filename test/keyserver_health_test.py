@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import queue
+import pytest
+
+from gpgsync.gnupg import KeyserverError, NotFoundOnKeyserver
+from gpgsync.deadline import Deadline, SyncCanceled
+from gpgsync.keyserver_health import KeyserverHealth
+
+
+@pytest.fixture
+def health(common, monkeypatch):
+    health = KeyserverHealth(common)
+    monkeypatch.setattr(health, 'get_retry_delay', lambda attempt: 0)
+    return health
+
+
+def failing(calls, times):
+    def func():
+        calls.append(True)
+        if len(calls) <= times:
+            raise KeyserverError('keys.openpgp.org: 502 Bad Gateway')
+        return b'pubkey'
+    return func
+
+
+def test_keyserver_health_retries(health):
+    calls = []
+    assert health.call('keys.openpgp.org', failing(calls, health.RETRIES)) == b'pubkey'
+    assert len(calls) == health.RETRIES + 1
+    assert health.get_state('keys.openpgp.org') == health.STATE_CLOSED
+
+    calls = []
+    with pytest.raises(KeyserverError):
+        health.call('keys.openpgp.org', failing(calls, health.RETRIES + 1))
+    assert len(calls) == health.RETRIES + 1
+
+
+def test_keyserver_health_not_found_is_not_retried(health):
+    calls = []
+
+    def func():
+        calls.append(True)
+        raise NotFoundOnKeyserver('A' * 40)
+
+    with pytest.raises(NotFoundOnKeyserver):
+        health.call('keys.openpgp.org', func)
+    assert len(calls) == 1
+
+
+def test_keyserver_health_circuit_breaker(health, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('gpgsync.keyserver_health.time.monotonic', lambda: now[0])
+
+    # Enough failures in a row open the circuit
+    calls = []
+    for _ in range(health.FAILURE_THRESHOLD):
+        with pytest.raises(KeyserverError):
+            health.call('keys.openpgp.org', failing(calls, 1000))
+    assert health.get_state('keys.openpgp.org') == health.STATE_OPEN
+    assert len(calls) == health.FAILURE_THRESHOLD
+
+    # While it's open, requests fail without being made
+    calls = []
+    with pytest.raises(KeyserverError) as e:
+        health.call('keys.openpgp.org', failing(calls, 0))
+    assert 'unavailable' in str(e.value)
+    assert calls == []
+
+    # Other keyservers aren't affected
+    assert health.call('hkps://keyserver.ubuntu.com', failing([], 0)) == b'pubkey'
+
+    # After the cool-down, one request is let through, and if that fails the
+    # circuit opens again
+    now[0] += health.COOL_DOWN
+    calls = []
+    with pytest.raises(KeyserverError):
+        health.call('keys.openpgp.org', failing(calls, 1000))
+    assert len(calls) == 1
+    assert health.get_state('keys.openpgp.org') == health.STATE_OPEN
+
+    # If it works, the circuit closes
+    now[0] += health.COOL_DOWN
+    assert health.call('keys.openpgp.org', failing([], 0)) == b'pubkey'
+    assert health.get_state('keys.openpgp.org') == health.STATE_CLOSED
+
+
+def test_keyserver_health_retry_stops_with_sync(common, monkeypatch):
+    health = KeyserverHealth(common)
+    cancel_q = queue.Queue()
+    deadline = Deadline(common, cancel_q)
+
+    def func():
+        cancel_q.put(True)
+        raise KeyserverError('keys.openpgp.org: 502 Bad Gateway')
+
+    with pytest.raises(SyncCanceled):
+        health.call('keys.openpgp.org', func, deadline=deadline)
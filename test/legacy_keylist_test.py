@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 import os
+import queue
 import pytest
 
 from gpgsync.keylist import URLDownloadError, ProxyURLDownloadError, \
-    InvalidFingerprints, LegacyKeylist
+    InvalidFingerprints, LegacyKeylist, RefresherMessageQueue
 
 
 # Load an keylist test file
@@ -49,3 +50,35 @@ def test_get_fingerprint_list_valid(legacy_keylist):
 def test_get_fingerprint_list_invalid_fingerprints(legacy_keylist):
     with pytest.raises(InvalidFingerprints):
         legacy_keylist.get_fingerprint_list(get_legacy_keylist_file_content('invalid_fingerprints.txt'))
+
+
+def test_refresh_fetch_fingerprints_batched(legacy_keylist, monkeypatch):
+    fingerprints = ['{:040X}'.format(i) for i in range(250)]
+    notfound = ['{:040X}'.format(i) for i in [5, 120, 249]]
+    chunks = []
+    imported = []
+
+    def recv_keys(keyserver, fps, homedir, deadline=None):
+        # Not the persistent homedir for authority keys
+        assert homedir != legacy_keylist.c.gpg.homedir
+        chunks.append(fps)
+        return [fp for fp in fps if fp in notfound]
+
+    def import_to_default_homedir(fp=None, pubkey=None, homedir=None):
+        assert os.path.isdir(homedir)
+        imported.append(fp)
+
+    monkeypatch.setattr(legacy_keylist.c.gpg, 'recv_keys', recv_keys)
+    monkeypatch.setattr(legacy_keylist.c.gpg, 'import_to_default_homedir', import_to_default_homedir)
+    legacy_keylist.use_modern_keyserver = False
+    legacy_keylist.keyserver = b'hkps://keyserver.ubuntu.com'
+    legacy_keylist.q = RefresherMessageQueue()
+
+    result = legacy_keylist.refresh_fetch_fingerprints(fingerprints, len(fingerprints), queue.Queue())
+    assert result['type'] == 'success'
+    assert result['data']['notfound_fingerprints'] == notfound
+
+    # One gpg --recv-keys per chunk, and one import at the end
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
+    assert imported == [[fp for fp in fingerprints if fp not in notfound]]
+    assert legacy_keylist.q.get(False)['current_key'] == 250
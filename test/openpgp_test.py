@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+import time
+import pytest
+
+from gpgsync import openpgp
+
+# Test keys, and their primary key and subkey fingerprints
+test_keys = {
+    'gpgsync_test_pubkey.asc': ['3B72C32B49CBB5BBDD57440E1D07D43448FB8382', '0C12005B274F012FEAC30C3D1ED9906D2F8FC45D'],
+    'pgpsync_multiple_uids.asc': ['D86B4D4BB5DFDD378B58D4D3F121AC6230396C33', '0861F11E50A2AA7A3CDA4BE006D001C585800EF4'],
+    'expired_pubkey.asc': ['30996DFF545AD6A02462639624C6564F385E35F8', '80551D1111E169137435F2CD6466C7378A8D030C'],
+    'revoked_pubkey.asc': ['79358BDE97F831D6027B8FFBDB2F866200EBDDE9', 'C78ED7FF0B3DCA64E6EE5D1FB66F45EBA1A01222']
+}
+
+
+# Load a gpg test file
+def get_gpg_file_content(filename):
+    filename = os.path.join(os.path.abspath('test/gpg_files'), filename)
+    return open(filename, 'rb').read()
+
+
+# All of the test keys, armored and binary
+def get_corpus():
+    corpus = []
+    for filename in test_keys:
+        armored = get_gpg_file_content(filename)
+        corpus.append(armored)
+        corpus.append(openpgp.dearmor(armored))
+    return corpus
+
+
+@pytest.mark.parametrize('filename', test_keys.keys())
+def test_parse_public_keys_armored(filename):
+    keys = openpgp.parse_public_keys(get_gpg_file_content(filename))
+    assert len(keys) == 1
+    assert keys[0].fingerprints() == test_keys[filename]
+
+
+@pytest.mark.parametrize('filename', test_keys.keys())
+def test_parse_public_keys_binary(filename):
+    binary = openpgp.dearmor(get_gpg_file_content(filename))
+    keys = openpgp.parse_public_keys(binary)
+    assert len(keys) == 1
+    assert keys[0].fingerprints() == test_keys[filename]
+
+
+def test_parse_public_keys_multiple_keys():
+    data = get_gpg_file_content('gpgsync_test_pubkey.asc') + get_gpg_file_content('revoked_pubkey.asc')
+    keys = openpgp.parse_public_keys(data)
+    assert [key.fingerprint for key in keys] == ['3B72C32B49CBB5BBDD57440E1D07D43448FB8382', '79358BDE97F831D6027B8FFBDB2F866200EBDDE9']
+
+
+def test_parse_public_keys_crlf():
+    data = get_gpg_file_content('gpgsync_test_pubkey.asc').replace(b'\n', b'\r\n')
+    assert openpgp.parse_public_keys(data)[0].fingerprint == '3B72C32B49CBB5BBDD57440E1D07D43448FB8382'
+
+
+def test_parse_public_keys_invalid():
+    with pytest.raises(openpgp.OpenPGPError):
+        openpgp.parse_public_keys(b'-----BEGIN PGP PUBLIC KEY BLOCK-----\n\nnot base64!\n-----END PGP PUBLIC KEY BLOCK-----\n')
+    with pytest.raises(openpgp.OpenPGPError):
+        openpgp.parse_public_keys(b'this is not a key')
+    with pytest.raises(openpgp.OpenPGPError):
+        openpgp.parse_public_keys(openpgp.dearmor(get_gpg_file_content('gpgsync_test_pubkey.asc'))[:-10])
+
+    # A signature is valid OpenPGP data, but it has no keys
+    assert openpgp.parse_public_keys(get_gpg_file_content('signed_message-valid.txt.sig')) == []
+
+
+def test_parse_public_keys_fuzz():
+    # Mutated keys should either parse or raise OpenPGPError, never anything else
+    rand = random.Random(1234)
+    for data in get_corpus():
+        for _ in range(200):
+            mutated = bytearray(data)
+            mutation = rand.randrange(3)
+            if mutation == 0:
+                for _ in range(rand.randint(1, 8)):
+                    mutated[rand.randrange(len(mutated))] = rand.randrange(256)
+            elif mutation == 1:
+                mutated = mutated[:rand.randrange(len(mutated))]
+            else:
+                pos = rand.randrange(len(mutated))
+                mutated[pos:pos] = bytes(rand.randrange(256) for _ in range(rand.randint(1, 16)))
+
+            try:
+                keys = openpgp.parse_public_keys(bytes(mutated))
+            except openpgp.OpenPGPError:
+                continue
+            assert all(len(key.fingerprint) in (40, 64) for key in keys)
+
+
+# Timing depends on the machine, so this only runs when asked for, like
+# `GPGSYNC_BENCHMARK=1 pytest -s test/openpgp_test.py`
+@pytest.mark.skipif(not os.environ.get('GPGSYNC_BENCHMARK'), reason="set GPGSYNC_BENCHMARK to run benchmarks")
+def test_parse_public_keys_benchmark():
+    corpus = get_corpus()
+    iterations = 100
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for data in corpus:
+            openpgp.parse_public_keys(data)
+    elapsed = (time.perf_counter() - start) / (iterations * len(corpus))
+
+    print("parse_public_keys: {:.1f} microseconds per key".format(elapsed * 1000000))
+
+    # Far less than the cost of spawning a gpg process
+    assert elapsed < 0.005
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import queue
+import threading
+import pytest
+
+from gpgsync.deadline import Deadline, SyncCanceled
+from gpgsync.rate_limiter import EndpointLimiter
+
+
+def test_endpoint_limiter_backs_off_when_rate_limited(common):
+    limiter = EndpointLimiter(common, 'https://keys.openpgp.org/vks/v1', 8)
+
+    limiter.acquire()
+    limiter.release(retry_after='0', rate_limited=True)
+    assert limiter.concurrency == 4
+    assert limiter.rate == EndpointLimiter.MAX_RATE / 2
+
+    # Speeds back up after a round of fast responses
+    for _ in range(limiter.concurrency):
+        limiter.acquire()
+        limiter.release(latency=0.1)
+    assert limiter.concurrency == 5
+    assert limiter.rate == EndpointLimiter.MAX_RATE
+
+    # Slow responses reduce concurrency
+    limiter.acquire()
+    limiter.release(latency=EndpointLimiter.LATENCY_TARGET + 1)
+    assert limiter.concurrency == 4
+
+
+def test_endpoint_limiter_onion_latency(common):
+    limiter = EndpointLimiter(common, 'http://zkaan2xfbuxia2wpf7ofnkbz6r5zdbbvxbunvp5g2iebopbfc4iqmbad.onion/vks/v1', 8)
+
+    # Tor round-trips are always a few seconds, that's not the server struggling
+    for latency in [4.0, 3.0, 6.0, 5.0, 3.5, 7.0, 4.5, 5.5] * 3:
+        limiter.acquire()
+        limiter.release(latency=latency)
+    assert limiter.concurrency == 8
+
+    # Much slower than usual is
+    limiter.acquire()
+    limiter.release(latency=30.0)
+    assert limiter.concurrency == 7
+
+
+def test_endpoint_limiter_parse_retry_after(common):
+    limiter = EndpointLimiter(common, 'https://keys.openpgp.org/vks/v1', 8)
+    assert limiter.parse_retry_after('30') == 30
+    assert limiter.parse_retry_after(None) == EndpointLimiter.DEFAULT_RETRY_AFTER
+    assert limiter.parse_retry_after('99999') == EndpointLimiter.MAX_RETRY_AFTER
+    assert limiter.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert limiter.parse_retry_after('soon') == EndpointLimiter.DEFAULT_RETRY_AFTER
+
+
+def test_endpoint_limiter_limits_concurrency(common):
+    limiter = EndpointLimiter(common, 'https://keys.openpgp.org/vks/v1', 1)
+    limiter.acquire()
+
+    acquired = threading.Event()
+    t = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+    t.start()
+    assert not acquired.wait(0.2)
+
+    limiter.release(latency=0.1)
+    assert acquired.wait(5)
+    t.join()
+
+
+def test_endpoint_limiter_honors_retry_after(common):
+    limiter = EndpointLimiter(common, 'https://keys.openpgp.org/vks/v1', 8)
+    limiter.acquire()
+    limiter.release(retry_after='60', rate_limited=True)
+
+    # Waiting for the Retry-After stops with the sync
+    cancel_q = queue.Queue()
+    deadline = Deadline(common, cancel_q)
+    threading.Timer(0.2, lambda: cancel_q.put(True)).start()
+    with pytest.raises(SyncCanceled):
+        limiter.acquire(deadline)
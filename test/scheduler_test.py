@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from gpgsync.scheduler import Scheduler
+
+
+def test_next_due(common, keylist):
+    common.settings.update_interval_hours = b'12'
+    scheduler = Scheduler(common)
+    now = datetime.datetime.now()
+
+    # Never checked
+    assert scheduler.next_due(keylist) is None
+    assert scheduler.is_due(keylist, now)
+
+    keylist.last_checked = now - datetime.timedelta(hours=1)
+    assert scheduler.next_due(keylist) == keylist.last_checked + datetime.timedelta(hours=12)
+    assert not scheduler.is_due(keylist, now)
+    assert scheduler.is_due(keylist, now + datetime.timedelta(hours=11))
+
+
+def test_next_due_after_failure(common, keylist):
+    common.settings.update_interval_hours = b'12'
+    scheduler = Scheduler(common)
+    now = datetime.datetime.now()
+
+    # Failed after it was due, so retry a bit later
+    keylist.last_checked = now - datetime.timedelta(hours=24)
+    keylist.last_failed = now
+    assert scheduler.next_due(keylist) == now + datetime.timedelta(seconds=Scheduler.FAILED_RETRY)
+
+    # Failures from before the last successful check don't matter
+    keylist.last_failed = now - datetime.timedelta(hours=25)
+    assert scheduler.next_due(keylist) == keylist.last_checked + datetime.timedelta(hours=12)
+
+
+def test_due_keylists(common, keylist):
+    common.settings.update_interval_hours = b'12'
+    scheduler = Scheduler(common)
+    now = datetime.datetime.now()
+
+    keylist.last_checked = now
+    assert scheduler.due_keylists([keylist], now) == []
+
+    keylist.last_checked = now - datetime.timedelta(hours=13)
+    assert scheduler.due_keylists([keylist], now) == [keylist]
+
+    # Already syncing
+    keylist.syncing = True
+    assert scheduler.due_keylists([keylist], now) == []
+
+
+def test_seconds_until_next_sync(common, keylist, monkeypatch):
+    common.settings.update_interval_hours = b'12'
+    scheduler = Scheduler(common)
+    now = datetime.datetime.now()
+
+    # Nothing to do, just sleep for as long as possible
+    assert scheduler.seconds_until_next_sync([], now) == Scheduler.MAX_SLEEP
+    keylist.last_checked = now
+    assert scheduler.seconds_until_next_sync([keylist], now) == Scheduler.MAX_SLEEP
+
+    # Due soon, plus jitter
+    monkeypatch.setattr(scheduler, 'get_jitter', lambda: 100)
+    keylist.last_checked = now - datetime.timedelta(hours=12) + datetime.timedelta(seconds=600)
+    assert scheduler.seconds_until_next_sync([keylist], now) == 700
+
+    # Overdue keylists don't make it wake up more than once a minute
+    keylist.last_checked = None
+    monkeypatch.setattr(scheduler, 'get_jitter', lambda: 0)
+    assert scheduler.seconds_until_next_sync([keylist], now) == Scheduler.MIN_SLEEP
+
+    # Syncing keylists get rescheduled when they finish
+    keylist.syncing = True
+    assert scheduler.seconds_until_next_sync([keylist], now) == Scheduler.MAX_SLEEP
+
+
+def test_jitter(common):
+    scheduler = Scheduler(common)
+
+    common.settings.update_interval_hours = b'12'
+    for _ in range(100):
+        assert 0 <= scheduler.get_jitter() <= Scheduler.MAX_JITTER
+
+    # No more than a tenth of the interval
+    common.settings.update_interval_hours = b'0.1'
+    for _ in range(100):
+        assert 0 <= scheduler.get_jitter() <= 36
+
+
+def test_record_result(common, keylist):
+    common.settings.update_interval_hours = b'12'
+    scheduler = Scheduler(common)
+    now = datetime.datetime.now()
+
+    # Skipped syncs don't update the keylist, but aren't retried right away
+    scheduler.record_result(keylist, keylist.result_object('skip'), now)
+    assert not scheduler.is_due(keylist, now)
+    assert scheduler.is_due(keylist, now + datetime.timedelta(seconds=Scheduler.UNFINISHED_RETRY))
+    assert scheduler.due_keylists([keylist], now) == []
+
+    # Backing off, up to FAILED_RETRY
+    scheduler.record_result(keylist, keylist.result_object('cancel'), now)
+    assert not scheduler.is_due(keylist, now + datetime.timedelta(seconds=Scheduler.UNFINISHED_RETRY))
+    assert scheduler.is_due(keylist, now + datetime.timedelta(seconds=Scheduler.UNFINISHED_RETRY * 2))
+    for _ in range(20):
+        scheduler.record_result(keylist, keylist.result_object('skip'), now)
+    assert scheduler.is_due(keylist, now + datetime.timedelta(seconds=Scheduler.FAILED_RETRY))
+
+    # The sleep waits for the retry
+    scheduler.get_jitter = lambda: 0
+    assert scheduler.seconds_until_next_sync([keylist], now) == Scheduler.FAILED_RETRY
+
+    scheduler.record_result(keylist, keylist.result_object('success'), now)
+    assert scheduler.is_due(keylist, now)
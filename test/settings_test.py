@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import tempfile
+import pytest
+
+
+@pytest.fixture
+def settings(common, monkeypatch):
+    settings = common.settings
+    settings.appdata_path = tempfile.mkdtemp()
+
+    # Don't touch the real autostart file
+    configured = []
+
+    def configure_run_automatically():
+        configured.append(settings.run_automatically)
+        settings.configured_run_automatically = settings.run_automatically
+
+    monkeypatch.setattr(settings, 'configure_run_automatically', configure_run_automatically)
+    settings.configured = configured
+    return settings
+
+
+def test_save_is_atomic(settings):
+    settings.fetch_workers = 3
+    assert settings.save()
+
+    filename = os.path.join(settings.appdata_path, 'settings.json')
+    assert json.load(open(filename))['fetch_workers'] == 3
+    assert os.listdir(settings.appdata_path) == ['settings.json']
+
+
+def test_save_later_coalesces(settings, monkeypatch):
+    settings.SAVE_DELAY = 0.1
+    saves = []
+    save = settings.save
+    monkeypatch.setattr(settings, 'save', lambda: saves.append(True) or save())
+
+    for i in range(10):
+        settings.fetch_workers = i
+        settings.save_later()
+    assert saves == []
+
+    time.sleep(0.5)
+    assert saves == [True]
+    assert json.load(open(os.path.join(settings.appdata_path, 'settings.json')))['fetch_workers'] == 9
+
+    # Nothing changed since
+    settings.flush()
+    assert saves == [True]
+
+
+def test_flush(settings):
+    settings.SAVE_DELAY = 60
+    settings.fetch_workers = 5
+    settings.save_later()
+    assert not os.path.exists(os.path.join(settings.appdata_path, 'settings.json'))
+
+    settings.flush()
+    assert json.load(open(os.path.join(settings.appdata_path, 'settings.json')))['fetch_workers'] == 5
+    assert settings.save_timer is None
+    assert not settings.dirty
+
+
+def test_autostart_only_configured_when_changed(settings):
+    settings.configured_run_automatically = settings.run_automatically = True
+    settings.save()
+    settings.save()
+    assert settings.configured == []
+
+    settings.run_automatically = False
+    settings.save()
+    settings.save()
+    assert settings.configured == [False]
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import datetime
+
+from gpgsync.common import Common
+from gpgsync.keylist import Keylist
+from gpgsync.state_db import StateDB
+
+fp = '3B72C32B49CBB5BBDD57440E1D07D43448FB8382'
+fp2 = 'D86B4D4BB5DFDD378B58D4D3F121AC6230396C33'
+
+
+def test_state_db_schema(common, tmpdir):
+    db = StateDB(common, str(tmpdir))
+    assert db.conn.execute('PRAGMA user_version').fetchone()[0] == StateDB.SCHEMA_VERSION
+
+    # Opening it again doesn't break anything
+    db.close()
+    db = StateDB(common, str(tmpdir))
+    assert db.get_key(fp) is None
+
+
+def test_state_db_record_key(common, tmpdir):
+    db = StateDB(common, str(tmpdir))
+
+    db.record_key(fp, 'notfound', '2026-01-01T00:00:00')
+    db.record_key(fp, 'notfound', '2026-01-02T00:00:00')
+    key = db.get_key(fp)
+    assert key['result'] == 'notfound'
+    assert key['last_fetched'] == '2026-01-02T00:00:00'
+    assert key['notfound_count'] == 2
+
+    db.record_key(fp, 'error', '2026-01-03T00:00:00', 'Keyserver error')
+    key = db.get_key(fp)
+    assert key['last_error'] == 'Keyserver error'
+    assert key['notfound_count'] == 0
+
+
+def test_state_db_keylist_membership(common, keylist, tmpdir):
+    db = StateDB(common, str(tmpdir))
+    keylist.fingerprint = fp.encode()
+    keylist.url = b'https://example.com/keylist.json'
+
+    db.record_keylist(keylist, [fp, fp2], '2026-01-01T00:00:00')
+    assert db.get_keylist_fingerprints(keylist) == [fp, fp2]
+    assert db.get_fingerprint_keylists(fp2) == [db.get_keylist_id(keylist)]
+
+    # Keys that are removed from the keylist are forgotten
+    db.record_keylist(keylist, [fp], '2026-01-02T00:00:00')
+    assert db.get_keylist_fingerprints(keylist) == [fp]
+    assert db.get_fingerprint_keylists(fp2) == []
+
+
+def test_state_db_keylist_status(common, keylist, tmpdir):
+    db = StateDB(common, str(tmpdir))
+    keylist.fingerprint = fp.encode()
+    keylist.url = b'https://example.com/keylist.json'
+    keylist.last_checked = datetime.datetime(2026, 1, 1)
+    keylist.error = 'Error connecting to keyserver'
+    db.save_keylist_status(keylist)
+
+    # Recording membership doesn't forget the status
+    db.record_keylist(keylist, [fp], '2026-01-02T00:00:00')
+
+    common.settings.keylists = [Keylist(common).load({'fingerprint': fp, 'url': 'https://example.com/keylist.json'})]
+    db.load_keylist_status(common.settings)
+    assert common.settings.keylists[0].last_checked == datetime.datetime(2026, 1, 1)
+    assert common.settings.keylists[0].last_synced == datetime.datetime(2026, 1, 2)
+    assert common.settings.keylists[0].error == 'Error connecting to keyserver'
+
+
+def test_state_db_migrate_settings(common, tmpdir):
+    # Older versions saved the sync status of keylists in settings.json
+    settings_filename = os.path.join(common.settings.get_appdata_path(), 'settings.json')
+    settings = json.load(open(settings_filename))
+    settings['keylists'] = [{
+        'fingerprint': fp,
+        'url': 'https://example.com/keylist.json',
+        'keyserver': 'hkps://keys.openpgp.org',
+        'use_proxy': False,
+        'proxy_host': '127.0.0.1',
+        'proxy_port': '9050',
+        'last_checked': '2026-01-01T00:00:00',
+        'last_synced': '2026-01-01T00:00:00',
+        'last_failed': None,
+        'error': None,
+        'warning': 'Fingerprints not found: {}'.format(fp2)
+    }]
+    json.dump(settings, open(settings_filename, 'w'))
+
+    common = Common(verbose=True)
+    assert common.settings.keylists[0].last_synced == datetime.datetime(2026, 1, 1)
+    assert 'last_synced' not in json.load(open(settings_filename))['keylists'][0]
+
+    # The status now comes from the database
+    common = Common(verbose=True)
+    assert common.settings.keylists[0].last_synced == datetime.datetime(2026, 1, 1)
+    assert common.settings.keylists[0].warning == 'Fingerprints not found: {}'.format(fp2)
+
+
+def test_state_db_authority_keys(common, tmpdir):
+    db = StateDB(common, str(tmpdir))
+    assert db.get_authority_key_validated(fp) is None
+
+    db.record_authority_key_validated(fp, '2026-01-01T00:00:00')
+    db.close()
+    db = StateDB(common, str(tmpdir))
+    assert db.get_authority_key_validated(fp) == '2026-01-01T00:00:00'
+
+    db.record_authority_key_validated(fp, None)
+    assert db.get_authority_key_validated(fp) is None
+
+
+def test_state_db_shared_between_processes(common, tmpdir):
+    # Like the GUI and a cron --sync using the same database
+    db = StateDB(common, str(tmpdir))
+    other_db = StateDB(common, str(tmpdir))
+    other_db.conn.execute('PRAGMA busy_timeout = 100')
+
+    # Writes don't hold the database locked until the end of the sync
+    db.record_key(fp, 'success', '2026-01-01T00:00:00')
+    other_db.record_key(fp2, 'success', '2026-01-01T00:00:00')
+    db.set_key_hash(fp, 'abc')
+    other_db.record_authority_key_validated(fp, '2026-01-01T00:00:00')
+
+    assert other_db.get_key(fp)['result'] == 'success'
+    assert db.get_key(fp2)['result'] == 'success'
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import time
+import queue
+import threading
+
+from gpgsync.keylist import Keylist
+from gpgsync.sync_pool import SyncPool
+
+
+def test_sync_pool_limits_concurrent_syncs(common, monkeypatch):
+    common.settings.max_concurrent_syncs = 2
+    sync_pool = SyncPool(common)
+
+    lock = threading.Lock()
+    running = [0]
+    max_running = [0]
+
+    def refresh(common, cancel_q, keylist, force=False):
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return keylist.result_object('success')
+
+    monkeypatch.setattr(Keylist, 'refresh', staticmethod(refresh))
+
+    futures = [sync_pool.submit(Keylist(common), queue.Queue()) for _ in range(6)]
+    assert [future.result()['type'] for future in futures] == ['success'] * 6
+    assert max_running[0] == 2
+
+
+def test_sync_pool_canceled_while_waiting(common, monkeypatch):
+    refreshed = []
+    monkeypatch.setattr(Keylist, 'refresh', staticmethod(lambda common, cancel_q, keylist, force=False: refreshed.append(keylist)))
+
+    keylist = Keylist(common)
+    cancel_q = queue.Queue()
+    cancel_q.put(True)
+
+    assert common.sync_pool.submit(keylist, cancel_q).result()['type'] == 'cancel'
+    assert refreshed == []
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from gpgsync.keyring import KeyringIndex
+from gpgsync.state_db import StateDB
+from gpgsync.sync_state import SyncState
+
+fp = '3B72C32B49CBB5BBDD57440E1D07D43448FB8382'
+
+
+# Build a KeyringIndex that contains the given fingerprints
+def keyring(*fingerprints, expires=None):
+    listing = []
+    for fingerprint in fingerprints:
+        expires_str = str(int(expires.timestamp())) if expires else ''
+        listing.append('pub:-:4096:1:{}:1474591596:{}::-:::scESC::::::23::0:'.format(fingerprint[-16:], expires_str))
+        listing.append('fpr:::::::::{}:'.format(fingerprint))
+    return KeyringIndex('\n'.join(listing).encode())
+
+
+def test_sync_state_new_key_is_due(common):
+    assert common.sync_state.is_due(fp, keyring(fp))
+
+
+def test_sync_state_recently_fetched_is_not_due(common):
+    common.sync_state.record(fp, SyncState.RESULT_SUCCESS)
+    assert not common.sync_state.is_due(fp, keyring(fp))
+
+
+def test_sync_state_missing_from_keyring_is_due(common):
+    common.sync_state.record(fp, SyncState.RESULT_SUCCESS)
+    assert common.sync_state.is_due(fp, keyring())
+
+
+def test_sync_state_error_is_due(common):
+    common.sync_state.record(fp, SyncState.RESULT_ERROR)
+    assert common.sync_state.is_due(fp, keyring(fp))
+
+
+def test_sync_state_expiring_is_due(common):
+    common.sync_state.record(fp, SyncState.RESULT_SUCCESS)
+    expires = datetime.datetime.now() + datetime.timedelta(days=2)
+    assert common.sync_state.is_due(fp, keyring(fp, expires=expires))
+
+    expires = datetime.datetime.now() + datetime.timedelta(days=365)
+    assert not common.sync_state.is_due(fp, keyring(fp, expires=expires))
+
+
+def test_sync_state_old_fetch_is_due(common):
+    common.sync_state.record(fp, SyncState.RESULT_SUCCESS)
+    last_fetched = datetime.datetime.now() - datetime.timedelta(hours=float(common.settings.key_refresh_age_hours) + 1)
+    common.state_db.record_key(fp, SyncState.RESULT_SUCCESS, last_fetched.isoformat())
+    assert common.sync_state.is_due(fp, keyring(fp))
+
+
+def test_sync_state_persists(common):
+    common.sync_state.record(fp, SyncState.RESULT_SUCCESS)
+    common.sync_state.save()
+
+    sync_state = SyncState(common, StateDB(common, common.state_db.appdata_path))
+    assert not sync_state.is_due(fp, keyring(fp))
+
+
+def test_refresh_build_fingerprints_lists_incremental(keylist, monkeypatch):
+    fp_new = 'D86B4D4BB5DFDD378B58D4D3F121AC6230396C33'
+    keylist.c.sync_state.record(fp, SyncState.RESULT_SUCCESS)
+
+    monkeypatch.setattr(keylist.c.gpg, 'test_key', lambda fp: None)
+    monkeypatch.setattr(keylist.c.gpg, 'get_default_keyring_index', lambda: keyring(fp, fp_new))
+
+    fingerprints_to_fetch, invalid_fingerprints = keylist.refresh_build_fingerprints_lists([fp, fp_new])
+    assert fingerprints_to_fetch == [fp_new]
+
+    # Forced syncs fetch everything
+    fingerprints_to_fetch, invalid_fingerprints = keylist.refresh_build_fingerprints_lists([fp, fp_new], force=True)
+    assert fingerprints_to_fetch == [fp, fp_new]
+
+
+def test_sync_state_notfound_backoff(common):
+    common.settings.notfound_max_backoff_hours = 4
+
+    # Just not found, so it's cached
+    common.sync_state.record(fp, SyncState.RESULT_NOTFOUND)
+    assert common.sync_state.is_notfound_cached(fp)
+    assert not common.sync_state.is_due(fp, keyring())
+
+    # The backoff doubles each time, up to the maximum
+    assert common.sync_state.get_notfound_backoff(1) == datetime.timedelta(hours=1)
+    assert common.sync_state.get_notfound_backoff(2) == datetime.timedelta(hours=2)
+    assert common.sync_state.get_notfound_backoff(10) == datetime.timedelta(hours=4)
+    assert common.sync_state.get_notfound_backoff(1000) == datetime.timedelta(hours=4)
+
+    # Not found again a while ago, so it's due again once the backoff is over
+    last_fetched = datetime.datetime.now() - datetime.timedelta(hours=1)
+    common.state_db.record_key(fp, SyncState.RESULT_NOTFOUND, last_fetched.isoformat())
+    assert common.state_db.get_key(fp)['notfound_count'] == 2
+    assert common.sync_state.is_notfound_cached(fp)
+    last_fetched = datetime.datetime.now() - datetime.timedelta(hours=5)
+    common.state_db.record_key(fp, SyncState.RESULT_NOTFOUND, last_fetched.isoformat())
+    assert not common.sync_state.is_notfound_cached(fp)
+    assert common.sync_state.is_due(fp, keyring())
+
+    # Found again
+    common.sync_state.record(fp, SyncState.RESULT_SUCCESS)
+    assert not common.sync_state.is_notfound_cached(fp)
+
+
+def test_refresh_cached_notfound_fingerprints(keylist, monkeypatch):
+    fp_notfound = 'D86B4D4BB5DFDD378B58D4D3F121AC6230396C33'
+    keylist.c.sync_state.record(fp, SyncState.RESULT_SUCCESS)
+    keylist.c.sync_state.record(fp_notfound, SyncState.RESULT_NOTFOUND)
+
+    monkeypatch.setattr(keylist.c.gpg, 'test_key', lambda fp: None)
+    monkeypatch.setattr(keylist.c.gpg, 'get_default_keyring_index', lambda: keyring(fp))
+
+    fingerprints_to_fetch, invalid_fingerprints = keylist.refresh_build_fingerprints_lists([fp, fp_notfound])
+    assert fingerprints_to_fetch == []
+    assert keylist.refresh_cached_notfound_fingerprints([fp, fp_notfound], fingerprints_to_fetch, invalid_fingerprints) == [fp_notfound]
+
+    # Forced syncs look everything up
+    fingerprints_to_fetch, invalid_fingerprints = keylist.refresh_build_fingerprints_lists([fp, fp_notfound], force=True)
+    assert fingerprints_to_fetch == [fp, fp_notfound]
+    assert keylist.refresh_cached_notfound_fingerprints([fp, fp_notfound], fingerprints_to_fetch, invalid_fingerprints) == []